@@ -1,308 +1,808 @@
 import logging
-from homeassistant.helpers.storage import Store
-from homeassistant.helpers.event import async_call_later
-from .const import DOMAIN, DATA_ICA
-from homeassistant.helpers import entity_registry
-
-from .ica_api import ICAApi
+import time
+from datetime import timedelta
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import async_track_state_change_event
+import voluptuous as vol
+import asyncio
+from .const import (
+    ACCOUNT_OPTIONS,
+    DOMAIN,
+    DATA_ICA,
+    ICA_WRITE_CONCURRENCY,
+    KEEP_WRITE_CONCURRENCY,
+    LIST_CACHE_SECONDS,
+    MAX_ICA_ITEMS,
+    POLL_FAST_SECONDS,
+    POLL_IDLE_MINUTES,
+    SYNC_STATS_HISTORY,
+)
+
+from .coordinator import ICAListCoordinator, ICAPurchaseCoordinator
+from .ica_api import ICAApi, session_hash
+from .metrics import SyncProfiler
+from .outbox import Outbox
+from .purchases import PurchaseHistory
+from .reconcile import (
+    keep_fingerprint,
+    list_after,
+    list_fingerprint,
+    normalize,
+    plan_bulk_add,
+    plan_bulk_remove,
+    plan_keep_to_ica,
+    plan_operations,
+    plan_refresh,
+    plan_three_way,
+    synced_snapshot,
+)
+from .sync_queue import OP_ADD, OP_COMPLETE, OP_REMOVE, OperationLog, SyncDebouncer
+from .sync_state import SyncState
 
 _LOGGER = logging.getLogger(__name__)
 
-async def _trigger_sensor_update(hass, list_id):
-    registry = entity_registry.async_get(hass)  # ✅ utan await
-    target_unique_id = f"shoppinglist_{list_id}"
-    sensor_entity = None
+MAX_KEEP_ITEMS = 100
+DEBOUNCE_SECONDS = 1
+DEBOUNCE_MAX_WAIT_SECONDS = 10
+COMPLETION_WINDOW_SECONDS = 0.5
+KEEP_SERVICES = frozenset({"add_item", "remove_item", "update_item"})
 
-    for entity in registry.entities.values():
-        if entity.unique_id == target_unique_id:
-            sensor_entity = entity.entity_id
-            break
+REFRESH_SCHEMA = vol.Schema({
+    vol.Optional("list_id"): cv.string,
+    vol.Optional("dry_run", default=False): cv.boolean,
+})
 
-    if not sensor_entity:
-        _LOGGER.debug("ℹ️ Kunde inte hitta sensor med unique_id %s", target_unique_id)
-        return
+SYNC_STATS_SCHEMA = vol.Schema({
+    vol.Optional("list_id"): cv.string,
+})
 
-    _LOGGER.debug("🔁 Triggar update för %s", sensor_entity)
-    await hass.services.async_call(
-        "homeassistant", "update_entity",
-        {"entity_id": sensor_entity},
-        blocking=True
-    )
-
-STORAGE_VERSION = 1
-STORAGE_KEY = "ica_keep_synced_list"
-MAX_ICA_ITEMS = 250
-MAX_KEEP_ITEMS = 100
-DEBOUNCE_SECONDS = 1
+ITEMS_SCHEMA = vol.Schema({
+    vol.Optional("list_id"): cv.string,
+    vol.Required("items"): vol.All(cv.ensure_list, [cv.string]),
+})
 
 async def async_setup(hass, config):
+    hass.data.setdefault(DOMAIN, {})
+
+    async def handle_refresh(call):
+        """Kör refresh för alla entries, eller bara den med angivet list_id.
+
+        Med dry_run räknas planen ut men inget ändras; svarsdata innehåller
+        då planen per lista, annars statistiken för cykeln. Listorna hämtas
+        en gång per konto innan entryna stäms av var för sig.
+        """
+        list_id = call.data.get("list_id")
+        dry_run = call.data["dry_run"]
+        entries = [
+            data
+            for data in _loaded_entries(hass)
+            if not list_id or data["list_id"] == list_id
+        ]
+        fetched_since = time.monotonic()
+        accounts = {id(data["coordinator"]): data for data in entries}
+        await asyncio.gather(*(
+            data["coordinator"].async_fetch_list(data["list_id"], max_age=0)
+            for data in accounts.values()
+        ))
+        results = await asyncio.gather(*(
+            data["refresh"](dry_run, fetched_since=fetched_since) for data in entries
+        ))
+        if call.return_response:
+            return {"lists": {data["list_id"]: result for data, result in zip(entries, results)}}
+        return None
+
+    async def handle_sync_stats(call):
+        """Senaste synkcyklerna per lista som svarsdata."""
+        list_id = call.data.get("list_id")
+        return {
+            "lists": {
+                data["list_id"]: {**data["profiler"].as_dict(), "outbox_pending": len(data["outbox"])}
+                for data in _loaded_entries(hass)
+                if not list_id or data["list_id"] == list_id
+            }
+        }
+
+    def target_entry(call):
+        """Entryn för list_id; utan list_id måste exakt en lista vara konfigurerad."""
+        list_id = call.data.get("list_id")
+        entries = [
+            data
+            for data in _loaded_entries(hass)
+            if not list_id or data["list_id"] == list_id
+        ]
+        if not entries or (not list_id and len(entries) > 1):
+            raise ServiceValidationError(
+                f"Ange list_id för en konfigurerad ICA-lista ({len(entries)} matchar)"
+            )
+        return entries[0]
+
+    async def handle_add_items(call):
+        """Lägg till flera varor i en ICA-lista; resultat per vara som svarsdata."""
+        data = target_entry(call)
+        results = await data["add_items"](call.data["items"])
+        return {"list_id": data["list_id"], "items": results} if call.return_response else None
+
+    async def handle_remove_items(call):
+        """Ta bort flera varor ur en ICA-lista; resultat per vara som svarsdata."""
+        data = target_entry(call)
+        results = await data["remove_items"](call.data["items"])
+        return {"list_id": data["list_id"], "items": results} if call.return_response else None
+
+    hass.services.async_register(
+        DOMAIN, "refresh", handle_refresh, schema=REFRESH_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+    )
+    for service, handler in (("add_items", handle_add_items), ("remove_items", handle_remove_items)):
+        hass.services.async_register(
+            DOMAIN, service, handler, schema=ITEMS_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+        )
+    hass.services.async_register(
+        DOMAIN, "sync_stats", handle_sync_stats, schema=SYNC_STATS_SCHEMA, supports_response=SupportsResponse.ONLY
+    )
     return True
 
+def _loaded_entries(hass):
+    return [
+        hass.data[DOMAIN][entry.entry_id]
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        if entry.entry_id in hass.data.get(DOMAIN, {})
+    ]
+
+@callback
+def _async_acquire_client(hass, entry, session_id):
+    """API-klient och coordinator delas av alla entries med samma session.
+
+    Kontots optioner (ACCOUNT_OPTIONS) som entryn har satt gäller hela
+    den delade klienten, även när den redan fanns.
+    """
+    clients = hass.data[DOMAIN].setdefault(DATA_ICA, {})
+    client = clients.get(session_id)
+    if client is not None:
+        _apply_account_options(client, entry.options)
+    else:
+        api = ICAApi(
+            hass,
+            session_id=session_id,
+            write_concurrency=entry.options.get("write_concurrency", ICA_WRITE_CONCURRENCY),
+            list_cache_seconds=entry.options.get("list_cache_seconds", LIST_CACHE_SECONDS),
+        )
+        client = clients[session_id] = {
+            "api": api,
+            "coordinator": ICAListCoordinator(
+                hass,
+                api,
+                fast_interval=timedelta(seconds=entry.options.get("poll_fast_seconds", POLL_FAST_SECONDS)),
+                idle_interval=timedelta(minutes=entry.options.get("poll_idle_minutes", POLL_IDLE_MINUTES)),
+            ),
+            "entries": set(),
+        }
+    client["entries"].add(entry.entry_id)
+    return client
+
+@callback
+def _apply_account_options(client, options):
+    api = client["api"]
+    coordinator = client["coordinator"]
+    if "write_concurrency" in options:
+        api.write_concurrency = max(1, int(options["write_concurrency"]))
+    if "list_cache_seconds" in options:
+        api.list_cache_seconds = options["list_cache_seconds"]
+    if "poll_fast_seconds" in options:
+        coordinator.fast_interval = timedelta(seconds=options["poll_fast_seconds"])
+    if "poll_idle_minutes" in options:
+        coordinator.idle_interval = timedelta(minutes=options["poll_idle_minutes"])
+    coordinator.idle_interval = max(coordinator.idle_interval, coordinator.fast_interval)
+
+async def _async_purchase_coordinator(hass, client, session_id):
+    """Köphistoriken skapas först när någon entry vill ha köpsensorerna."""
+    coordinator = client.get("purchases")
+    if coordinator is not None:
+        return coordinator, False
+    # Cachen sparas per konto; filnamnet ska inte avslöja session-id:t
+    history = PurchaseHistory(hass, session_hash(session_id))
+    coordinator = client["purchases"] = ICAPurchaseCoordinator(hass, client["api"], history)
+    await history.async_load()
+    coordinator.async_seed()
+    return coordinator, True
+
+@callback
+def _async_release_client(hass, entry_id, session_id, list_id):
+    clients = hass.data[DOMAIN].get(DATA_ICA, {})
+    client = clients.get(session_id)
+    if client is None:
+        return
+    client["api"].untrack_list(list_id)
+    client["entries"].discard(entry_id)
+    if not client["entries"]:
+        clients.pop(session_id)
+        client["coordinator"].async_cancel_fast_poll()
+        hass.async_create_task(client["api"].async_close())
+
 async def async_setup_entry(hass, entry):
     _LOGGER.debug("⚙️ ICA Shopping initieras via UI config entry")
+    hass.data.setdefault(DOMAIN, {})
     session_id = entry.options.get("session_id", entry.data["session_id"])
     list_id = entry.options.get("ica_list_id", entry.data["ica_list_id"])
-    api = ICAApi(hass, session_id=session_id)
-    hass.data.setdefault(DOMAIN, {})[DATA_ICA] = api
-    hass.data[DOMAIN]["current_list_id"] = list_id  # 🔁 spara aktuellt list ID
     keep_entity = entry.options.get("todo_entity_id", entry.data.get("todo_entity_id"))
     if not keep_entity:
         _LOGGER.error("❌ Ingen todo-entity vald – ICA-integrationen kan inte synka utan en källa.")
         return False
 
- 
-    # --- Keep → ICA debounce sync ---
-    debounce_unsub = None
+    client = _async_acquire_client(hass, entry, session_id)
+    entry.async_on_unload(
+        lambda: _async_release_client(hass, entry.entry_id, session_id, list_id)
+    )
+    api = client["api"]
+    new_list = api.track_list(list_id)
+    # En coordinator per konto matar sensorer, synk och tjänster för alla listor
+    coordinator = client["coordinator"]
+
+    sync_state = SyncState(hass, entry.entry_id, list_id)
+    await sync_state.async_load()
+
+    entry_data = hass.data[DOMAIN][entry.entry_id] = {
+        "api": api,
+        "coordinator": coordinator,
+        "list_id": list_id,  # 🔁 spara aktuellt list ID
+        "sync_state": sync_state,
+        "recent_keep_adds": set(),
+        "recent_keep_removes": set(),
+        "last_fingerprints": None,
+    }
+
+    if entry.options.get("purchase_sensors", False):
+        purchases, created = await _async_purchase_coordinator(hass, client, session_id)
+        entry_data["purchases"] = purchases
+        if created:
+            # Sparade månader syns direkt; saknade månader hämtas i bakgrunden
+            entry.async_create_background_task(
+                hass, purchases.async_refresh(), f"{DOMAIN}_purchases_{entry.entry_id}"
+            )
+
+    # Första entryn, eller en lista som tidigare bara hämtats som id/namn
+    if coordinator.data is None or new_list:
+        if sync_state.last_list is not None:
+            # Sparad lista visas direkt; första hämtningen görs i bakgrunden
+            coordinator.async_seed_list(sync_state.last_list)
+            entry.async_create_background_task(
+                hass, coordinator.async_refresh(), f"{DOMAIN}_first_refresh_{entry.entry_id}"
+            )
+        else:
+            await coordinator.async_refresh()
 
-    async def schedule_sync(_now=None):
-        nonlocal debounce_unsub
-        debounce_unsub = None
-        list_id = entry.options.get("ica_list_id", entry.data.get("ica_list_id"))
-        keep_entity = entry.options.get("todo_entity_id", entry.data.get("todo_entity_id"))
+    @callback
+    def remember_list():
+        the_list = coordinator.get_list(list_id)
+        if the_list is not None and "rows" in the_list:
+            sync_state.remember_list(the_list, coordinator.get_fingerprint(list_id))
 
+    entry.async_on_unload(coordinator.async_add_listener(remember_list))
+    remember_list()
 
-        _LOGGER.debug("🔁 Debounced Keep → ICA sync")
-        try:
-            result = await hass.services.async_call(
-                "todo", "get_items",
-                {"entity_id": keep_entity},
-                blocking=True, return_response=True
-            )
+    # --- Snabbare pollning medan någon är i butiken ---
+    presence_zone = entry.options.get("presence_zone")
+    if presence_zone:
+        coordinator.track_zone(presence_zone)
+        entry.async_on_unload(lambda: coordinator.untrack_zone(presence_zone))
 
-            items = result.get(keep_entity, {}).get("items", [])
-            summaries = [i.get("summary", "").strip() for i in items if isinstance(i, dict)]
-            if len(summaries) > MAX_KEEP_ITEMS:
-                summaries = summaries[:MAX_KEEP_ITEMS]
+        @callback
+        def zone_changed(event):
+            new_state = event.data.get("new_state")
+            if new_state is not None and new_state.state.isdigit() and int(new_state.state) > 0:
+                _LOGGER.debug("🛒 Någon är i %s – pollar ICA tätare", presence_zone)
+                coordinator.async_mark_activity(refresh=True)
 
-            lists = await api.fetch_lists()
-            rows = next((l.get("rows", []) for l in lists if l.get("id") == list_id), [])
-            if len(rows) >= MAX_ICA_ITEMS:
-                _LOGGER.error("🚫 ICA-listan full (%s). Inga varor tillagda.", len(rows))
-                return
+        entry.async_on_unload(async_track_state_change_event(hass, presence_zone, zone_changed))
+
+ 
+    # --- Keep → ICA debounce sync ---
+    oplog = OperationLog()
+    outbox = Outbox(hass, entry.entry_id, list_id)
+    await outbox.async_load()
+    entry_data["outbox"] = outbox
+    profiler = entry_data["profiler"] = SyncProfiler(SYNC_STATS_HISTORY, api.metrics)
+    # Serialiserar allt som skriver till ICA för den här listan: synk, refresh
+    # och bulktjänsterna läser annars samma okvitterade kö och skickar den två gånger
+    write_lock = asyncio.Lock()
+
+    async def sync_from_keep(the_list, skip_keys):
+        """Full synk: läs hela Keep och lägg till det som saknas i ICA."""
+        result = await hass.services.async_call(
+            "todo", "get_items",
+            {"entity_id": keep_entity},
+            blocking=True, return_response=True
+        )
+
+        items = result.get(keep_entity, {}).get("items", [])
+        summaries = [
+            i.get("summary", "").strip()
+            for i in items
+            if isinstance(i, dict)
+            and i.get("status") != "completed"
+            and normalize(i.get("summary")) not in skip_keys
+        ]
+        if len(summaries) > MAX_KEEP_ITEMS:
+            summaries = summaries[:MAX_KEEP_ITEMS]
+
+        rows = the_list.get("rows", [])
+        space = MAX_ICA_ITEMS - len(rows)
+        return plan_keep_to_ica(summaries, rows, space, base=sync_state.base)
+
+    async def drain_outbox(the_list, cycle, to_add=None):
+        """Skicka skrivkön till ICA i en batch mot en och samma snapshot.
+
+        `to_add` ersätter köns tillägg när hela Keep har lästs. Det som
+        misslyckas eller inte får plats i listan ligger kvar i kön till nästa
+        försök, utom det som ICA avvisat för gott (4xx), som stryks ur kön.
+        Anroparen håller
+        `write_lock`.
+        """
+        rows = the_list.get("rows", [])
+        space = MAX_ICA_ITEMS - len(rows)
+        if to_add is not None:
+            await outbox.async_write({normalize(text): (OP_ADD, text) for text in to_add})
+        pending = outbox.take()
+        with cycle.phase("diff"):
+            planned_add, to_remove, deferred = plan_operations(pending, rows, space)
+        if to_add is None:
+            to_add = planned_add
+        else:
+            deferred = []  # hela Keep är läst; det som inte fick plats tas vid nästa refresh
+        cycle.count("outbox", len(pending))
+
+        if to_add and space <= 0:
+            _LOGGER.error("🚫 ICA-listan full (%s). Inga varor tillagda.", len(rows))
+            deferred += [normalize(text) for text in to_add]
+            to_add = []
+        if deferred:
+            _LOGGER.warning("🚫 ICA-listan full – %s tillägg väntar i skrivkön på plats", len(deferred))
+
+        failed = set(deferred)
+        rejected = 0
+        removed_row_ids = []
+        with cycle.phase("write_ica"):
+            removed = await api.remove_items(list(to_remove))
+            results = await api.add_items(list_id, to_add, capacity=space)
+        for row_id, success in removed:
+            text, reason = to_remove[row_id]
+            if success:
+                removed_row_ids.append(row_id)
+                _LOGGER.info("❌ Tog bort '%s' från ICA (baserat på %s)", text, reason)
+            elif success is None:
+                rejected += 1
+                _LOGGER.warning("🚫 ICA avvisade borttagning av '%s' – stryks ur skrivkön", text)
+            else:
+                failed.add(text)
+        sync_state.discard([to_remove[row_id][0] for row_id in removed_row_ids])
+
+        added = []
+        for text, success in results:
+            if success:
+                _LOGGER.info("📥 Lade till '%s' i ICA", text)
+                added.append(text)
+            elif success is None:
+                rejected += 1
+                _LOGGER.warning("🚫 ICA avvisade '%s' – stryks ur skrivkön", text)
+            else:
+                failed.add(normalize(text))
+        sync_state.add(added)
+        cycle.count("ica_remove", len(removed_row_ids))
+        cycle.count("ica_add", len(added))
+        cycle.count("ica_failed", len(failed))
+        cycle.count("ica_rejected", rejected)
+
+        # Allt utom det misslyckade är klart – även sådant som redan stämde i ICA
+        # och sådant som ICA avvisat
+        outbox.ack({key: value for key, value in pending.items() if key not in failed})
+        if failed:
+            _LOGGER.warning("📮 %s ICA-ändringar ligger kvar i skrivkön", len(outbox))
+
+        if added or removed_row_ids:
+            coordinator.async_set_list(list_after(the_list, removed_row_ids, added))
+
+    async def schedule_sync():
+        ops, complete = oplog.drain()
+        if complete and not ops and not outbox:
+            _LOGGER.debug("ℹ️ Inga Keep-ändringar kvar att synka")
+            return
+
+        _LOGGER.debug("🔁 Debounced Keep → ICA sync (%s operationer, komplett: %s)", len(ops), complete)
+        cycle = profiler.start("sync")
+        cycle.count("keep_ops", len(ops))
+        try:
+            # Write-ahead: ändringarna sparas innan något skickas till ICA
+            await outbox.async_write(ops)
+            # En batch mot ICA åt gången: en synk som startar under en pågående
+            # väntar tills kön är kvitterad och läser sedan om listan
+            async with write_lock:
+                with cycle.phase("fetch_ica"):
+                    the_list = await coordinator.async_fetch_list(list_id)
+                if the_list is None:
+                    _LOGGER.warning("❌ Ingen ICA-lista att synka mot – %s ändringar väntar i skrivkön", len(outbox))
+                    if not complete:
+                        oplog.mark_incomplete()
+                    profiler.record(cycle, "no_list")
+                    return
+
+                to_add = None
+                if not complete:
+                    removed_keys = {key for key, (op, _) in outbox.pending().items() if op != OP_ADD}
+                    with cycle.phase("read_keep"):
+                        to_add = await sync_from_keep(the_list, removed_keys)
+                await drain_outbox(the_list, cycle, to_add)
+            profiler.record(cycle)
 
-            existing = [r.get("text", "").strip().lower() for r in rows if isinstance(r, dict)]
-            space = MAX_ICA_ITEMS - len(rows)
-            to_add = [s for s in summaries if s.lower() not in existing][:space]
-            
-            any_added = False
-            for text in to_add:
-                success = await api.add_to_list(list_id, text)
-                if success:
-                    _LOGGER.info("📥 Lade till '%s' i ICA", text)
-                    any_added = True
-
-            if any_added:
-                await _trigger_sensor_update(hass, list_id)
-                    
-                    
         except Exception as e:
+            if not complete:
+                oplog.mark_incomplete()
+            profiler.record(cycle, "error")
             _LOGGER.error("💥 Fel vid sync_keep_to_ica: %s", e)
 
+    debouncer = SyncDebouncer(hass, DEBOUNCE_SECONDS, DEBOUNCE_MAX_WAIT_SECONDS, schedule_sync)
+    entry.async_on_unload(debouncer.async_cancel)
+
+    @callback
+    def retry_outbox():
+        # ICA svarar igen – töm det som väntar från avbrottet
+        if outbox and coordinator.last_update_success:
+            debouncer.async_schedule()
+
+    entry.async_on_unload(coordinator.async_add_listener(retry_outbox))
+    if outbox:
+        debouncer.async_schedule()
+
+    @callback
+    def is_keep_service_call(event_or_data):
+        """Eventfilter: bara todo-anrop mot vår Keep-entity når lyssnaren."""
+        # Äldre HA skickar hela eventet, nyare bara event.data
+        event_data = getattr(event_or_data, "data", event_or_data)
+        if event_data.get("domain") != "todo" or event_data.get("service") not in KEEP_SERVICES:
+            return False
+        entity_ids = event_data.get("service_data", {}).get("entity_id")
+        if isinstance(entity_ids, str):
+            return entity_ids == keep_entity
+        return bool(entity_ids) and keep_entity in entity_ids
+
+    @callback
     def call_service_listener(event):
-        nonlocal debounce_unsub
         data = event.data.get("service_data", {})
         service = event.data.get("service")
+        coordinator.async_mark_activity()
         # Lyssna på "status: completed" via update_item
         if service == "update_item":
             status = data.get("status")
             text = data.get("rename")  # detta är varunamnet
             if status == "completed" and text:
-                item = text.strip().lower()
-                hass.data[DOMAIN].setdefault("recent_keep_removes", set()).add(item)
+                item = normalize(text)
+                entry_data["recent_keep_removes"].add(item)
+                oplog.record(OP_COMPLETE, text)
                 _LOGGER.debug("🟡 Avlyssnad remove via update_item: %s", item)
 
-                # 🆕 Direktborttagning från ICA
-                async def remove_from_ica_direct():
-                    try:
-                        list_id = entry.options.get("ica_list_id", entry.data.get("ica_list_id"))
-                        lists = await api.fetch_lists()
-                        rows = next((l.get("rows", []) for l in lists if l.get("id") == list_id), [])
-                        ica_rows_dict = {
-                            row.get("text", "").strip().lower(): row.get("id")
-                            for row in rows if isinstance(row, dict)
-                        }
-                        row_id = ica_rows_dict.get(item)
-                        if row_id:
-                            await api.remove_item(row_id)
-                            _LOGGER.info("❌ Direkt borttagning av '%s' från ICA (pga completed i Keep)", item)
-                    except Exception as e:
-                        _LOGGER.error("💥 Fel vid direkt ICA-radering: %s", e)
-
-                hass.async_create_task(remove_from_ica_direct())
-
-                # Planera även en sync mot Keep
-                if debounce_unsub:
-                    debounce_unsub()
-                debounce_unsub = async_call_later(hass, DEBOUNCE_SECONDS, schedule_sync)
-      
-        entity_ids = data.get("entity_id", [])
-        keep_entity = entry.options.get("todo_entity_id", entry.data.get("todo_entity_id"))
-        item = data.get("item")
-        if isinstance(item, str):
-            item = item.strip().lower()
-        elif isinstance(item, list) and item:   
-            item = item[0].strip().lower()  # plockar första om flera finns
-        else:
-            item = None
+                # Avbockningar samlas i ett kort fönster och raderas i en batch
+                debouncer.async_schedule(quiet=COMPLETION_WINDOW_SECONDS)
+                return
 
-        if isinstance(entity_ids, str):
-            entity_ids = [entity_ids]
+            # Namnbyte eller återöppnad vara – kräver full läsning av Keep
+            oplog.mark_incomplete()
+            debouncer.async_schedule()
+            return
+
+        items = data.get("item")
+        if isinstance(items, str):
+            items = [items]
+        elif not isinstance(items, list):
+            items = []
+        items = [i for i in items if isinstance(i, str) and normalize(i)]
 
-        if keep_entity not in entity_ids or not item:
+        if not items:
+            oplog.mark_incomplete()
+            debouncer.async_schedule()
             return
 
         # Spåra senaste add/remove från Keep
-        if service == "add_item":
-            hass.data[DOMAIN].setdefault("recent_keep_adds", set()).add(item)
-            _LOGGER.debug("📌 Noterat 'add_item' i Keep: %s", item)
+        for text in items:
+            item = normalize(text)
+            if service == "add_item":
+                entry_data["recent_keep_adds"].add(item)
+                oplog.record(OP_ADD, text)
+                _LOGGER.debug("📌 Noterat 'add_item' i Keep: %s", item)
 
-        elif service == "remove_item":
-            hass.data[DOMAIN].setdefault("recent_keep_removes", set()).add(item)
-            _LOGGER.debug("📌 Noterat 'remove_item' i Keep: %s", item)
+            elif service == "remove_item":
+                entry_data["recent_keep_removes"].add(item)
+                oplog.record(OP_REMOVE, text)
+                _LOGGER.debug("📌 Noterat 'remove_item' i Keep: %s", item)
 
-        if debounce_unsub:
-            debounce_unsub()
-        debounce_unsub = async_call_later(hass, DEBOUNCE_SECONDS, schedule_sync)
+        debouncer.async_schedule()
 
 
-    hass.bus.async_listen("call_service", call_service_listener)
+    entry.async_on_unload(
+        hass.bus.async_listen(
+            "call_service", call_service_listener, event_filter=is_keep_service_call
+        )
+    )
 
-    # --- Registrera refresh-tjänst ---
-    async def handle_refresh(call):
+    # --- Refresh för den här entryn (anropas av tjänsten ica_shopping.refresh) ---
+    async def remove_from_keep(uids):
+        """Ta bort ur Keep i ett anrop; faller tillbaka på ett anrop per uid.
 
-        _LOGGER.debug("🔄 ICA refresh triggered via service")
+        Ett enda uid som hunnit försvinna sedan get_items får annars hela
+        anropet att misslyckas, och då stoppas refreshen innan ICA skrivs.
+        """
         try:
-            remove_striked = entry.options.get("remove_striked", True)
-            keep_entity = entry.options.get("todo_entity_id", entry.data.get("todo_entity_id"))
-            list_id = entry.options.get("ica_list_id", entry.data.get("ica_list_id"))
-            lists = await api.fetch_lists()
-            the_list = next((l for l in lists if l.get("id") == list_id), None)
-            if not the_list:
-                _LOGGER.warning("❌ Kunde inte hitta ICA-lista %s", list_id)
-                return
-                
-            rows = the_list.get("rows", [])
-
-            if remove_striked:
-                checked_rows = [r for r in rows if r.get("isStriked") is True and r.get("id")]
-                for r in checked_rows:
-                    await api.remove_item(r["id"])
-                    _LOGGER.info("🧹 Rensade avbockad vara '%s' från ICA", r.get("text", ""))
-                rows = [r for r in rows if r.get("id") not in [cr["id"] for cr in checked_rows]]
-            
-            
-            if len(rows) >= MAX_ICA_ITEMS:
-                _LOGGER.error("🚫 ICA-listan är full (%s varor). Refresh stoppad.", len(rows))
-                return
-
-            ica_items = [row.get("text", "").strip() for row in rows if isinstance(row, dict)]
-            ica_items_lower = [x.lower() for x in ica_items]
-            ica_rows_dict = {
-                row.get("text", "").strip().lower(): row.get("id")
-                for row in rows if isinstance(row, dict)
-            }
-
+            await hass.services.async_call(
+                "todo", "remove_item",
+                {"entity_id": keep_entity, "item": uids},
+                blocking=True,
+            )
+            return
+        except HomeAssistantError as e:
+            _LOGGER.debug("ℹ️ Borttagning ur Keep i ett anrop misslyckades (%s) – tar en i taget", e)
+        for uid in uids:
+            try:
+                await hass.services.async_call(
+                    "todo", "remove_item",
+                    {"entity_id": keep_entity, "item": uid},
+                    blocking=True,
+                )
+            except HomeAssistantError as e:
+                _LOGGER.warning("⚠️ Kunde inte ta bort '%s' ur Keep: %s", uid, e)
+
+    async def run_refresh(cycle, dry_run, max_age=0):
+        """Själva refreshen. Returnerar (resultat, plan); planen bara vid dry run.
+
+        `max_age` låter en lista som hämtats för hela kontot nyss räcka.
+        """
+        remove_striked = entry.options.get("remove_striked", True)
+        if outbox and not dry_run:
+            # Väntande ändringar först, så att avstämningen ser dem i ICA
+            with cycle.phase("fetch_ica"):
+                pending_list = await coordinator.async_fetch_list(list_id, max_age=max_age)
+            if pending_list:
+                await drain_outbox(pending_list, cycle)
+            max_age = 0  # efter skrivningarna krävs en ny läsning
+        with cycle.phase("fetch_ica"):
+            the_list = await coordinator.async_fetch_list(list_id, max_age=max_age)
+        if not the_list:
+            _LOGGER.warning("❌ Kunde inte hitta ICA-lista %s", list_id)
+            return "no_list", None
+
+        rows = the_list.get("rows", [])
+        cycle.count("ica_rows", len(rows))
+
+        removed_striked = []
+        checked_rows = {}
+        if remove_striked:
+            checked_rows = {r["id"]: r for r in rows if r.get("isStriked") is True and r.get("id")}
+            if not dry_run:
+                with cycle.phase("write_ica"):
+                    results = await api.remove_items(list(checked_rows))
+                for row_id, success in results:
+                    if success:
+                        removed_striked.append(row_id)
+                        _LOGGER.info("🧹 Rensade avbockad vara '%s' från ICA", checked_rows[row_id].get("text", ""))
+                cycle.count("ica_remove_striked", len(removed_striked))
+            rows = [r for r in rows if r.get("id") not in checked_rows]
+
+        if len(rows) >= MAX_ICA_ITEMS:
+            _LOGGER.error("🚫 ICA-listan är full (%s varor). Refresh stoppad.", len(rows))
+            return "list_full", None
+
+        with cycle.phase("read_keep"):
             result = await hass.services.async_call(
                 "todo", "get_items",
                 {"entity_id": keep_entity},
                 blocking=True, return_response=True
             )
-            keep_items = result.get(keep_entity, {}).get("items", [])
-            keep_summaries = [i.get("summary", "").strip() for i in keep_items if isinstance(i, dict)]
-            keep_lower = [x.lower() for x in keep_summaries]
-
-
-            # 1️⃣ Hitta completed-items i Keep som fortfarande finns i ICA
-            keep_completed = [
-                i.get("summary", "").strip().lower()
-                for i in keep_items
-                if i.get("status") == "completed"
-            ]
-
-
-            # ❌ Radera completed från Keep – endast om remove_striked är aktivt
-            if remove_striked:
-                for text in keep_completed:
-                    await hass.services.async_call(
-                        "todo", "remove_item",
-                        {"entity_id": keep_entity, "item": text}
-                    )
-                    _LOGGER.info("🧹 Tog bort '%s' från Keep (pga status: completed + remove_striked)", text)
-
-
-            # 2️⃣ Lägg till dem i listan att radera från ICA
-            for text in keep_completed:
-                row_id = ica_rows_dict.get(text)
-                if row_id:
-                    await api.remove_item(row_id)
-                    _LOGGER.info("❌ Tog bort '%s' från ICA (baserat på Keep: completed)", text)
-
+        keep_items = result.get(keep_entity, {}).get("items", [])
+        cycle.count("keep_items", len(keep_items))
+
+        # Hämta senaste ändringar från Keep
+        recent_removes = entry_data["recent_keep_removes"]
+
+        # Oförändrat på båda sidor sedan en refresh utan åtgärder → ingen diff
+        fingerprints = (
+            list_fingerprint({**the_list, "rows": rows}),
+            keep_fingerprint(keep_items),
+        )
+        if not dry_run and fingerprints == entry_data["last_fingerprints"] and not recent_removes:
+            _LOGGER.debug("⏭️ ICA och Keep oförändrade sedan senaste refresh – hoppar över diff")
+            if removed_striked:
+                coordinator.async_set_list(list_after(the_list, removed_striked))
+            return "unchanged", None
+
+        with cycle.phase("diff"):
+            if sync_state.base is not None:
+                plan = plan_three_way(
+                    sync_state.base,
+                    rows,
+                    keep_items,
+                    remove_striked=remove_striked,
+                    max_keep_add=MAX_ICA_ITEMS - len(keep_items),
+                    ica_space=MAX_ICA_ITEMS - len(rows),
+                )
+            else:
+                # Ingen sparad bas ännu – ICA styr, utom nyss borttaget i Keep
+                plan = plan_refresh(
+                    rows,
+                    keep_items,
+                    recent_removes=recent_removes,
+                    remove_striked=remove_striked,
+                    max_keep_add=MAX_ICA_ITEMS - len(keep_items),
+                )
+        for key in plan.skipped:
+            _LOGGER.debug("⛔ Hoppar över '%s' – finns i recent_removes", key)
+
+        if dry_run:
+            planned = plan.as_dict()
+            planned["ica_remove_striked"] = [r.get("text", "") for r in checked_rows.values()]
+            planned["outbox"] = [{"op": op, "text": text} for op, text in outbox.pending().values()]
+            planned["three_way"] = sync_state.base is not None
+            _LOGGER.info(
+                "🧪 Dry run för lista %s: %s",
+                list_id,
+                {key: len(value) for key, value in planned.items() if isinstance(value, list)},
+            )
+            return "dry_run", planned
 
+        entry_data["last_fingerprints"] = fingerprints if plan.is_empty else None
 
+        # ❌ Completed (om remove_striked) och sådant som inte finns i ICA
+        # tas bort ur Keep i ett enda anrop, per uid från get_items
+        if plan.keep_remove_uids:
+            with cycle.phase("write_keep"):
+                await remove_from_keep(plan.keep_remove_uids)
+            for text in plan.keep_remove_completed:
+                _LOGGER.info("🧹 Tog bort '%s' från Keep (pga status: completed + remove_striked)", text)
+            for summary in plan.keep_remove:
+                _LOGGER.info("🗑️ Tagit bort '%s' från Keep", summary)
 
-            # Hämta senaste ändringar från Keep
-            recent_adds = hass.data[DOMAIN].setdefault("recent_keep_adds", set())
-            recent_removes = hass.data[DOMAIN].setdefault("recent_keep_removes", set())
+        # Lägg till i Keep det som saknas i Keep, och som INTE nyss tagits bort
+        keep_writes = asyncio.Semaphore(KEEP_WRITE_CONCURRENCY)
 
-            # Lägg till i Keep det som saknas i Keep, och som INTE nyss tagits bort
-            to_add = []
-            for item in ica_items:
-                key = item.lower()
-                if key not in keep_lower and key not in recent_removes:
-                    _LOGGER.debug("➕ Planerar att lägga till i Keep: %s", item)
-                    to_add.append(item)
-                else:
-                    _LOGGER.debug("⛔ Hoppar över '%s' – finns i recent_removes eller redan i Keep", item)
-
-            
-            max_add = MAX_ICA_ITEMS - len(keep_items)
-            to_add = to_add[:max_add]
-
-            for item in to_add:
+        async def add_to_keep(item):
+            async with keep_writes:
                 await hass.services.async_call(
                     "todo", "add_item",
-                    {"entity_id": keep_entity, "item": item}
+                    {"entity_id": keep_entity, "item": item},
+                    blocking=True,
                 )
-                _LOGGER.info("✅ Lagt till '%s' i Keep", item)
-
-            # Ta bort från Keep det som inte finns i ICA
-            to_remove_from_keep = [
-                i.get("summary") for i in keep_items
-                if i.get("summary", "").strip().lower() not in ica_items_lower
-            ]
-
-            for summary in to_remove_from_keep:
-                if summary:
-                    await hass.services.async_call(
-                        "todo", "remove_item",
-                        {"entity_id": keep_entity, "item": summary}
-                    )
-                    _LOGGER.info("🗑️ Tagit bort '%s' från Keep", summary)
-
-            # Ta bort från ICA om det just tagits bort i Keep
-            to_remove_from_ica = [item for item in recent_removes if item in ica_rows_dict]
-
-            for text in to_remove_from_ica:
-                row_id = ica_rows_dict.get(text)
-                if row_id:
-                    await api.remove_item(row_id)
-                    _LOGGER.info("❌ Tog bort '%s' från ICA (baserat på Keep-radering)", text)
-
-            # Uppdatera sensor
-            await _trigger_sensor_update(hass, list_id)
-
-            # Rensa eventspårning efter allt är klart
-            if "recent_keep_adds" in hass.data[DOMAIN]:
-                hass.data[DOMAIN]["recent_keep_adds"].clear()
-            if "recent_keep_removes" in hass.data[DOMAIN]:
-                hass.data[DOMAIN]["recent_keep_removes"].clear()
-
-
+            _LOGGER.info("✅ Lagt till '%s' i Keep", item)
+
+        with cycle.phase("write_keep"):
+            await asyncio.gather(*(add_to_keep(item) for item in plan.keep_add))
+        cycle.count("keep_remove", len(plan.keep_remove_uids))
+        cycle.count("keep_add", len(plan.keep_add))
+
+        # Ta bort från ICA det som är completed eller just tagits bort i Keep,
+        # och lägg till det som lagts till i Keep sedan senaste synk
+        ica_deletes = plan.ica_remove
+        with cycle.phase("write_ica"):
+            removed = await api.remove_items(list(ica_deletes))
+            added = await api.add_items(list_id, plan.ica_add, capacity=MAX_ICA_ITEMS - len(rows))
+
+        removed_row_ids = []
+        for row_id, success in removed:
+            if success:
+                text, reason = ica_deletes[row_id]
+                removed_row_ids.append(row_id)
+                _LOGGER.info("❌ Tog bort '%s' från ICA (baserat på %s)", text, reason)
+
+        ica_added = []
+        for text, success in added:
+            if success:
+                ica_added.append(text)
+                _LOGGER.info("📥 Lade till '%s' i ICA", text)
+        cycle.count("ica_remove", len(removed_row_ids))
+        cycle.count("ica_add", len(ica_added))
+
+        sync_state.replace(synced_snapshot(
+            rows,
+            keep_items,
+            removed_row_ids,
+            ica_added,
+            keep_added=plan.keep_add,
+            keep_removed=plan.keep_remove_uids,
+        ))
+
+        # Uppdatera sensor
+        coordinator.async_set_list(
+            list_after(the_list, removed_striked + removed_row_ids, ica_added)
+        )
+
+        # Rensa eventspårning efter allt är klart
+        entry_data["recent_keep_adds"].clear()
+        entry_data["recent_keep_removes"].clear()
+        return "ok", None
+
+    async def handle_refresh(dry_run=False, fetched_since=None):
+        """Refresh för tjänsten. Returnerar cykelns statistik, och planen vid dry run.
+
+        Med `fetched_since` duger en lista som hämtats efter den tidpunkten.
+        """
+        _LOGGER.debug("🔄 ICA refresh triggered via service för lista %s", list_id)
+        cycle = profiler.start("dry_run" if dry_run else "refresh")
+        try:
+            async with write_lock:
+                max_age = 0 if fetched_since is None else time.monotonic() - fetched_since
+                result, plan = await run_refresh(cycle, dry_run, max_age)
         except Exception as e:
             _LOGGER.error("💥 Fel vid refresh: %s", e)
+            result, plan = "error", None
+        profiler.record(cycle, result)
+        response = cycle.as_dict()
+        if plan is not None:
+            response["plan"] = plan
+        return response
+
+    entry_data["refresh"] = handle_refresh
+
+    # --- Bulktjänsterna ica_shopping.add_items / remove_items ---
+    async def add_items(texts):
+        """Lägg till det som saknas i ICA i en batch; resultat per text."""
+        async with write_lock:
+            cycle = profiler.start("add_items")
+            with cycle.phase("fetch_ica"):
+                the_list = await coordinator.async_fetch_list(list_id)
+            if the_list is None:
+                profiler.record(cycle, "no_list")
+                return [{"item": text, "result": "failed"} for text in texts]
+            rows = the_list.get("rows", [])
+            space = MAX_ICA_ITEMS - len(rows)
+            to_add, results = plan_bulk_add(texts, rows, space)
+
+            with cycle.phase("write_ica"):
+                outcome = dict(await api.add_items(list_id, to_add, capacity=space))
+            added = [text for text in to_add if outcome.get(text)]
+            for text in added:
+                _LOGGER.info("📥 Lade till '%s' i ICA (add_items)", text)
+            cycle.count("ica_add", len(added))
+            cycle.count("ica_failed", len(to_add) - len(added))
+            if added:
+                coordinator.async_set_list(list_after(the_list, [], added))
+            profiler.record(cycle)
+
+            return [
+                {
+                    "item": text,
+                    "result": result or ("added" if outcome.get(text.strip()) else "failed"),
+                }
+                for text, result in zip(texts, results)
+            ]
 
-
-    hass.services.async_register(DOMAIN, "refresh", handle_refresh)
+    async def remove_items(texts):
+        """Radera alla rader med de angivna texterna i en batch; resultat per text."""
+        async with write_lock:
+            cycle = profiler.start("remove_items")
+            with cycle.phase("fetch_ica"):
+                the_list = await coordinator.async_fetch_list(list_id)
+            if the_list is None:
+                profiler.record(cycle, "no_list")
+                return [{"item": text, "result": "failed"} for text in texts]
+            to_remove, results = plan_bulk_remove(texts, the_list.get("rows", []))
+
+            row_ids = [row_id for ids in to_remove.values() for row_id in ids]
+            with cycle.phase("write_ica"):
+                outcome = dict(await api.remove_items(row_ids))
+            removed_row_ids = [row_id for row_id in row_ids if outcome.get(row_id)]
+            cycle.count("ica_remove", len(removed_row_ids))
+            cycle.count("ica_failed", len(row_ids) - len(removed_row_ids))
+            if removed_row_ids:
+                coordinator.async_set_list(list_after(the_list, removed_row_ids))
+            profiler.record(cycle)
+
+            response = []
+            for text, result in zip(texts, results):
+                if result is None:
+                    ok = all(outcome.get(row_id) for row_id in to_remove[normalize(text)])
+                    result = "removed" if ok else "failed"
+                    if ok:
+                        _LOGGER.info("❌ Tog bort '%s' från ICA (remove_items)", text)
+                response.append({"item": text, "result": result})
+            return response
+
+    entry_data["add_items"] = add_items
+    entry_data["remove_items"] = remove_items
 
     # --- Ladda sensorer (korrekt sätt) ---
     await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
@@ -312,15 +812,31 @@ async def async_setup_entry(hass, entry):
 
     return True
 
+async def async_unload_entry(hass, entry):
+    unload_ok = await hass.config_entries.async_unload_platforms(entry, ["sensor"])
+    if unload_ok:
+        hass.data[DOMAIN].pop(entry.entry_id, None)
+    return unload_ok
+
 async def _options_update_listener(hass, entry):
     _LOGGER.debug("♻️ Optioner har ändrats, laddar om entry")
 
-    prev_list_id = hass.data[DOMAIN].get("current_list_id")
+    prev_list_id = hass.data[DOMAIN].get(entry.entry_id, {}).get("list_id")
     new_list_id = entry.options.get("ica_list_id", entry.data.get("ica_list_id"))
 
     if prev_list_id and prev_list_id != new_list_id:
         _LOGGER.warning("⚠️ List ID changed from %s to %s – this may cause syncing of previous Keep items to the new ICA list.", prev_list_id, new_list_id)
 
-    hass.data[DOMAIN]["current_list_id"] = new_list_id
+    # Kontots optioner följer med till övriga listor på samma konto
+    account = {key: entry.options[key] for key in ACCOUNT_OPTIONS if key in entry.options}
+    session_id = entry.options.get("session_id", entry.data["session_id"])
+    for other in hass.config_entries.async_entries(DOMAIN):
+        if other.entry_id == entry.entry_id:
+            continue
+        if other.options.get("session_id", other.data.get("session_id")) != session_id:
+            continue
+        if any(other.options.get(key) != value for key, value in account.items()):
+            _LOGGER.debug("♻️ Kontots optioner gäller även %s", other.title)
+            hass.config_entries.async_update_entry(other, options={**other.options, **account})
 
     await hass.config_entries.async_reload(entry.entry_id)
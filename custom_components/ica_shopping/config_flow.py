@@ -7,7 +7,13 @@ from homeassistant.helpers.selector import BooleanSelector
 
 import voluptuous as vol
 from typing import Any
-from .const import DOMAIN
+from .const import (
+    DOMAIN,
+    ICA_WRITE_CONCURRENCY,
+    LIST_CACHE_SECONDS,
+    POLL_FAST_SECONDS,
+    POLL_IDLE_MINUTES,
+)
 
 
 class ICAConfigFlow(ConfigFlow, domain=DOMAIN):
@@ -65,6 +71,19 @@ class ICAOptionsFlowHandler(OptionsFlow):
                 }
             }),
             vol.Optional("remove_striked", default=self.config_entry.options.get("remove_striked", True)): BooleanSelector(),
+            vol.Optional("write_concurrency", default=self.config_entry.options.get("write_concurrency", ICA_WRITE_CONCURRENCY)): vol.All(vol.Coerce(int), vol.Range(min=1, max=16)),
+            vol.Optional("list_cache_seconds", default=self.config_entry.options.get("list_cache_seconds", LIST_CACHE_SECONDS)): vol.All(vol.Coerce(float), vol.Range(min=0, max=60)),
+            vol.Optional("legacy_attributes", default=self.config_entry.options.get("legacy_attributes", False)): BooleanSelector(),
+            vol.Optional("diagnostic_sensors", default=self.config_entry.options.get("diagnostic_sensors", False)): BooleanSelector(),
+            vol.Optional("purchase_sensors", default=self.config_entry.options.get("purchase_sensors", False)): BooleanSelector(),
+            vol.Optional("poll_fast_seconds", default=self.config_entry.options.get("poll_fast_seconds", POLL_FAST_SECONDS)): vol.All(vol.Coerce(int), vol.Range(min=30, max=900)),
+            vol.Optional("poll_idle_minutes", default=self.config_entry.options.get("poll_idle_minutes", POLL_IDLE_MINUTES)): vol.All(vol.Coerce(int), vol.Range(min=5, max=1440)),
+            vol.Optional("presence_zone", description={"suggested_value": self.config_entry.options.get("presence_zone")}): selector({
+                "entity": {
+                    "domain": "zone",
+                    "multiple": False
+                }
+            }),
         }
 
         return self.async_show_form(
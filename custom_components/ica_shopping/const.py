@@ -1,8 +1,69 @@
+from datetime import timedelta
+
 DOMAIN = "ica_shopping"
 DATA_ICA = f"{DOMAIN}._data"
 COOKIE_CACHE_FILE = ".ica_cookies.json"
+TOKEN_STORAGE_KEY = f"{DOMAIN}.token"
+TOKEN_STORAGE_VERSION = 1
+TOKEN_REFRESH_MARGIN = 120  # sekunder innan utgång som token förnyas
+TOKEN_DEFAULT_TTL = 1800  # används om token saknar exp-claim
 
 API_USER_INFO = "https://www.ica.se/api/user/information"
 API_LIST_ALL = "https://apimgw-pub.ica.se/sverige/digx/shopping-list/v1/api/list/all"
 API_ADD_ROW = "https://apimgw-pub.ica.se/sverige/digx/shopping-list/v1/api/list/{list_id}/row"
 API_REMOVE_ROW = "https://apimgw-pub.ica.se/sverige/digx/shopping-list/v1/api/list/{list_id}/row/{row_id}"
+API_DELETE_ROW = "https://apimgw-pub.ica.se/sverige/digx/shopping-list/v1/api/row/{row_id}"
+API_PURCHASES = "https://www.ica.se/api/cpa/purchases/historical/me/byyearmonth/{year_month}"
+
+# HTTP-pool mot ICA (en session per config entry)
+ICA_CONNECTION_LIMIT = 10
+ICA_CONNECTIONS_PER_HOST = 4
+ICA_KEEPALIVE_TIMEOUT = 60
+ICA_DNS_CACHE_TTL = 300
+ICA_WRITE_CONCURRENCY = 4  # max samtidiga add/remove-anrop i en batch
+KEEP_WRITE_CONCURRENCY = 4  # samtidiga todo.add_item mot Keep vid refresh
+LIST_CACHE_SECONDS = 5  # hur länge en list/all-snapshot återanvänds
+# Gäller hela kontot eftersom klient och coordinator delas av alla listor;
+# senast sparade värde skrivs till kontots alla entries
+ACCOUNT_OPTIONS = ("write_concurrency", "list_cache_seconds", "poll_fast_seconds", "poll_idle_minutes")
+
+# Senast synkade tillstånd (bas för trevägsavstämning)
+STORAGE_VERSION = 1
+STORAGE_KEY = "ica_keep_synced_list"
+SYNC_STATE_SAVE_DELAY = 10
+
+# Adaptiv pollning: snabbt efter ändringar eller när någon är i butiken,
+# sedan dubblat intervall per oförändrad hämtning upp till UPDATE_INTERVAL
+POLL_FAST_SECONDS = 60
+POLL_IDLE_MINUTES = 60
+POLL_ACTIVE_SECONDS = 600  # så länge efter senaste ändringen pollas det snabbt
+UPDATE_INTERVAL = timedelta(minutes=POLL_IDLE_MINUTES)  # gemensam pollning för sensorer och synk
+
+# Skrivkö för ICA-ändringar som ännu inte bekräftats
+OUTBOX_STORAGE_KEY = f"{DOMAIN}.outbox"
+OUTBOX_STORAGE_VERSION = 1
+OUTBOX_SAVE_DELAY = 1
+
+# Antal synkcykler som sparas för ica_shopping.sync_stats
+SYNC_STATS_HISTORY = 20
+
+# Retry, backoff och circuit breaker för anrop mot ICA
+ICA_REQUEST_TIMEOUT = 15
+ICA_MAX_RETRIES = 3
+ICA_BACKOFF_BASE = 0.5
+ICA_BACKOFF_MAX = 30
+ICA_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+ICA_BREAKER_THRESHOLD = 5
+ICA_BREAKER_RESET_SECONDS = 60
+ICA_MAX_CONCURRENT_REQUESTS = 6
+ICA_REQUESTS_PER_SECOND = 5
+
+# Största antal rader ICA tar emot i en lista
+MAX_ICA_ITEMS = 250
+
+# Köphistorik: avslutade månader hämtas en gång och sparas, bara innevarande pollas
+PURCHASE_STORAGE_KEY = f"{DOMAIN}.purchases"
+PURCHASE_STORAGE_VERSION = 1
+PURCHASE_SAVE_DELAY = 10
+PURCHASE_HISTORY_MONTHS = 12
+PURCHASE_UPDATE_INTERVAL = timedelta(hours=6)
@@ -0,0 +1,220 @@
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DOMAIN,
+    POLL_ACTIVE_SECONDS,
+    POLL_FAST_SECONDS,
+    PURCHASE_UPDATE_INTERVAL,
+    UPDATE_INTERVAL,
+)
+from .reconcile import list_fingerprint
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ICAListCoordinator(DataUpdateCoordinator):
+    """Äger list/all-snapshot och token-status för ett ICA-konto.
+
+    Delas av alla config entries med samma session, så en hämtning per
+    cykel räcker oavsett hur många listor som synkas.
+
+    data = {"lists": {list_id: lista}, "fingerprints": {list_id: hash},
+            "token": <accessToken eller None>}
+
+    Intervallet är adaptivt: efter en ändring (i ICA-appen, från Keep eller
+    via tjänsterna) och medan någon är i en bevakad zon pollas det med
+    `fast_interval`. Därefter dubblas det för varje hämtning upp till
+    `idle_interval`.
+    """
+
+    def __init__(self, hass, api, fast_interval=None, idle_interval=None):
+        self.fast_interval = fast_interval or timedelta(seconds=POLL_FAST_SECONDS)
+        self.idle_interval = max(idle_interval or UPDATE_INTERVAL, self.fast_interval)
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=DOMAIN,
+            update_interval=self.idle_interval,
+        )
+        self.api = api
+        self._fresh_at = 0.0
+        self._active_until = 0.0
+        self._zones: Counter = Counter()
+        self._unsub_fast_poll = None
+
+    async def _async_update_data(self):
+        # Hämtningen schemalägger nästa själv med det aktuella intervallet
+        self.async_cancel_fast_poll()
+        lists = await self.api.fetch_lists()
+        token = self.api.token
+        if not lists:
+            self._adapt_interval()
+            raise UpdateFailed("Kunde inte hämta ICA-listor")
+
+        self._fresh_at = time.monotonic()
+        lists = {l.get("id"): l for l in lists if isinstance(l, dict)}
+        fingerprints = {list_id: list_fingerprint(l) for list_id, l in lists.items()}
+        previous = (self.data or {}).get("fingerprints")
+        if previous is not None and any(previous.get(i) != f for i, f in fingerprints.items()):
+            _LOGGER.debug("🔔 ICA-listan har ändrats – pollar tätare en stund")
+            self._active_until = time.monotonic() + POLL_ACTIVE_SECONDS
+        self._adapt_interval()
+        return {
+            "lists": lists,
+            "fingerprints": fingerprints,
+            "token": token,
+        }
+
+    def _in_zone(self) -> bool:
+        for zone in self._zones:
+            state = self.hass.states.get(zone)
+            if state is not None and state.state.isdigit() and int(state.state) > 0:
+                return True
+        return False
+
+    def _adapt_interval(self):
+        if self._in_zone() or time.monotonic() < self._active_until:
+            interval = self.fast_interval
+        else:
+            interval = min(self.update_interval * 2, self.idle_interval)
+        if interval != self.update_interval:
+            _LOGGER.debug("⏱️ Nästa ICA-hämtning om %s", interval)
+        self.update_interval = interval
+
+    @callback
+    def async_mark_activity(self, refresh: bool = False):
+        """Något har ändrats lokalt – polla tätt en stund framåt.
+
+        En redan schemalagd hämtning ligger kvar på det gamla intervallet,
+        så en egen hämtning planeras om `fast_interval`. Med `refresh`
+        hämtas listan direkt, t.ex. när någon just kommit till butiken.
+        """
+        self._active_until = time.monotonic() + POLL_ACTIVE_SECONDS
+        if refresh:
+            self.update_interval = self.fast_interval
+            self.hass.async_create_task(self.async_request_refresh())
+            return
+        if self.update_interval != self.fast_interval:
+            self.update_interval = self.fast_interval
+            self.async_cancel_fast_poll()
+            self._unsub_fast_poll = async_call_later(self.hass, self.fast_interval, self._async_fast_poll)
+
+    async def _async_fast_poll(self, _now):
+        self._unsub_fast_poll = None
+        await self.async_request_refresh()
+
+    @callback
+    def async_cancel_fast_poll(self):
+        if self._unsub_fast_poll:
+            self._unsub_fast_poll()
+            self._unsub_fast_poll = None
+
+    @callback
+    def track_zone(self, zone):
+        self._zones[zone] += 1
+
+    @callback
+    def untrack_zone(self, zone):
+        self._zones[zone] -= 1
+        if self._zones[zone] <= 0:
+            del self._zones[zone]
+
+    def get_list(self, list_id):
+        return (self.data or {}).get("lists", {}).get(list_id)
+
+    def get_fingerprint(self, list_id):
+        return (self.data or {}).get("fingerprints", {}).get(list_id)
+
+    async def async_fetch_list(self, list_id, max_age: float | None = None):
+        """Hämta färsk lista för en synk; None om hämtningen misslyckades.
+
+        En snapshot som är yngre än `max_age` (standard: API:ets
+        färskhetsfönster) återanvänds, även om den kommer från synken själv.
+        """
+        max_age = self.api.list_cache_seconds if max_age is None else max_age
+        if not (
+            self.data is not None
+            and self.last_update_success
+            and time.monotonic() - self._fresh_at < max_age
+        ):
+            if max_age < self.api.list_cache_seconds:
+                # Snävare krav än API:ets eget fönster – dess snapshot duger inte heller
+                self.api.invalidate_lists()
+            await self.async_refresh()
+            if not self.last_update_success:
+                return None
+        the_list = self.get_list(list_id)
+        if the_list is None:
+            _LOGGER.warning("❌ Kunde inte hitta lista med ID %s", list_id)
+        return the_list
+
+    @callback
+    def async_seed_list(self, the_list):
+        """Visa en sparad lista direkt vid start; räknas inte som färsk."""
+        data = self.data or {"lists": {}, "fingerprints": {}, "token": None}
+        list_id = the_list.get("id")
+        self.data = {
+            **data,
+            "lists": {**data.get("lists", {}), list_id: the_list},
+            "fingerprints": {**data.get("fingerprints", {}), list_id: list_fingerprint(the_list)},
+        }
+        self.async_update_listeners()
+
+    @callback
+    def async_set_list(self, the_list):
+        """Ge alla konsumenter en lista som synken redan känner till, utan HTTP."""
+        data = self.data or {"lists": {}, "token": self.api.token}
+        list_id = the_list.get("id")
+        lists = {**data.get("lists", {}), list_id: the_list}
+        fingerprints = {**data.get("fingerprints", {}), list_id: list_fingerprint(the_list)}
+        # Bara en lista där alla rader har id duger som underlag för nästa synk
+        if all(isinstance(r, dict) and r.get("id") for r in the_list.get("rows", [])):
+            self._fresh_at = time.monotonic()
+        else:
+            self._fresh_at = 0.0
+        self.async_mark_activity()
+        # async_set_updated_data schemalägger om med det snabba intervallet
+        self.async_cancel_fast_poll()
+        self.async_set_updated_data({**data, "lists": lists, "fingerprints": fingerprints})
+
+
+class ICAPurchaseCoordinator(DataUpdateCoordinator):
+    """Köphistorik för ett ICA-konto, ur den sparade månadscachen.
+
+    data = {"latest": transaktion eller None, "monthly_spend": {YYYY-MM: summa},
+            "store_visits": {butik: antal}, "current_month": YYYY-MM}
+    """
+
+    def __init__(self, hass, api, history):
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN}_purchases",
+            update_interval=PURCHASE_UPDATE_INTERVAL,
+        )
+        self.api = api
+        self.history = history
+
+    async def _async_update_data(self):
+        now = dt_util.now()
+        changed = await self.history.async_update(self.api, now.year, now.month)
+        current_month = f"{now.year:04d}-{now.month:02d}"
+        if not changed and self.data is not None and self.data["current_month"] == current_month:
+            return self.data
+        return {**self.history.summary(), "current_month": current_month}
+
+    @callback
+    def async_seed(self):
+        """Visa den sparade historiken direkt vid start; räknas inte som färsk."""
+        summary = self.history.summary()
+        if summary["monthly_spend"]:
+            now = dt_util.now()
+            self.data = {**summary, "current_month": f"{now.year:04d}-{now.month:02d}"}
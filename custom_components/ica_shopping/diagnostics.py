@@ -0,0 +1,43 @@
+from homeassistant.components.diagnostics import async_redact_data
+
+from .const import DOMAIN
+
+TO_REDACT = {"session_id", "token", "accessToken"}
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """HTTP-statistik, breaker-läge och synkstatus för en config entry."""
+    entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+    diagnostics = {
+        "entry": {
+            "data": async_redact_data(dict(entry.data), TO_REDACT),
+            "options": async_redact_data(dict(entry.options), TO_REDACT),
+        },
+    }
+    if entry_data is None:
+        return diagnostics
+
+    api = entry_data["api"]
+    coordinator = entry_data["coordinator"]
+    list_id = entry_data["list_id"]
+    the_list = coordinator.get_list(list_id)
+    base = entry_data["sync_state"].base
+
+    diagnostics.update({
+        "http": api.metrics.as_dict(),
+        "circuit_breakers": api.breaker_states(),
+        "token_valid": api.token is not None,
+        "coordinator": {
+            "last_update_success": coordinator.last_update_success,
+            "lists": len((coordinator.data or {}).get("lists", {})),
+        },
+        "list": {
+            "found": the_list is not None,
+            "rows": len(the_list.get("rows", [])) if the_list else None,
+            "fingerprint": coordinator.get_fingerprint(list_id),
+        },
+        "sync_state_entries": len(base) if base is not None else None,
+        "outbox_pending": len(entry_data["outbox"]),
+        "sync_cycles": entry_data["profiler"].as_dict()["by_kind"],
+    })
+    return diagnostics
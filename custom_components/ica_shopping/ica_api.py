@@ -1,94 +1,489 @@
+import asyncio
+import base64
+import hashlib
+import json
 import logging
-import yaml
+import time
+from collections import Counter
+from urllib.parse import urlsplit
 import aiohttp
-import aiofiles
-from .const import API_LIST_ALL, API_ADD_ROW, API_REMOVE_ROW
-from homeassistant.core import HomeAssistant
+from .const import (
+    API_LIST_ALL,
+    API_ADD_ROW,
+    API_DELETE_ROW,
+    API_PURCHASES,
+    API_USER_INFO,
+    ICA_BACKOFF_BASE,
+    ICA_BACKOFF_MAX,
+    ICA_BREAKER_RESET_SECONDS,
+    ICA_BREAKER_THRESHOLD,
+    ICA_CONNECTION_LIMIT,
+    ICA_CONNECTIONS_PER_HOST,
+    ICA_DNS_CACHE_TTL,
+    ICA_KEEPALIVE_TIMEOUT,
+    ICA_MAX_CONCURRENT_REQUESTS,
+    ICA_MAX_RETRIES,
+    ICA_REQUEST_TIMEOUT,
+    ICA_REQUESTS_PER_SECOND,
+    ICA_RETRY_STATUSES,
+    ICA_WRITE_CONCURRENCY,
+    LIST_CACHE_SECONDS,
+    TOKEN_DEFAULT_TTL,
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_STORAGE_KEY,
+    TOKEN_STORAGE_VERSION,
+)
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
 from homeassistant.helpers import issue_registry as ir
+from homeassistant.helpers.storage import Store
 from .const import DOMAIN
+from .list_parser import parse_lists
+from .metrics import ApiMetrics, endpoint_label, preview
+from .resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateBudget,
+    backoff_delay,
+    parse_retry_after,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+
+def _token_expiry(token: str) -> float:
+    """Läs exp-claim ur en JWT, annars anta TOKEN_DEFAULT_TTL."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        if exp:
+            return float(exp)
+    except (IndexError, ValueError, TypeError, AttributeError):
+        pass
+    return time.time() + TOKEN_DEFAULT_TTL
+
+
+def session_hash(session_id: str) -> str:
+    """Kort hash av session-id:t för filnamn i .storage – id:t självt ska inte synas."""
+    return hashlib.sha1(session_id.encode()).hexdigest()[:12]
+
+
+def _write_failed(status) -> bool | None:
+    """Resultat för ett misslyckat skrivanrop: None om ICA avvisat det för gott.
+
+    4xx utom 401 och 429 blir inte bättre av att skickas igen; allt annat
+    (saknad token, 5xx, avbrutna anrop) ger False och kan försökas igen.
+    """
+    if status is not None and 400 <= status < 500 and status not in (401, 429):
+        return None
+    return False
+
+
 class ICAApi:
-    def __init__(self, hass, session_id):
+    def __init__(
+        self,
+        hass,
+        session_id,
+        write_concurrency: int = ICA_WRITE_CONCURRENCY,
+        list_cache_seconds: float = LIST_CACHE_SECONDS,
+    ):
         self.hass = hass
         self.session_id = session_id
+        self.write_concurrency = max(1, int(write_concurrency))
+
+        # list/all-snapshot: en delad förfrågan åt gången + kort färskhetsfönster
+        self.list_cache_seconds = list_cache_seconds
+        self._lists = None
+        self._lists_fetched_at = 0.0
+        self._lists_task = None
+        self._etag = None
+        self._etag_lists = None
+        self._wanted_lists = Counter()
+
+        # Egen långlivad HTTP-session per konto, se `session`
+        self._session = None
+        self._unsub_close = None
+
+        # Skydd mot ICA:s gränser: en breaker per värd och en gemensam budget
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._budget = RateBudget(ICA_MAX_CONCURRENT_REQUESTS, ICA_REQUESTS_PER_SECOND)
+        self._timeout = aiohttp.ClientTimeout(total=ICA_REQUEST_TIMEOUT)
+        self.metrics = ApiMetrics()
+
+        # Token-cache: delas av alla anrop, förnyas strax före utgång
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._token_loaded = False
+        # En sparad token per konto, så att flera konton inte skriver över varandra
+        self._session_hash = session_hash(session_id)
+        self._token_store = Store(hass, TOKEN_STORAGE_VERSION, f"{TOKEN_STORAGE_KEY}.{self._session_hash}")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Kontots session med keep-alive, per-host-gräns och DNS-cache.
+
+        HA:s delade session används inte: dess connector går inte att ställa
+        in, och dess cookie-jar skulle blanda ihop kontons ICA-cookies.
+        Sessionen stängs när sista entryn släpper klienten, eller när HA stängs.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=ICA_CONNECTION_LIMIT,
+                limit_per_host=ICA_CONNECTIONS_PER_HOST,
+                keepalive_timeout=ICA_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=ICA_DNS_CACHE_TTL,
+            )
+            # Cookies skickas explicit per anrop, så inget cookie-jar behövs
+            self._session = aiohttp.ClientSession(
+                connector=connector, cookie_jar=aiohttp.DummyCookieJar()
+            )
+            if self._unsub_close is None:
+                self._unsub_close = self.hass.bus.async_listen_once(
+                    EVENT_HOMEASSISTANT_CLOSE, self._async_on_hass_close
+                )
+        return self._session
+
+    async def _async_on_hass_close(self, _event):
+        self._unsub_close = None
+        await self.async_close()
+
+    async def async_close(self):
+        if self._unsub_close is not None:
+            self._unsub_close()
+            self._unsub_close = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def token(self):
+        """Cachad accessToken utan att trigga en förnyelse."""
+        return self._token if self._token_valid() else None
+
+    def _token_valid(self) -> bool:
+        return bool(self._token) and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN
+
+    async def _load_cached_token(self):
+        self._token_loaded = True
+        try:
+            data = await self._token_store.async_load()
+        except Exception as e:
+            _LOGGER.debug("ℹ️ Kunde inte läsa sparad token: %s", e)
+            return
+        if not data or data.get("session") != self._session_hash:
+            return
+        self._token = data.get("token")
+        self._token_expires_at = float(data.get("expires_at", 0))
+        if self._token_valid():
+            _LOGGER.debug("🔑 Återanvänder sparad accessToken")
+
+    async def get_token(self, force_refresh: bool = False, rejected: str | None = None):
+        """Returnera cachad accessToken; bara en förnyelse åt gången.
+
+        `rejected` är en token som servern just svarat 401 på – den förnyas
+        bara om ingen annan anropare redan hunnit byta ut den.
+        """
+        if not force_refresh and self._token_valid() and self._token != rejected:
+            return self._token
+
+        async with self._token_lock:
+            if not self._token_loaded:
+                await self._load_cached_token()
+            # En annan anropare kan ha förnyat medan vi väntade på låset
+            if not force_refresh and self._token_valid() and self._token != rejected:
+                return self._token
+
+            token = await self._get_token_from_session_id()
+            self.metrics.record_token_refresh(bool(token))
+            if not token:
+                self._token = None
+                self._token_expires_at = 0.0
+                return None
+
+            self._token = token
+            self._token_expires_at = _token_expiry(token)
+            self._token_store.async_delay_save(
+                lambda: {
+                    "session": self._session_hash,
+                    "token": self._token,
+                    "expires_at": self._token_expires_at,
+                },
+                1,
+            )
+            return token
+
+    def _breaker(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).hostname or ""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                host, ICA_BREAKER_THRESHOLD, ICA_BREAKER_RESET_SECONDS
+            )
+        return breaker
+
+    def breaker_states(self) -> dict[str, str]:
+        """Breakerns läge per värd ("closed", "open" eller "half_open")."""
+        return {host: breaker.state for host, breaker in self._breakers.items()}
+
+    async def _send(self, method: str, url: str, headers: dict, json_data=None, with_headers=False, decoder=None):
+        """Ett HTTP-anrop med timeout, retry/backoff, Retry-After, breaker och budget.
+
+        Returnerar (status, body), eller (status, body, headers) med
+        `with_headers`. En `decoder` får JSON-svarets råa bytes i stället
+        för att hela svaret läses med resp.json(). POST görs bara om när servern uttryckligen
+        inte hanterat anropet (429/503), så att rader inte dubbleras.
+        """
+        breaker = self._breaker(url)
+        idempotent = method != "POST"
+        label = endpoint_label(method, url)
+
+        for attempt in range(ICA_MAX_RETRIES + 1):
+            if attempt:
+                self.metrics.record_retry(label)
+            try:
+                breaker.before_request()
+            except CircuitOpenError:
+                self.metrics.circuit_rejections += 1
+                raise
+            retry_after = None
+            started = time.monotonic()
+            try:
+                async with self._budget:
+                    # Latensen mäts från att budgeten släppt igenom anropet
+                    started = time.monotonic()
+                    async with self.session.request(
+                        method, url, headers=headers, json=json_data, timeout=self._timeout
+                    ) as resp:
+                        status = resp.status
+                        resp_headers = resp.headers
+                        nbytes = 0
+                        if status in ICA_RETRY_STATUSES:
+                            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        else:
+                            raw = await resp.read()
+                            nbytes = len(raw)
+                            if resp.content_type == "application/json" and decoder is not None:
+                                body = decoder(raw)
+                            elif resp.content_type == "application/json":
+                                body = await resp.json()
+                            else:
+                                body = await resp.text()
+                self.metrics.record_response(label, status, time.monotonic() - started, nbytes)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.record_error(label, time.monotonic() - started)
+                breaker.record_failure()
+                if not idempotent or attempt == ICA_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, ICA_BACKOFF_BASE, ICA_BACKOFF_MAX)
+                _LOGGER.debug("🔁 %s %s misslyckades (%s) – nytt försök om %.1fs", method, url, e, delay)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Avbrutet eller oläsbart svar: varken lyckat eller misslyckat
+                breaker.release_trial()
+                raise
+
+            if status not in ICA_RETRY_STATUSES:
+                breaker.record_success()
+                return (status, body, resp_headers) if with_headers else (status, body)
+
+            if status >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()  # 429 betyder att värden lever
+            retryable = idempotent or status in (429, 503)
+            if not retryable or attempt == ICA_MAX_RETRIES:
+                break
+            delay = backoff_delay(attempt, ICA_BACKOFF_BASE, ICA_BACKOFF_MAX, retry_after)
+            _LOGGER.debug("⏳ ICA svarade %s på %s – nytt försök om %.1fs", status, url, delay)
+            await asyncio.sleep(delay)
+
+        return (status, None, resp_headers) if with_headers else (status, None)
 
-
-            
     async def _get_token_from_session_id(self):
         headers = {
             "Cookie": f"thSessionId={self.session_id}",
             "Accept": "application/json"
         }
-        url = "https://www.ica.se/api/user/information"
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as resp:
-                    if resp.status != 200:
-                        _LOGGER.error("❗ Misslyckades att hämta accessToken (%s)", resp.status)
-
-                        ir.async_create_issue(
-                            self.hass,
-                            DOMAIN,
-                            "invalid_session_id",
-                            is_fixable=True,
-                            severity=ir.IssueSeverity.ERROR,
-                            translation_key="invalid_session_id"
-                        )   
+            status, data = await self._send("GET", API_USER_INFO, headers)
+            if status in ICA_RETRY_STATUSES:
+                _LOGGER.error("❗ ICA kunde inte lämna ut accessToken just nu (%s)", status)
+                return None
+            if status != 200 or not isinstance(data, dict):
+                _LOGGER.error("❗ Misslyckades att hämta accessToken (%s)", status)
 
-                        return None
+                ir.async_create_issue(
+                    self.hass,
+                    DOMAIN,
+                    "invalid_session_id",
+                    is_fixable=True,
+                    severity=ir.IssueSeverity.ERROR,
+                    translation_key="invalid_session_id"
+                )
 
-                    data = await resp.json()
-                    token = data.get("accessToken")
+                return None
 
+            token = data.get("accessToken")
 
-                    # Ta bort eventuell aktiv issue om sessionen funkar igen
+            # Ta bort eventuell aktiv issue om sessionen funkar igen
 
-                    ir.async_delete_issue(self.hass, DOMAIN, "invalid_session_id")
+            ir.async_delete_issue(self.hass, DOMAIN, "invalid_session_id")
 
-                    return token
+            return token
 
         except Exception as e:
             _LOGGER.error("❗ Fel vid hämtning av accessToken: %s", e)
             return None
 
-
-    async def fetch_lists(self):
-        token = await self._get_token_from_session_id()
-        if not token:
-            _LOGGER.error("❌ Avbryter fetch_lists - token saknas")
+    async def _request(self, method: str, url: str, json_data=None, extra_headers=None, with_headers=False, decoder=None):
+        """Autentiserat anrop mot ICA. Returnerar (status, body) eller (None, None) utan token.
+
+        Vid 401 tvingas en ny token fram och anropet görs om en gång.
+        Med `with_headers` läggs svarets headers till sist i tupeln.
+        """
+        empty = (None, None, {}) if with_headers else (None, None)
+        rejected = None
+        for attempt in range(2):
+            token = await self.get_token(rejected=rejected)
+            if not token:
+                return empty
+
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json",
+                "Cookie": f"thSessionId={self.session_id}",
+            }
+            if json_data is not None:
+                headers["Content-Type"] = "application/json"
+            if extra_headers:
+                headers.update(extra_headers)
+
+            result = await self._send(method, url, headers, json_data, with_headers, decoder)
+            if result[0] == 401 and attempt == 0:
+                _LOGGER.debug("🔑 401 från ICA – förnyar token och försöker igen")
+                rejected = token
+                continue
+            return result
+
+        return (401, None, {}) if with_headers else (401, None)
+
+    def track_list(self, list_id) -> bool:
+        """Registrera en lista som ska avkodas helt; True om den är ny."""
+        self._wanted_lists[list_id] += 1
+        if self._wanted_lists[list_id] > 1:
+            return False
+        # Cachade svar saknar rader för den nya listan
+        self._etag = None
+        self._etag_lists = None
+        self.invalidate_lists()
+        return True
+
+    def untrack_list(self, list_id):
+        self._wanted_lists[list_id] -= 1
+        if self._wanted_lists[list_id] <= 0:
+            del self._wanted_lists[list_id]
+
+    def invalidate_lists(self):
+        """Glöm senaste snapshot, t.ex. efter att en rad lagts till eller tagits bort."""
+        self._lists = None
+        self._lists_task = None
+
+    async def fetch_lists(self, max_age: float | None = None):
+        """Hämta alla listor; samtidiga anropare delar på en list/all-förfrågan."""
+        max_age = self.list_cache_seconds if max_age is None else max_age
+        if self._lists is not None and time.monotonic() - self._lists_fetched_at < max_age:
+            return self._lists
+
+        task = self._lists_task
+        if task is None:
+            task = self._lists_task = asyncio.ensure_future(self._fetch_lists())
+
+            def _done(fut):
+                if self._lists_task is not fut:
+                    return  # invaliderad under tiden – cacha inte
+                self._lists_task = None
+                if not fut.cancelled() and fut.exception() is None and fut.result():
+                    self._lists = fut.result()
+                    self._lists_fetched_at = time.monotonic()
+
+            task.add_done_callback(_done)
+        else:
+            _LOGGER.debug("🔗 Ansluter till pågående list/all-hämtning")
+
+        return await asyncio.shield(task)
+
+    async def _fetch_lists(self):
+        try:
+            # Villkorlig hämtning: 304 betyder att senaste svaret fortfarande gäller
+            extra_headers = {"If-None-Match": self._etag} if self._etag and self._etag_lists else None
+            # Med registrerade listor avkodas bara de, övriga blir id/namn
+            wanted = set(self._wanted_lists)
+            decoder = (lambda raw: parse_lists(raw, wanted)) if wanted else None
+            status, result, headers = await self._request(
+                "GET", API_LIST_ALL, extra_headers=extra_headers, with_headers=True, decoder=decoder
+            )
+            if status is None:
+                _LOGGER.error("❌ Avbryter fetch_lists - token saknas")
+                return []
+
+            if status == 304 and self._etag_lists is not None:
+                _LOGGER.debug("📡 ICA list/all oförändrad (304)")
+                return self._etag_lists
+
+            _LOGGER.debug("📡 ICA API status: %s", status)
+            if status != 200:
+                _LOGGER.error("❗ ICA API error: %s", status)
+                return []
+
+            if _LOGGER.isEnabledFor(logging.DEBUG):
+                _LOGGER.debug("📦 ICA API raw response: %s", preview(result))
+
+            # Returnera rätt beroende på format
+            if isinstance(result, dict) and "items" in result:
+                lists = result["items"]
+            elif isinstance(result, list):
+                lists = result
+            else:
+                lists = None
+            if lists is not None:
+                self._etag = headers.get("ETag")
+                self._etag_lists = lists if self._etag else None
+                return lists
+            else:
+                _LOGGER.error("❗ Oväntat format på ICA-response: %s", type(result))
+                return []
+        except Exception as e:
+            _LOGGER.error("❗ Fel vid hämtning av ICA-listor: %s", e)
             return []
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "Cookie": f"thSessionId={self.session_id}"
-        }
+    async def fetch_purchases(self, year_month: str, etag: str | None = None):
+        """Köp för en månad (YYYY-MM). Returnerar (status, transaktioner, etag).
 
+        Transaktionerna är None vid 304 (oförändrat) och vid fel.
+        """
+        extra_headers = {"Cookie": f"thSessionId={self.session_id}"}
+        if etag:
+            extra_headers["If-None-Match"] = etag
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(API_LIST_ALL, headers=headers) as resp:
-                    _LOGGER.debug("📡 ICA API status: %s", resp.status)
-                    if resp.status != 200:
-                        _LOGGER.error("❗ ICA API error: %s", resp.status)
-                        return []
-
-                    result = await resp.json()
-                    _LOGGER.debug("📦 ICA API raw response: %s", result)
-
-                    # Returnera rätt beroende på format
-                    if isinstance(result, dict) and "items" in result:
-                        return result["items"]
-                    elif isinstance(result, list):
-                        return result
-                    else:
-                        _LOGGER.error("❗ Oväntat format på ICA-response: %s", type(result))
-                        return []
+            status, body, headers = await self._request(
+                "GET", API_PURCHASES.format(year_month=year_month),
+                extra_headers=extra_headers, with_headers=True,
+            )
         except Exception as e:
-            _LOGGER.error("❗ Fel vid hämtning av ICA-listor: %s", e)
-            return []
+            _LOGGER.error("❗ Fel vid hämtning av köphistorik för %s: %s", year_month, e)
+            return None, None, None
+        if status == 304:
+            return status, None, etag
+        if status == 403:
+            _LOGGER.warning("❌ Åtkomst nekad (403) vid hämtning av köphistorik – ignorerar.")
+            return status, None, None
+        if status != 200 or not isinstance(body, dict):
+            _LOGGER.error("❌ Oväntat fel (%s) vid hämtning av köphistorik", status)
+            return status, None, None
+        return status, body.get("transactions", []), headers.get("ETag")
 
     async def get_list_name(self, list_id: str) -> str:
         lists = await self.fetch_lists()
@@ -106,84 +501,103 @@ class ICAApi:
 
 
     async def add_item(self, list_id: str, item: str):
-        token = await self._get_token_from_session_id()
-        if not token:
-            return False
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
-
-        data = {"text": item}
         url = API_ADD_ROW.format(list_id=list_id)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as resp:
-                    _LOGGER.debug("➕ Lägg till '%s' till ICA (%s): %s", item, list_id, resp.status)
-                    return resp.status == 200
+            status, _ = await self._request("POST", url, json_data={"text": item})
+            self.invalidate_lists()
+            if status is None:
+                return False
+            _LOGGER.debug("➕ Lägg till '%s' till ICA (%s): %s", item, list_id, status)
+            return status == 200
         except Exception as e:
             _LOGGER.error("❗ Error adding item to ICA: %s", e)
             return False
 
-    async def remove_item(self, row_id: str) -> bool:
-        token = await self._get_token_from_session_id()
-        if not token:
-            _LOGGER.error("❌ Kan inte radera – token saknas")
-            return False
-
-        url = f"https://apimgw-pub.ica.se/sverige/digx/shopping-list/v1/api/row/{row_id}"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json; charset=UTF-8",
-            "Accept": "*/*"
-        }
+    async def remove_item(self, row_id: str) -> bool | None:
+        """Radera en rad. En rad som redan saknas (404) räknas som borttagen."""
+        url = API_DELETE_ROW.format(row_id=row_id)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.delete(url, headers=headers) as resp:
-                    if resp.status in (200, 204):
-                        _LOGGER.info("🗑️ Tog bort rad %s från ICA", row_id)
-                        return True
-                    else:
-                        _LOGGER.warning("❗ Misslyckades ta bort rad %s – status %s", row_id, resp.status)
-                        return False
+            status, _ = await self._request("DELETE", url)
+            self.invalidate_lists()
+            if status is None:
+                _LOGGER.error("❌ Kan inte radera – token saknas")
+                return False
+            if status in (200, 204):
+                _LOGGER.info("🗑️ Tog bort rad %s från ICA", row_id)
+                return True
+            if status == 404:
+                _LOGGER.debug("ℹ️ Rad %s fanns redan inte i ICA", row_id)
+                return True
+            _LOGGER.warning("❗ Misslyckades ta bort rad %s – status %s", row_id, status)
+            return _write_failed(status)
         except Exception as e:
             _LOGGER.error("❗ Fel vid borttagning av ICA-rad: %s", e)
             return False
 
-            
-    async def add_to_list(self, list_id: str, text: str):
-        token = await self._get_token_from_session_id()
-        if not token:
-            _LOGGER.error("❌ Saknar token – kan inte lägga till i ICA")
-            return False
-
-        url = f"https://apimgw-pub.ica.se/sverige/digx/shopping-list/v1/api/list/{list_id}/row"
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-          "text": text}
 
+    async def add_to_list(self, list_id: str, text: str) -> bool | None:
+        """Lägg till en rad. None om ICA avvisat den för gott, se _write_failed."""
+        url = API_ADD_ROW.format(list_id=list_id)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as resp:
-                    _LOGGER.debug("➕ Försöker lägga till '%s' i ICA (%s)", text, resp.status)
-                    if resp.status == 200:
-                        _LOGGER.info("✅ Lade till '%s' i ICA-listan", text)
-                        return True
-                    else:
-                        body = await resp.text()
-                        _LOGGER.warning("❗ Kunde inte lägga till i ICA (%s): %s", resp.status, body)
-                        return False
+            status, body = await self._request("POST", url, json_data={"text": text})
+            self.invalidate_lists()
+            if status is None:
+                _LOGGER.error("❌ Saknar token – kan inte lägga till i ICA")
+                return False
+            _LOGGER.debug("➕ Försöker lägga till '%s' i ICA (%s)", text, status)
+            if status == 200:
+                _LOGGER.info("✅ Lade till '%s' i ICA-listan", text)
+                return True
+            else:
+                _LOGGER.warning("❗ Kunde inte lägga till i ICA (%s): %s", status, preview(body))
+                return _write_failed(status)
         except Exception as e:
             _LOGGER.error("❗ Fel vid add_to_list('%s'): %s", text, e)
-            return False
\ No newline at end of file
+            return False
+
+    async def _run_batch(self, items, operation, capacity: int | None = None):
+        """Kör `operation` för varje item parallellt, max `write_concurrency` åt gången.
+
+        Med `capacity` startas inga fler anrop när så många lyckats; ett
+        misslyckat anrop lämnar tillbaka sin plats till nästa item.
+        Returnerar [(item, ok)] i samma ordning som `items`; ok är None
+        när ICA avvisat anropet för gott.
+        """
+        semaphore = asyncio.Semaphore(self.write_concurrency)
+        claimed = 0
+
+        async def run(item):
+            nonlocal claimed
+            async with semaphore:
+                if capacity is not None:
+                    if claimed >= capacity:
+                        return item, False
+                    claimed += 1
+                try:
+                    ok = await operation(item)
+                except Exception as e:
+                    _LOGGER.error("❗ Fel i batch-anrop för '%s': %s", item, e)
+                    ok = False
+                if not ok and capacity is not None:
+                    claimed -= 1
+                return item, ok
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
+
+    async def add_items(self, list_id: str, texts, capacity: int | None = None):
+        """Lägg till flera rader parallellt. Returnerar [(text, ok)]."""
+        if not texts:
+            return []
+        if capacity is not None and capacity <= 0:
+            _LOGGER.error("🚫 ICA-listan full – hoppar över %s varor", len(texts))
+            return [(text, False) for text in texts]
+        return await self._run_batch(
+            texts, lambda text: self.add_to_list(list_id, text), capacity
+        )
+
+    async def remove_items(self, row_ids):
+        """Radera flera rader parallellt. Returnerar [(row_id, ok)]."""
+        return await self._run_batch(row_ids, self.remove_item)
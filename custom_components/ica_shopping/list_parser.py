@@ -0,0 +1,69 @@
+"""Plocka ut bara de listor som synkas ur ett list/all-svar.
+
+Svaret avkodas ett listobjekt i taget med JSONDecoder.raw_decode, så
+som mest en hel lista finns i minnet utöver råtexten. Listor som inte
+efterfrågas krymps direkt till {"id", "name"}.
+"""
+import json
+import re
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _skip(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _reduce(value, wanted):
+    if isinstance(value, dict) and value.get("id") not in wanted:
+        return {"id": value.get("id"), "name": value.get("name")}
+    return value
+
+
+def _parse_array(text: str, pos: int, wanted):
+    pos = _skip(text, pos + 1)
+    lists = []
+    if text[pos] == "]":
+        return lists, pos + 1
+    while True:
+        value, pos = _DECODER.raw_decode(text, pos)
+        lists.append(_reduce(value, wanted))
+        pos = _skip(text, pos)
+        if text[pos] == "]":
+            return lists, pos + 1
+        if text[pos] != ",":
+            raise ValueError(f"Oväntat tecken {text[pos]!r} på position {pos}")
+        pos = _skip(text, pos + 1)
+
+
+def parse_lists(raw, wanted) -> list:
+    """Listorna i ett list/all-svar (lista eller {"items": [...]}).
+
+    Listor vars id finns i `wanted` behålls hela, övriga blir id/namn.
+    """
+    text = raw.decode("utf-8") if isinstance(raw, (bytes, bytearray)) else raw
+    pos = _skip(text, 0)
+    if text.startswith("[", pos):
+        return _parse_array(text, pos, wanted)[0]
+    if not text.startswith("{", pos):
+        raise ValueError("list/all är varken lista eller objekt")
+
+    lists = None
+    pos = _skip(text, pos + 1)
+    while text[pos] != "}":
+        key, pos = _DECODER.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if text[pos] != ":":
+            raise ValueError(f"Saknar ':' på position {pos}")
+        pos = _skip(text, pos + 1)
+        if key == "items" and text.startswith("[", pos):
+            lists, pos = _parse_array(text, pos, wanted)
+        else:
+            _, pos = _DECODER.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if text[pos] == ",":
+            pos = _skip(text, pos + 1)
+    if lists is None:
+        raise ValueError("list/all saknar items")
+    return lists
@@ -0,0 +1,207 @@
+import re
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+# Övre gränser (sekunder) för latenshistogrammet; sista facket är "större än"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_ID_SEGMENT = re.compile(r"^(?=.*\d)[0-9A-Za-z-]{8,}$|^\d+$")
+
+
+def endpoint_label(method: str, url: str) -> str:
+    """Metod plus sökväg där list- och rad-id ersatts med {id}."""
+    segments = [
+        "{id}" if _ID_SEGMENT.match(segment) else segment
+        for segment in urlsplit(url).path.split("/")
+    ]
+    return f"{method} {'/'.join(segments)}"
+
+
+def preview(value, limit: int = 300) -> str:
+    """Avkortad text för debug-loggning av stora svar."""
+    text = str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… ({len(text)} tecken)"
+
+
+class EndpointStats:
+    """Räknare för en endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_received = 0
+        self.statuses: Counter = Counter()
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def observe(self, seconds: float):
+        self.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+
+    def as_dict(self) -> dict:
+        observed = sum(self.latency_buckets)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_received": self.bytes_received,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "latency": {
+                "buckets": {
+                    **{f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+                    "inf": self.latency_buckets[-1],
+                },
+                "mean": round(self.latency_total / observed, 4) if observed else None,
+                "max": round(self.latency_max, 4),
+            },
+        }
+
+
+class ApiMetrics:
+    """Mätvärden för alla HTTP-anrop som en ICAApi gör.
+
+    Varje försök räknas för sig, så ett anrop som görs om efter 503
+    syns både som en 503 och som en retry.
+    """
+
+    def __init__(self):
+        self.endpoints: dict[str, EndpointStats] = {}
+        self.token_refreshes = 0
+        self.token_refresh_failures = 0
+        self.circuit_rejections = 0
+
+    def _stats(self, label: str) -> EndpointStats:
+        stats = self.endpoints.get(label)
+        if stats is None:
+            stats = self.endpoints[label] = EndpointStats()
+        return stats
+
+    def record_response(self, label: str, status: int, seconds: float, nbytes: int = 0):
+        stats = self._stats(label)
+        stats.requests += 1
+        stats.statuses[status] += 1
+        stats.bytes_received += nbytes
+        stats.observe(seconds)
+
+    def record_error(self, label: str, seconds: float):
+        stats = self._stats(label)
+        stats.requests += 1
+        stats.errors += 1
+        stats.observe(seconds)
+
+    def record_retry(self, label: str):
+        self._stats(label).retries += 1
+
+    def record_token_refresh(self, success: bool):
+        self.token_refreshes += 1
+        if not success:
+            self.token_refresh_failures += 1
+
+    @property
+    def total_requests(self) -> int:
+        return sum(s.requests for s in self.endpoints.values())
+
+    @property
+    def mean_latency(self) -> float | None:
+        observed = sum(sum(s.latency_buckets) for s in self.endpoints.values())
+        if not observed:
+            return None
+        return sum(s.latency_total for s in self.endpoints.values()) / observed
+
+    def as_dict(self) -> dict:
+        return {
+            "total_requests": self.total_requests,
+            "token_refreshes": self.token_refreshes,
+            "token_refresh_failures": self.token_refresh_failures,
+            "circuit_rejections": self.circuit_rejections,
+            "endpoints": {label: s.as_dict() for label, s in sorted(self.endpoints.items())},
+        }
+
+
+class SyncCycle:
+    """Tid per fas och antal operationer för en synk- eller refreshcykel.
+
+    `http` är antalet HTTP-anrop under cykeln enligt ApiMetrics; klienten
+    delas per konto, så samtidiga cykler för andra listor räknas med.
+    """
+
+    def __init__(self, kind: str, metrics: ApiMetrics | None = None):
+        self.kind = kind
+        self.started = datetime.now(timezone.utc)
+        self.phases: dict[str, float] = {}
+        self.counts: Counter = Counter()
+        self.result = None
+        self.duration = None
+        self._metrics = metrics
+        self._http_before = metrics.total_requests if metrics else 0
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def count(self, name: str, value: int = 1):
+        self.counts[name] += value
+
+    def finish(self, result: str):
+        self.result = result
+        self.duration = time.perf_counter() - self._start
+        if self._metrics is not None:
+            self.counts["http"] = self._metrics.total_requests - self._http_before
+
+    def as_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "started": self.started.isoformat(),
+            "result": self.result,
+            "duration_s": round(self.duration, 4) if self.duration is not None else None,
+            "phases_s": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "counts": dict(self.counts),
+        }
+
+
+class SyncProfiler:
+    """De senaste synkcyklerna för en entry i en ringbuffert."""
+
+    def __init__(self, size: int, metrics: ApiMetrics | None = None):
+        self.cycles: deque[SyncCycle] = deque(maxlen=size)
+        self._metrics = metrics
+
+    def start(self, kind: str) -> SyncCycle:
+        return SyncCycle(kind, self._metrics)
+
+    def record(self, cycle: SyncCycle, result: str = "ok"):
+        cycle.finish(result)
+        self.cycles.append(cycle)
+
+    def as_dict(self) -> dict:
+        by_kind = {}
+        for cycle in self.cycles:
+            stats = by_kind.setdefault(cycle.kind, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            stats["count"] += 1
+            stats["total_s"] += cycle.duration
+            stats["max_s"] = max(stats["max_s"], cycle.duration)
+        return {
+            "by_kind": {
+                kind: {
+                    "count": stats["count"],
+                    "mean_s": round(stats["total_s"] / stats["count"], 4),
+                    "max_s": round(stats["max_s"], 4),
+                }
+                for kind, stats in by_kind.items()
+            },
+            "cycles": [cycle.as_dict() for cycle in self.cycles],
+        }
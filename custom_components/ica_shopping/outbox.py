@@ -0,0 +1,93 @@
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .const import OUTBOX_SAVE_DELAY, OUTBOX_STORAGE_KEY, OUTBOX_STORAGE_VERSION
+from .sync_queue import OP_ADD
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Skrivkö (write-ahead) för ICA-ändringar, sparad via Store.
+
+    Ändringar från Keep skrivs hit innan de skickas till ICA och tas bort
+    först när ICA har bekräftat dem, så inget försvinner om token eller
+    gatewayen är nere. Kön har högst en operation per normaliserad vara:
+    ett tillägg och en borttagning av samma vara tar ut varandra, så länge
+    ingen tömning har tagit den första – en operation som redan är på väg
+    till ICA ersätts i stället av den nya. Att köra
+    om en operation är ofarligt – tillägg av en vara som redan finns och
+    borttagning av en som saknas blir inga anrop.
+    """
+
+    def __init__(self, hass, entry_id: str, list_id: str):
+        self._store = Store(hass, OUTBOX_STORAGE_VERSION, f"{OUTBOX_STORAGE_KEY}.{entry_id}")
+        self._list_id = list_id
+        self._ops: dict[str, tuple[str, str]] = {}
+        self._in_flight: set[str] = set()
+
+    def __len__(self):
+        return len(self._ops)
+
+    async def async_load(self):
+        try:
+            data = await self._store.async_load()
+        except Exception as e:
+            _LOGGER.warning("⚠️ Kunde inte läsa sparad skrivkö: %s", e)
+            return
+        if not data or data.get("list_id") != self._list_id:
+            return
+        self._ops = {key: (op, text) for key, op, text in data.get("ops", [])}
+        if self._ops:
+            _LOGGER.info("📮 %s ICA-ändringar väntar sedan förra körningen", len(self._ops))
+
+    def pending(self) -> dict:
+        """Kopia av kön som {nyckel: (operation, text)}."""
+        return dict(self._ops)
+
+    @callback
+    def take(self) -> dict:
+        """Kopia av kön för en tömning; nycklarna räknas som på väg till ICA till ack."""
+        self._in_flight = set(self._ops)
+        return dict(self._ops)
+
+    async def async_write(self, ops):
+        """Lägg till operationer och spara innan de körs."""
+        if not ops:
+            return
+        for key, (op, text) in ops.items():
+            previous = self._ops.get(key)
+            if (
+                previous
+                and key not in self._in_flight
+                and (previous[0] == OP_ADD) != (op == OP_ADD)
+            ):
+                # Tillägg och borttagning av samma vara – inget att skicka
+                del self._ops[key]
+                continue
+            self._ops[key] = (op, text)
+        await self._store.async_save(self._data_to_save())
+
+    @callback
+    def ack(self, done):
+        """Ta bort bekräftade operationer som inte har ändrats under tiden.
+
+        Avslutar tömningen: inget räknas längre som på väg till ICA.
+        """
+        self._in_flight = set()
+        removed = False
+        for key, value in done.items():
+            if self._ops.get(key) == value:
+                del self._ops[key]
+                removed = True
+        if removed:
+            self._store.async_delay_save(self._data_to_save, OUTBOX_SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self):
+        return {
+            "list_id": self._list_id,
+            "ops": [[key, op, text] for key, (op, text) in self._ops.items()],
+        }
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+from collections import Counter
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    PURCHASE_HISTORY_MONTHS,
+    PURCHASE_SAVE_DELAY,
+    PURCHASE_STORAGE_KEY,
+    PURCHASE_STORAGE_VERSION,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Kompakt transaktion: [id, datum (YYYY-MM-DD), belopp, rabatt, butik]
+TX_ID, TX_DATE, TX_VALUE, TX_DISCOUNT, TX_STORE = range(5)
+
+
+def months_back(year: int, month: int, count: int) -> list[str]:
+    """De `count` senaste månaderna som "YYYY-MM", äldst först."""
+    months = []
+    for _ in range(count):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months[::-1]
+
+
+def compact_transactions(transactions) -> list[list]:
+    return [
+        [
+            t.get("transactionId"),
+            (t.get("transactionDate") or "")[:10],
+            t.get("transactionValue") or 0,
+            t.get("totalDiscount") or 0,
+            t.get("storeMarketingName") or "",
+        ]
+        for t in transactions
+        if isinstance(t, dict)
+    ]
+
+
+def summarize_month(tx) -> dict:
+    """Summa och butiksbesök för en månad – räknas bara om när månaden ändrats."""
+    return {
+        "total": round(sum(t[TX_VALUE] for t in tx), 2),
+        "stores": dict(Counter(t[TX_STORE] for t in tx if t[TX_STORE])),
+    }
+
+
+class PurchaseHistory:
+    """Köphistorik per konto, månad för månad, sparad via Store.
+
+    En avslutad månad hämtas en sista gång efter månadsskiftet och
+    markeras då som klar; därefter pollas bara innevarande månad.
+    Varje månad har sin egen summering, så totalsummor och butiksfrekvens
+    byggs av högst PURCHASE_HISTORY_MONTHS färdiga delsummor.
+    """
+
+    def __init__(self, hass, session_hash: str):
+        self._store = Store(hass, PURCHASE_STORAGE_VERSION, f"{PURCHASE_STORAGE_KEY}.{session_hash}")
+        self._months: dict[str, dict] = {}
+
+    async def async_load(self):
+        try:
+            data = await self._store.async_load()
+        except Exception as e:
+            _LOGGER.warning("⚠️ Kunde inte läsa sparad köphistorik: %s", e)
+            return
+        if data:
+            self._months = data.get("months", {})
+
+    async def async_update(self, api, year: int, month: int) -> bool:
+        """Hämta det som saknas eller kan ha ändrats. True om något ändrades."""
+        window = months_back(year, month, PURCHASE_HISTORY_MONTHS)
+        current = window[-1]
+        changed = False
+        # Innevarande månad först; nekas den är det ingen idé att fortsätta bakåt
+        for year_month in reversed(window):
+            cached = self._months.get(year_month)
+            if cached and cached.get("final"):
+                continue
+            status, transactions, etag = await api.fetch_purchases(
+                year_month, cached.get("etag") if cached else None
+            )
+            if status == 403:
+                break
+            final = year_month != current
+            if status == 304 and cached:
+                if final:
+                    cached["final"] = True
+                    changed = True
+                continue
+            if transactions is None:
+                continue
+
+            tx = compact_transactions(transactions)
+            fingerprint = hashlib.sha1(
+                "\0".join(str(t[TX_ID]) for t in tx).encode()
+            ).hexdigest()
+            if cached and cached.get("fingerprint") == fingerprint:
+                if final or cached.get("etag") != etag:
+                    cached.update(final=final, etag=etag)
+                    changed = True
+                continue
+
+            self._months[year_month] = {
+                "final": final,
+                "etag": etag,
+                "fingerprint": fingerprint,
+                "tx": tx,
+                **summarize_month(tx),
+            }
+            changed = True
+
+        for year_month in list(self._months):
+            if year_month not in window:
+                del self._months[year_month]
+                changed = True
+
+        if changed:
+            self._store.async_delay_save(self._data_to_save, PURCHASE_SAVE_DELAY)
+        return changed
+
+    def summary(self) -> dict:
+        """Senaste köp, summa per månad och butiksbesök över hela fönstret."""
+        latest = None
+        stores: Counter = Counter()
+        monthly = {}
+        for year_month in sorted(self._months):
+            data = self._months[year_month]
+            monthly[year_month] = data.get("total", 0)
+            stores.update(data.get("stores", {}))
+            for tx in data.get("tx", []):
+                if latest is None or tx[TX_DATE] > latest[TX_DATE]:
+                    latest = tx
+        return {"latest": latest, "monthly_spend": monthly, "store_visits": dict(stores)}
+
+    @callback
+    def _data_to_save(self):
+        return {"months": self._months}
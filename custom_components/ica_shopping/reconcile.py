@@ -0,0 +1,435 @@
+"""Ren diff-logik mellan Keep (todo) och ICA-listan.
+
+Allt här är synkront och utan Home Assistant-beroenden. Varje funktion
+bygger sina index en gång och går igenom varje sida en gång, så en
+avstämning är linjär i antalet varor. Dubbletter räknas som multimängd:
+två "mjölk" i Keep och en i ICA betyder att en "mjölk" saknas i ICA.
+"""
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, field
+
+
+def normalize(text) -> str:
+    """Jämförelsenyckel för en vara: trimmad och gemen."""
+    if not isinstance(text, str):
+        return ""
+    return text.strip().lower()
+
+
+def build_index(entries, text_of) -> dict[str, list]:
+    """Gruppera entries per normaliserad nyckel, i ursprunglig ordning."""
+    index: dict[str, list] = {}
+    for entry in entries:
+        key = normalize(text_of(entry))
+        if key:
+            index.setdefault(key, []).append(entry)
+    return index
+
+
+def row_text(row) -> str:
+    return row.get("text", "") if isinstance(row, dict) else ""
+
+
+def keep_summary(item) -> str:
+    return item.get("summary", "") if isinstance(item, dict) else ""
+
+
+def list_fingerprint(the_list) -> str | None:
+    """Kort hash av en ICA-lista (namn plus raders id, text och avbockning)."""
+    if not isinstance(the_list, dict):
+        return None
+    digest = hashlib.sha1(str(the_list.get("name", "")).encode())
+    for row in the_list.get("rows", []):
+        if isinstance(row, dict):
+            digest.update(f"\0{row.get('id')}\1{row_text(row)}\1{row.get('isStriked')}".encode())
+    return digest.hexdigest()
+
+
+def keep_fingerprint(keep_items) -> str:
+    """Kort hash av Keep-varornas text och status, oberoende av ordning."""
+    digest = hashlib.sha1()
+    for key, status in sorted((normalize(keep_summary(i)), i.get("status", "")) for i in keep_items if isinstance(i, dict)):
+        digest.update(f"\0{key}\1{status}".encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class RefreshPlan:
+    """Resultat av plan_refresh – vad som ska göras på respektive sida."""
+
+    # Keep-varor med status completed som ska bort ur Keep
+    keep_remove_completed: list[str] = field(default_factory=list)
+    # ICA-texter som saknas i Keep
+    keep_add: list[str] = field(default_factory=list)
+    # Keep-varor som inte (längre) finns i ICA
+    keep_remove: list[str] = field(default_factory=list)
+    # uid (eller text om uid saknas) för allt i keep_remove_completed och keep_remove
+    keep_remove_uids: list[str] = field(default_factory=list)
+    # ICA-rader att radera: row_id -> (text, anledning)
+    ica_remove: dict[str, tuple[str, str]] = field(default_factory=dict)
+    # Keep-texter som saknas i ICA (bara vid trevägsavstämning)
+    ica_add: list[str] = field(default_factory=list)
+    # Nycklar som planerades men hoppades över pga nyligen borttagna i Keep
+    skipped: list[str] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (
+            self.keep_remove_completed
+            or self.keep_add
+            or self.keep_remove
+            or self.ica_remove
+            or self.ica_add
+        )
+
+    def as_dict(self) -> dict:
+        """Planen som svarsdata (dry run); uid:n är interna och tas inte med."""
+        return {
+            "keep_add": list(self.keep_add),
+            "keep_remove": list(self.keep_remove),
+            "keep_remove_completed": list(self.keep_remove_completed),
+            "ica_add": list(self.ica_add),
+            "ica_remove": [
+                {"row_id": row_id, "text": text, "reason": reason}
+                for row_id, (text, reason) in self.ica_remove.items()
+            ],
+            "skipped": list(self.skipped),
+        }
+
+
+def plan_keep_to_ica(keep_summaries, ica_rows, space: int, base=None) -> list[str]:
+    """Keep-texter som saknas i ICA, högst `space` stycken.
+
+    Med en `base` (senast synkade poster) räknas bara det som lagts till i
+    Keep sedan dess – det som raderats i ICA återuppstår inte.
+    """
+    if space <= 0:
+        return []
+    remaining = Counter(normalize(row_text(r)) for r in ica_rows)
+    if base is not None:
+        remaining |= Counter(e.get("key") for e in base)
+    to_add = []
+    for text in keep_summaries:
+        key = normalize(text)
+        if not key:
+            continue
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            continue
+        to_add.append(text.strip())
+        if len(to_add) >= space:
+            break
+    return to_add
+
+
+def plan_refresh(
+    ica_rows,
+    keep_items,
+    recent_removes=(),
+    remove_striked: bool = True,
+    max_keep_add: int | None = None,
+) -> RefreshPlan:
+    """Tvåvägsavstämning där ICA styr, utom för det som nyss togs bort i Keep.
+
+    `ica_rows` ska redan vara rensad från avbockade rader som raderas.
+    """
+    plan = RefreshPlan()
+    recent_removes = {normalize(t) for t in recent_removes}
+
+    ica_index = build_index(ica_rows, row_text)
+    keep_index = build_index(keep_items, keep_summary)
+
+    # ICA-rader som fortfarande kan matchas mot en radering
+    available_rows = {
+        key: [r.get("id") for r in rows if r.get("id")] for key, rows in ica_index.items()
+    }
+
+    # 1️⃣ Completed i Keep → bort ur Keep (om remove_striked) och ur ICA
+    completed_ids = set()
+    for key, items in keep_index.items():
+        for item in items:
+            if item.get("status") != "completed":
+                continue
+            completed_ids.add(id(item))
+            if remove_striked:
+                plan.keep_remove_completed.append(item.get("summary") or key)
+                plan.keep_remove_uids.append(item.get("uid") or item.get("summary") or key)
+            ids = available_rows.get(key)
+            if ids:
+                plan.ica_remove[ids.pop()] = (key, "Keep: completed")
+
+    # 2️⃣ Saknas i Keep → lägg till, om det inte nyss tagits bort där
+    for key, rows in ica_index.items():
+        missing = len(rows) - len(keep_index.get(key, ()))
+        if missing <= 0:
+            continue
+        if key in recent_removes:
+            plan.skipped.append(key)
+            continue
+        plan.keep_add.extend(row_text(r).strip() for r in rows[-missing:])
+
+    if max_keep_add is not None:
+        plan.keep_add = plan.keep_add[:max(0, max_keep_add)]
+
+    # 3️⃣ Finns i Keep men inte i ICA → ta bort ur Keep
+    for key, items in keep_index.items():
+        excess = len(items) - len(ica_index.get(key, ()))
+        if excess <= 0:
+            continue
+        for item in items[-excess:]:
+            if remove_striked and id(item) in completed_ids:
+                continue  # tas redan bort i steg 1
+            summary = item.get("summary")
+            if summary:
+                plan.keep_remove.append(summary)
+                plan.keep_remove_uids.append(item.get("uid") or summary)
+
+    # 4️⃣ Nyss borttaget i Keep men kvar i ICA → radera i ICA
+    for key in recent_removes:
+        ids = available_rows.get(key)
+        if ids:
+            row_id = ids.pop()
+            plan.ica_remove.setdefault(row_id, (key, "Keep-radering"))
+
+    return plan
+
+
+def _merge_count(base: int, ica: int, keep: int) -> int:
+    """Önskat antal av en nyckel efter en trevägsmerge."""
+    if ica == keep:
+        return ica
+    if keep == base:
+        return ica  # bara ICA har ändrats
+    if ica == base:
+        return keep  # bara Keep har ändrats
+    if ica > base and keep > base:
+        return max(ica, keep)  # lagts till på båda håll
+    if ica < base and keep < base:
+        return min(ica, keep)  # tagits bort på båda håll
+    return max(0, ica + keep - base)
+
+
+def plan_three_way(
+    base,
+    ica_rows,
+    keep_items,
+    remove_striked: bool = True,
+    max_keep_add: int | None = None,
+    ica_space: int | None = None,
+) -> RefreshPlan:
+    """Trevägsavstämning mot senast synkade `base` ([{"key", ...}]).
+
+    Bara nycklar som ändrats på någon sida sedan basen ger åtgärder, så en
+    oförändrad lista ger en tom plan.
+    """
+    plan = RefreshPlan()
+    base_counts = Counter(e.get("key") for e in base)
+
+    ica_index = build_index(ica_rows, row_text)
+    keep_index = build_index(keep_items, keep_summary)
+    available_rows = {
+        key: [r.get("id") for r in rows if r.get("id")] for key, rows in ica_index.items()
+    }
+
+    # Completed i Keep raderar sin ICA-rad direkt och räknas inte som aktiv
+    active_keep: dict[str, list] = {}
+    claimed: Counter = Counter()
+    for key, items in keep_index.items():
+        for item in items:
+            if item.get("status") != "completed":
+                active_keep.setdefault(key, []).append(item)
+                continue
+            if remove_striked:
+                plan.keep_remove_completed.append(item.get("summary") or key)
+                plan.keep_remove_uids.append(item.get("uid") or item.get("summary") or key)
+            ids = available_rows.get(key)
+            if ids:
+                plan.ica_remove[ids.pop()] = (key, "Keep: completed")
+                claimed[key] += 1
+
+    for key in ica_index.keys() | active_keep.keys() | base_counts.keys():
+        ica_rows_for_key = ica_index.get(key, [])
+        keep_for_key = active_keep.get(key, [])
+        ica_count = len(ica_rows_for_key) - claimed[key]
+        keep_count = len(keep_for_key)
+        base_count = max(0, base_counts[key] - claimed[key])
+        target = _merge_count(base_count, ica_count, keep_count)
+
+        if target > ica_count:
+            texts = [keep_summary(i).strip() for i in keep_for_key]
+            plan.ica_add.extend(texts[-(target - ica_count):])
+        elif target < ica_count:
+            ids = available_rows.get(key, [])
+            for _ in range(ica_count - target):
+                if not ids:
+                    break
+                plan.ica_remove.setdefault(ids.pop(), (key, "Keep-radering"))
+
+        if target > keep_count:
+            plan.keep_add.extend(row_text(r).strip() for r in ica_rows_for_key[-(target - keep_count):])
+        elif target < keep_count:
+            for item in keep_for_key[-(keep_count - target):]:
+                summary = item.get("summary")
+                if summary:
+                    plan.keep_remove.append(summary)
+                    plan.keep_remove_uids.append(item.get("uid") or summary)
+
+    if max_keep_add is not None:
+        plan.keep_add = plan.keep_add[:max(0, max_keep_add)]
+    if ica_space is not None:
+        plan.ica_add = plan.ica_add[:max(0, ica_space)]
+    return plan
+
+
+def synced_snapshot(
+    ica_rows,
+    keep_items,
+    removed_row_ids=(),
+    added_texts=(),
+    keep_added=(),
+    keep_removed=(),
+) -> list[dict]:
+    """Ny bas efter en körning: det som finns på båda sidor när den är klar.
+
+    ICA-rader som finns kvar tas med högst så många gånger per nyckel som
+    varan finns i Keep efter körningen (aktiva varor minus `keep_removed`,
+    uid eller text, plus `keep_added`). En rad som inte speglades till Keep,
+    t.ex. för att max_keep_add tog slut, hamnar alltså inte i basen och
+    tolkas inte som raderad i Keep nästa gång. `added_texts` kom från Keep
+    och tas alltid med.
+
+    Varje post får Keep-uid från en aktiv Keep-vara med samma nyckel om
+    en sådan finns; nya ICA-rader saknar ännu row_id.
+    """
+    removed = set(removed_row_ids)
+    keep_removed = set(keep_removed)
+    uids: dict[str, list] = {}
+    in_keep: Counter = Counter()
+    for item in keep_items:
+        if not isinstance(item, dict) or item.get("status") == "completed":
+            continue
+        if item.get("uid") in keep_removed or item.get("summary") in keep_removed:
+            continue
+        key = normalize(keep_summary(item))
+        uids.setdefault(key, []).append(item.get("uid"))
+        in_keep[key] += 1
+    in_keep.update(normalize(text) for text in keep_added)
+
+    snapshot = []
+
+    def _append(text, row_id):
+        key = normalize(text)
+        if not key:
+            return
+        key_uids = uids.get(key)
+        snapshot.append({
+            "key": key,
+            "text": text.strip(),
+            "row_id": row_id,
+            "uid": key_uids.pop(0) if key_uids else None,
+        })
+
+    for row in ica_rows:
+        if not isinstance(row, dict) or row.get("id") in removed:
+            continue
+        key = normalize(row_text(row))
+        if in_keep[key] <= 0:
+            continue  # finns inte i Keep – inte synkad
+        in_keep[key] -= 1
+        _append(row_text(row), row.get("id"))
+    for text in added_texts:
+        _append(text, None)
+    return snapshot
+
+
+def list_after(the_list, removed_row_ids=(), added_texts=()) -> dict:
+    """Kopia av en ICA-lista med raderade rader borta och nya rader tillagda."""
+    removed = set(removed_row_ids)
+    rows = [
+        row for row in the_list.get("rows", [])
+        if not (isinstance(row, dict) and row.get("id") in removed)
+    ]
+    rows.extend({"text": text} for text in added_texts)
+    return {**the_list, "rows": rows}
+
+
+def plan_operations(ops, ica_rows, space: int):
+    """Översätt en sammanslagen operationslogg till ICA-ändringar.
+
+    `ops` är {nyckel: (operation, text)} där operation är "add", "remove"
+    eller "complete". Returnerar (texter att lägga till, {row_id: (text, anledning)},
+    nycklar för tillägg som inte fick plats i `space`).
+    """
+    ica_index = build_index(ica_rows, row_text)
+    to_add = []
+    to_remove = {}
+    deferred = []
+    for key, (op, text) in ops.items():
+        rows = ica_index.get(key)
+        if op == "add":
+            if rows:
+                continue
+            if len(to_add) < max(0, space):
+                to_add.append(text)
+            else:
+                deferred.append(key)
+            continue
+        row_id = next((r.get("id") for r in reversed(rows or []) if r.get("id")), None)
+        if row_id:
+            reason = "Keep: completed" if op == "complete" else "Keep-radering"
+            to_remove[row_id] = (key, reason)
+    return to_add, to_remove, deferred
+
+
+def plan_bulk_add(texts, ica_rows, space: int):
+    """Planera ica_shopping.add_items mot en snapshot.
+
+    Returnerar (texter att lägga till, resultat per inskickad text). Resultatet
+    är None för det som ska skickas till ICA, annars "invalid", "exists",
+    "duplicate" eller "list_full".
+    """
+    existing = build_index(ica_rows, row_text)
+    seen = set()
+    to_add = []
+    results = []
+    for text in texts:
+        key = normalize(text)
+        if not key:
+            results.append("invalid")
+        elif key in existing:
+            results.append("exists")
+        elif key in seen:
+            results.append("duplicate")
+        elif len(to_add) >= max(0, space):
+            results.append("list_full")
+        else:
+            seen.add(key)
+            to_add.append(text.strip())
+            results.append(None)
+    return to_add, results
+
+
+def plan_bulk_remove(texts, ica_rows):
+    """Planera ica_shopping.remove_items: alla rader med samma text tas bort.
+
+    Returnerar ({nyckel: [row_id]}, resultat per inskickad text) där
+    resultatet är None för det som ska raderas, annars "invalid",
+    "duplicate" eller "not_found".
+    """
+    existing = build_index(ica_rows, row_text)
+    to_remove = {}
+    results = []
+    for text in texts:
+        key = normalize(text)
+        row_ids = [r.get("id") for r in existing.get(key, []) if r.get("id")]
+        if not key:
+            results.append("invalid")
+        elif key in to_remove:
+            results.append("duplicate")
+        elif not row_ids:
+            results.append("not_found")
+        else:
+            to_remove[key] = row_ids
+            results.append(None)
+    return to_remove, results
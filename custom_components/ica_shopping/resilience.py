@@ -0,0 +1,100 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+class CircuitOpenError(Exception):
+    """ICA-värden har svarat med fel för många gånger i rad – anropet görs inte."""
+
+
+class CircuitBreaker:
+    """Enkel circuit breaker per värd.
+
+    Efter `threshold` fel i rad öppnas kretsen och alla anrop misslyckas
+    direkt i `reset_timeout` sekunder. Därefter släpps ett testanrop
+    igenom (half-open); lyckas det stängs kretsen igen.
+    """
+
+    def __init__(self, host: str, threshold: int, reset_timeout: float):
+        self.host = host
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_request(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError(f"Circuit öppen för {self.host}")
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """Testanropet avbröts utan svar om värden – släpp nästa i stället."""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_in_flight = False
+        if self._opened_at is not None or self._failures >= self._threshold:
+            self._opened_at = time.monotonic()
+
+
+class RateBudget:
+    """Tak för samtidiga anrop och jämn takt (token bucket) mot ICA."""
+
+    def __init__(self, max_concurrent: int, per_second: float):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._interval = 1 / per_second if per_second > 0 else 0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        if self._interval:
+            async with self._lock:
+                now = time.monotonic()
+                wait = self._next_slot - now
+                self._next_slot = max(now, self._next_slot) + self._interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+def parse_retry_after(value) -> float | None:
+    """Retry-After som sekunder eller HTTP-datum, annars None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: float | None = None) -> float:
+    """Exponentiell backoff med full jitter; Retry-After vinner om den finns."""
+    if retry_after is not None:
+        return min(retry_after, cap)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -1,41 +1,64 @@
 import logging
-from datetime import timedelta
 from homeassistant.components.sensor import SensorEntity
-from .const import DOMAIN, DATA_ICA
-import asyncio  # lägg i toppen om inte redan finns
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from .const import DOMAIN, MAX_ICA_ITEMS
+from .purchases import TX_DATE, TX_DISCOUNT, TX_ID, TX_STORE, TX_VALUE
 from homeassistant.helpers.entity import EntityCategory
 
 _LOGGER = logging.getLogger(__name__)
-SCAN_INTERVAL = timedelta(minutes=60)
 
 
 async def async_setup_entry(hass, entry, async_add_entities):
     _LOGGER.debug("📡 sensor.async_setup_entry startar...")
 
-    api = hass.data[DOMAIN][DATA_ICA]
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    api = entry_data["api"]
+    coordinator = entry_data["coordinator"]
     list_id = entry.options.get("ica_list_id", entry.data["ica_list_id"])
     session_id = entry.options.get("session_id", entry.data["session_id"])
-    
-    try:
-        list_name = await asyncio.wait_for(api.get_list_name(list_id), timeout=10)
-    except Exception as e:
-        _LOGGER.error("🚫 Misslyckades hämta listnamn: %s", e)
-        list_name = "Okänd lista"
-        
-
-
-    async_add_entities([
-        ShoppingListSensor(hass, api, list_id, list_name),
-        ICATokenSensor(hass, api, session_id, list_id, list_name),
-        #ICALastPurchaseSensor(hass, api, list_id, list_name, session_id)
-    ], False)
-
-class ShoppingListSensor(SensorEntity):
-    def __init__(self, hass, api, list_id, list_name):
-        self.hass = hass
-        self._api = api
+
+    # Namnet kommer från coordinatorn (hämtad eller sparad lista) – ingen egen list/all
+    the_list = coordinator.get_list(list_id)
+    list_name = the_list.get("name", f"Lista {list_id}") if the_list else "Okänd lista"
+
+    legacy_attributes = entry.options.get("legacy_attributes", False)
+
+    entities = [
+        ShoppingListSensor(coordinator, list_id, list_name, legacy_attributes),
+        ICATokenSensor(coordinator, session_id, list_id, list_name),
+    ]
+    purchases = entry_data.get("purchases")
+    if purchases is not None:
+        entities += [
+            ICALastPurchaseSensor(purchases, list_id, list_name),
+            ICAMonthlySpendSensor(purchases, list_id, list_name),
+            ICAStoreFrequencySensor(purchases, list_id, list_name),
+        ]
+    if entry.options.get("diagnostic_sensors", False):
+        entities += [
+            ICAApiStatsSensor(coordinator, api, list_id, list_name, "requests"),
+            ICAApiStatsSensor(coordinator, api, list_id, list_name, "latency"),
+        ]
+    async_add_entities(entities, False)
+
+class ShoppingListSensor(CoordinatorEntity, SensorEntity):
+    """Antal varor i listan, med varorna som ett listattribut.
+
+    Med `legacy_attributes` skrivs i stället ett attribut per vara
+    (vara_1 … vara_N) för äldre dashboards. Inget av varuattributen
+    sparas i recordern.
+    """
+
+    _unrecorded_attributes = frozenset(
+        {"items", "row_ids", "striked"} | {f"vara_{i}" for i in range(1, MAX_ICA_ITEMS + 1)}
+    )
+
+    def __init__(self, coordinator, list_id, list_name, legacy_attributes=False):
+        super().__init__(coordinator)
         self._list_id = list_id
         self._list_name = list_name
+        self._legacy_attributes = legacy_attributes
 
         self._attr_unique_id = f"shoppinglist_{self._list_id}"  # 👈 Detta är nyckeln
         self._attr_name = "Shoppinglist"
@@ -43,168 +66,205 @@ class ShoppingListSensor(SensorEntity):
         self._attr_has_entity_name = True
         self._attr_native_value = None
         self._attr_extra_state_attributes = {}
+        self._fingerprint = None
 
         self._attr_device_info = {
             "identifiers": {(DOMAIN, self._list_id)},
             "name": f"ICA – {self._list_name}",
             "manufacturer": "ICA",
         }
-        _LOGGER.debug("✅ Uppdatering klar för %s", self._attr_name)
 
     def _update_state(self, data):
         items = data.get("rows", [])
-        _LOGGER.debug("📦 Items i lista %s: %s", self._list_id, items)
+        _LOGGER.debug("📦 %s varor i lista %s", len(items), self._list_id)
         self._attr_native_value = len(items)
 
         attributes = {
             "list_name": data.get("name", "")
         }
-        for i, item in enumerate(items, start=1):
-            attributes[f"vara_{i}"] = item.get("text", "")
+        if self._legacy_attributes:
+            for i, item in enumerate(items, start=1):
+                attributes[f"vara_{i}"] = item.get("text", "")
+        else:
+            attributes["items"] = [item.get("text", "") for item in items]
+            attributes["row_ids"] = [item.get("id") for item in items]
+            # Index (0-baserade) för avbockade rader i stället för en flagga per rad
+            attributes["striked"] = [i for i, item in enumerate(items) if item.get("isStriked")]
 
         self._attr_extra_state_attributes = attributes
 
+    @callback
+    def _handle_coordinator_update(self):
+        # Samma innehåll som senast → inga nya attribut och ingen state-skrivning
+        fingerprint = (
+            self.coordinator.get_fingerprint(self._list_id),
+            self.coordinator.last_update_success,
+        )
+        if fingerprint[0] is not None and fingerprint == self._fingerprint:
+            return
+        the_list = self.coordinator.get_list(self._list_id)
+        if the_list is not None:
+            self._update_state(the_list)
+            self._fingerprint = fingerprint
+        super()._handle_coordinator_update()
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
 
-    async def async_update(self):
-        _LOGGER.debug("🔄 async_update för lista %s", self._list_id)
-        try:
-            try:
-                the_list = await asyncio.wait_for(self._api.get_list_by_id(self._list_id), timeout=10)
-                _LOGGER.debug("📋 Innehåll från get_list_by_id: %s", the_list)
-            except asyncio.TimeoutError:
-                _LOGGER.error("⏱️ Timeout vid hämtning av ICA-lista %s.", self._list_id)
-                return
+        async def handle_refresh(event):
+            await self.coordinator.async_request_refresh()
 
-            if the_list is None:
-                _LOGGER.warning("❌ Kunde inte hitta lista med ID %s", self._list_id)
-                return
+        self.async_on_remove(self.hass.bus.async_listen("ica_shopping_refresh", handle_refresh))
 
+        the_list = self.coordinator.get_list(self._list_id)
+        if the_list is not None:
             self._update_state(the_list)
-            _LOGGER.debug("✅ Uppdatering klar för %s", self._attr_name)
+            self._fingerprint = (
+                self.coordinator.get_fingerprint(self._list_id),
+                self.coordinator.last_update_success,
+            )
+
+class ICAPurchaseSensorBase(CoordinatorEntity, SensorEntity):
+    """Gemensamt för sensorerna som läser köphistoriken."""
+
+    def __init__(self, coordinator, list_id, list_name, key, name):
+        super().__init__(coordinator)
+        self._attr_unique_id = f"ica_{key}_{list_id}"
+        self._attr_name = name
+        self._attr_has_entity_name = True
+        self._attr_device_info = {
+            "identifiers": {(DOMAIN, list_id)},
+            "name": f"ICA – {list_name}",
+            "manufacturer": "ICA",
+        }
 
-        except Exception as e:
-            _LOGGER.error("💥 Fel i sensor async_update: %s", e)
+    @property
+    def available(self):
+        # Sparad historik duger även när senaste hämtningen misslyckades
+        return self.coordinator.data is not None
+
+    @property
+    def _purchases(self):
+        return self.coordinator.data or {}
+
+
+class ICALastPurchaseSensor(ICAPurchaseSensorBase):
+    def __init__(self, coordinator, list_id, list_name):
+        super().__init__(coordinator, list_id, list_name, "last_purchase", "Last Purchase")
+
+    @property
+    def native_value(self):
+        latest = self._purchases.get("latest")
+        return latest[TX_DATE] if latest else "Inga köp"
+
+    @property
+    def extra_state_attributes(self):
+        latest = self._purchases.get("latest")
+        if not latest:
+            return {}
+        return {
+            "transaction_id": latest[TX_ID],
+            "belopp": latest[TX_VALUE],
+            "rabatt": latest[TX_DISCOUNT],
+            "butik": latest[TX_STORE],
+        }
 
-    async def async_added_to_hass(self):
-        async def handle_refresh(event):
-            await self.async_update_ha_state(force_refresh=True)
 
+class ICAMonthlySpendSensor(ICAPurchaseSensorBase):
+    """Summa för innevarande månad; alla månader i fönstret som attribut."""
 
-        self._unsub_dispatcher = self.hass.bus.async_listen("ica_shopping_refresh", handle_refresh)
+    _unrecorded_attributes = frozenset({"months"})
 
-        # 🔁 Tvinga manuell första uppdatering direkt
-        await self.async_update()
-        await self.async_update_ha_state(force_refresh=True)
+    def __init__(self, coordinator, list_id, list_name):
+        super().__init__(coordinator, list_id, list_name, "monthly_spend", "Monthly Spend")
+        self._attr_native_unit_of_measurement = "SEK"
 
+    @property
+    def native_value(self):
+        data = self._purchases
+        return data.get("monthly_spend", {}).get(data.get("current_month"), 0)
 
+    @property
+    def extra_state_attributes(self):
+        return {"months": self._purchases.get("monthly_spend", {})}
 
 
+class ICAStoreFrequencySensor(ICAPurchaseSensorBase):
+    """Butiken med flest köp i fönstret; besök per butik som attribut."""
 
-    async def async_will_remove_from_hass(self):
-        if hasattr(self, "_unsub_dispatcher"):
-            self._unsub_dispatcher()
+    _unrecorded_attributes = frozenset({"visits"})
 
-from datetime import datetime
-import aiohttp
+    def __init__(self, coordinator, list_id, list_name):
+        super().__init__(coordinator, list_id, list_name, "favorite_store", "Favorite Store")
 
-class ICALastPurchaseSensor(SensorEntity):
-    
+    @property
+    def native_value(self):
+        visits = self._purchases.get("store_visits", {})
+        return max(visits, key=visits.get) if visits else None
 
-    def __init__(self, hass, api, list_id, list_name, session_id):
-        self.hass = hass
-        self._api = api
+    @property
+    def extra_state_attributes(self):
+        visits = self._purchases.get("store_visits", {})
+        return {"visits": dict(sorted(visits.items(), key=lambda kv: -kv[1]))}
+
+
+class ICATokenSensor(CoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, session_id, list_id, list_name):
+        super().__init__(coordinator)
+        self._session_id = session_id
         self._list_id = list_id
         self._list_name = list_name
-        self._session_id = session_id
-        self._attr_unique_id = f"ica_last_purchase_{self._list_id}"
-        self._attr_name = "Last Purchase"
+
+        self._attr_unique_id = f"ica_token_{list_id}"
+        self._attr_name = "Access Token"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
         self._attr_native_value = None
         self._attr_has_entity_name = True
         self._attr_extra_state_attributes = {}
+
         self._attr_device_info = {
-            "identifiers": {(DOMAIN, self._list_id)},
-            "name": f"ICA – {self._list_name}",
+            "identifiers": {(DOMAIN, list_id)},
+            "name": f"ICA – {list_name}",
             "manufacturer": "ICA",
         }
 
-    async def async_added_to_hass(self):
-        async def handle_refresh(event):
-            await self.async_update_ha_state(force_refresh=True)
-
-        self._unsub_dispatcher = self.hass.bus.async_listen("ica_shopping_refresh", handle_refresh)
-
-    async def async_will_remove_from_hass(self):
-        if hasattr(self, "_unsub_dispatcher"):
-            self._unsub_dispatcher()
-
-    async def async_update(self):
-        _LOGGER.warning("🚨 async_update körs för %s", self._attr_name)
-
-        try:
-            token = await asyncio.wait_for(self._api._get_token_from_session_id(), timeout=10)
-            _LOGGER.warning("🧪 Token mottagen: %s", token)
-            _LOGGER.warning("🍪 Session ID som används: %s", self._api.session_id)
-
-            if not token:
-                _LOGGER.error("❌ Token är None – avbryter.")
-                return
-
-            now = datetime.now()
-            url = f"https://www.ica.se/api/cpa/purchases/historical/me/byyearmonth/{now.strftime('%Y-%m')}"
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Accept": "application/json",
-                "Cookie": f"thSessionId={self._session_id}"
-            }
-
-            _LOGGER.debug("🌐 Request till: %s", url)
-            _LOGGER.debug("🧾 Headers: %s", headers)
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=10) as resp:
-                    if resp.status == 403:
-                        _LOGGER.warning("❌ Åtkomst nekad (403) vid hämtning av köphistorik – ignorerar.")
-                        return
-                    elif resp.status != 200:
-                        _LOGGER.error("❌ Ovänntat fel (%s) vid hämtning av köphistorik", resp.status)
-                        return
-
-                    data = await resp.json()
-                    transactions = data.get("transactions", [])
-                    if not transactions:
-                        self._attr_native_value = "Inga köp"
-                        self._attr_extra_state_attributes = {}
-                        return
-
-                    latest = transactions[0]
-                    self._attr_native_value = latest["transactionDate"][:10]
-                    self._attr_extra_state_attributes = {
-                        "transaction_id": latest["transactionId"],
-                        "belopp": latest["transactionValue"],
-                        "rabatt": latest["totalDiscount"],
-                        "butik": latest["storeMarketingName"],
-                    }
-
-        except asyncio.TimeoutError:
-            _LOGGER.error("⏱️ Timeout vid hämtning av token eller köpinfo.")
-        except Exception as e:
-            _LOGGER.error("🔥 Ovänterat fel i async_update: %s", e)
-
-
-class ICATokenSensor(SensorEntity):
-    def __init__(self, hass, api, session_id, list_id, list_name):
-        self.hass = hass
+    @property
+    def available(self):
+        return True  # visar ❌ i stället för unavailable när token saknas
+
+    @callback
+    def _handle_coordinator_update(self):
+        # Skriv bara state när token faktiskt har bytts
+        token = self.native_value
+        if token == self._attr_native_value:
+            return
+        self._attr_native_value = token
+        super()._handle_coordinator_update()
+
+    @property
+    def native_value(self):
+        return (self.coordinator.data or {}).get("token") or "❌"
+
+
+class ICAApiStatsSensor(CoordinatorEntity, SensorEntity):
+    """HTTP-statistik för ICA-kontot: antal anrop eller medellatens.
+
+    Uppdateras i takt med coordinatorn; hela uppdelningen per endpoint
+    finns i diagnostiken.
+    """
+
+    _unrecorded_attributes = frozenset({"statuses"})
+
+    def __init__(self, coordinator, api, list_id, list_name, kind):
+        super().__init__(coordinator)
         self._api = api
-        self._session_id = session_id
-        self._list_id = list_id
-        self._list_name = list_name
+        self._kind = kind
 
-        self._attr_unique_id = f"ica_token_{list_id}"
-        self._attr_name = "Access Token"
+        self._attr_unique_id = f"ica_api_{kind}_{list_id}"
+        self._attr_name = "API requests" if kind == "requests" else "API latency"
+        self._attr_native_unit_of_measurement = "requests" if kind == "requests" else "ms"
         self._attr_entity_category = EntityCategory.DIAGNOSTIC
-        self._attr_native_value = None
         self._attr_has_entity_name = True
-        self._attr_extra_state_attributes = {}
 
         self._attr_device_info = {
             "identifiers": {(DOMAIN, list_id)},
@@ -212,10 +272,31 @@ class ICATokenSensor(SensorEntity):
             "manufacturer": "ICA",
         }
 
-    async def async_update(self):
-        token = await self._api._get_token_from_session_id()
-        self._attr_native_value = token or "❌"
-
-    async def async_added_to_hass(self):
-        await self.async_update()
-        await self.async_update_ha_state(force_refresh=True)
\ No newline at end of file
+    @property
+    def available(self):
+        return True  # statistiken finns även när senaste hämtningen misslyckades
+
+    @property
+    def native_value(self):
+        metrics = self._api.metrics
+        if self._kind == "requests":
+            return metrics.total_requests
+        mean = metrics.mean_latency
+        return round(mean * 1000, 1) if mean is not None else None
+
+    @property
+    def extra_state_attributes(self):
+        metrics = self._api.metrics
+        if self._kind != "requests":
+            return {"max_ms": round(max((s.latency_max for s in metrics.endpoints.values()), default=0) * 1000, 1)}
+        statuses = {}
+        for stats in metrics.endpoints.values():
+            for status, count in stats.statuses.items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+        return {
+            "errors": sum(s.errors for s in metrics.endpoints.values()),
+            "retries": sum(s.retries for s in metrics.endpoints.values()),
+            "bytes_received": sum(s.bytes_received for s in metrics.endpoints.values()),
+            "token_refreshes": metrics.token_refreshes,
+            "statuses": statuses,
+        }
@@ -0,0 +1,109 @@
+import time
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .reconcile import normalize
+
+OP_ADD = "add"
+OP_REMOVE = "remove"
+OP_COMPLETE = "complete"
+
+
+class OperationLog:
+    """Avlyssnade Keep-ändringar sedan senaste synk, sammanslagna per vara.
+
+    Senaste operationen per normaliserad nyckel vinner. Ett add som var
+    fönstrets första operation för varan tar ut ett senare remove; ersatte
+    det en tidigare borttagning står borttagningen kvar. Om något event inte gick att
+    tolka helt blir loggen ofullständig och synken måste läsa hela Keep.
+    """
+
+    def __init__(self):
+        self._ops: dict[str, tuple[str, str]] = {}
+        self._new_keys: set[str] = set()  # första operationen var ett add
+        self._complete = True
+
+    def __len__(self):
+        return len(self._ops)
+
+    @property
+    def complete(self) -> bool:
+        return self._complete
+
+    def record(self, op: str, text: str):
+        key = normalize(text)
+        if not key:
+            self._complete = False
+            return
+        previous = self._ops.get(key)
+        if previous is None:
+            if op == OP_ADD:
+                self._new_keys.add(key)
+        elif op != OP_ADD and key in self._new_keys:
+            # Lades till och togs bort inom samma fönster – inget att synka
+            del self._ops[key]
+            self._new_keys.discard(key)
+            return
+        self._ops[key] = (op, text.strip())
+
+    def mark_incomplete(self):
+        self._complete = False
+
+    def drain(self):
+        """Returnera (ops, complete) och börja om med en tom logg."""
+        ops, complete = self._ops, self._complete
+        self._ops = {}
+        self._new_keys = set()
+        self._complete = True
+        return ops, complete
+
+
+class SyncDebouncer:
+    """Debounce med tyst period och maxväntetid.
+
+    Varje nytt event skjuter upp körningen `quiet` sekunder, men aldrig
+    längre än `max_wait` sekunder efter första eventet i skuren.
+    """
+
+    def __init__(self, hass, quiet: float, max_wait: float, action):
+        self._hass = hass
+        self._quiet = quiet
+        self._max_wait = max_wait
+        self._action = action
+        self._unsub = None
+        self._due = None
+        self._pinned = False
+        self._first_event = None
+
+    @callback
+    def async_schedule(self, quiet: float | None = None):
+        """Planera körning; `quiet` kan korta den tysta perioden för brådskande event."""
+        now = time.monotonic()
+        if self._first_event is None:
+            self._first_event = now
+        deadline = self._first_event + self._max_wait
+        delay = max(0.0, min(self._quiet if quiet is None else quiet, deadline - now))
+        if self._unsub:
+            if self._pinned and self._due <= now + delay:
+                return  # ett brådskande event har redan planerat tidigare än så
+            self._unsub()
+        self._due = now + delay
+        self._pinned = quiet is not None
+        self._unsub = async_call_later(self._hass, delay, self._fire)
+
+    async def _fire(self, _now=None):
+        self._unsub = None
+        self._due = None
+        self._pinned = False
+        self._first_event = None
+        await self._action()
+
+    @callback
+    def async_cancel(self):
+        if self._unsub:
+            self._unsub()
+            self._unsub = None
+        self._due = None
+        self._pinned = False
+        self._first_event = None
@@ -0,0 +1,99 @@
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .const import STORAGE_KEY, STORAGE_VERSION, SYNC_STATE_SAVE_DELAY
+from .reconcile import normalize
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SyncState:
+    """Senast synkade ögonblicksbild av en lista, sparad via Store.
+
+    Används som bas för trevägsavstämningen i refresh så att poster som
+    raderats på ena sidan inte återuppstår efter omstart eller reload.
+    Senast hämtade ICA-lista sparas också, så att sensorerna kan visas
+    direkt vid start innan första hämtningen är klar.
+    """
+
+    def __init__(self, hass, entry_id: str, list_id: str):
+        self._store = Store(hass, STORAGE_VERSION, f"{STORAGE_KEY}.{entry_id}")
+        self._list_id = list_id
+        self._entries = None
+        self._last_list = None
+        self._list_fingerprint = None
+
+    async def async_load(self):
+        try:
+            data = await self._store.async_load()
+        except Exception as e:
+            _LOGGER.warning("⚠️ Kunde inte läsa sparat synk-tillstånd: %s", e)
+            return
+        if not data:
+            return
+        if data.get("list_id") != self._list_id:
+            _LOGGER.debug("ℹ️ Sparat synk-tillstånd gäller annan lista – ignoreras")
+            return
+        self._entries = data.get("items")
+        self._last_list = data.get("list")
+        self._list_fingerprint = data.get("list_fingerprint")
+        _LOGGER.debug("💾 Läste synk-tillstånd med %s poster", len(self._entries or []))
+
+    @property
+    def base(self):
+        """Senast synkade poster, eller None om ingen bas finns ännu."""
+        return self._entries
+
+    @property
+    def last_list(self):
+        """Senast kända ICA-lista, eller None."""
+        return self._last_list
+
+    @callback
+    def remember_list(self, the_list, fingerprint):
+        if fingerprint == self._list_fingerprint:
+            return
+        self._last_list = the_list
+        self._list_fingerprint = fingerprint
+        self._schedule_save()
+
+    @callback
+    def replace(self, entries):
+        self._entries = list(entries)
+        self._schedule_save()
+
+    @callback
+    def add(self, texts):
+        if self._entries is None:
+            return
+        for text in texts:
+            key = normalize(text)
+            if key:
+                self._entries.append({"key": key, "text": text.strip(), "row_id": None, "uid": None})
+        self._schedule_save()
+
+    @callback
+    def discard(self, keys):
+        """Ta bort en post per nyckel i `keys`."""
+        if self._entries is None:
+            return
+        for key in keys:
+            for i, entry in enumerate(self._entries):
+                if entry.get("key") == key:
+                    del self._entries[i]
+                    break
+        self._schedule_save()
+
+    def _schedule_save(self):
+        self._store.async_delay_save(self._data_to_save, SYNC_STATE_SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self):
+        return {
+            "list_id": self._list_id,
+            "items": self._entries,
+            "list": self._last_list,
+            "list_fingerprint": self._list_fingerprint,
+        }
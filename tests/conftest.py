@@ -0,0 +1,118 @@
+"""Gemensamma fixtures: fejkad ICA-server, fejkad Keep-lista och benchmarkrapport."""
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+from homeassistant.const import EVENT_CALL_SERVICE
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.ica_shopping import ica_api
+from custom_components.ica_shopping.const import DOMAIN
+
+from .fake_ica import SESSION_ID, FakeICA
+from .fake_todo import KEEP_ENTITY, FakeTodoList, async_setup_fake_todo
+
+BENCH_RESULTS = []
+
+LIST_ID = "list-1"
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(enable_custom_integrations):
+    yield
+
+
+@pytest.fixture
+async def fake_ica(socket_enabled):
+    """Starta en FakeICA och peka ICAApi mot den.
+
+    Taktbegränsningen mot riktiga ICA stängs av så att tiderna visar
+    integrationens eget arbete.
+    """
+    server = await FakeICA().start()
+    with patch.multiple(
+        ica_api,
+        ICA_REQUESTS_PER_SECOND=0,
+        API_USER_INFO=server.url("/api/user/information"),
+        API_LIST_ALL=server.url("/api/list/all"),
+        API_ADD_ROW=server.url("/api/list") + "/{list_id}/row",
+        API_DELETE_ROW=server.url("/api/row") + "/{row_id}",
+        API_PURCHASES=server.url("/api/cpa/purchases/historical/me/byyearmonth") + "/{year_month}",
+    ):
+        yield server
+    await server.close()
+
+
+@pytest.fixture
+async def keep(hass):
+    """Fejkad Keep-lista registrerad som todo.keep."""
+    return await async_setup_fake_todo(hass, FakeTodoList("Keep"))
+
+
+@pytest.fixture
+def todo_calls(hass):
+    """Räkna todo-tjänsteanrop per tjänst."""
+    calls = Counter()
+
+    def _listener(event):
+        if event.data.get("domain") == "todo":
+            calls[event.data.get("service")] += 1
+
+    unsub = hass.bus.async_listen(EVENT_CALL_SERVICE, _listener)
+    yield calls
+    unsub()
+
+
+@pytest.fixture
+def make_entry(hass):
+    """Skapa en config entry för en lista på testkontot, med valfria optioner."""
+
+    def _make(list_id=LIST_ID, **options):
+        entry = MockConfigEntry(
+            domain=DOMAIN,
+            title=list_id,
+            data={"session_id": SESSION_ID, "ica_list_id": list_id, "todo_entity_id": KEEP_ENTITY},
+            options=options,
+        )
+        entry.add_to_hass(hass)
+        return entry
+
+    return _make
+
+
+@pytest.fixture
+def config_entry(make_entry):
+    return make_entry()
+
+
+@pytest.fixture
+def setup_entry(hass):
+    """Sätt upp en config entry och vänta tills starten är klar."""
+
+    async def _setup(entry):
+        assert await hass.config_entries.async_setup(entry.entry_id)
+        await hass.async_block_till_done()
+
+    return _setup
+
+
+@pytest.fixture
+def bench():
+    """Spara en benchmarkrad; alla rader skrivs ut efter körningen."""
+
+    def _record(name, **fields):
+        BENCH_RESULTS.append((name, fields))
+
+    return _record
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not BENCH_RESULTS:
+        return
+    terminalreporter.section("ica_shopping benchmarks")
+    for name, fields in BENCH_RESULTS:
+        values = "  ".join(
+            f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in fields.items()
+        )
+        terminalreporter.write_line(f"{name:<40} {values}")
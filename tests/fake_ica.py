@@ -0,0 +1,174 @@
+"""Fejkad ICA-server i processen för de endpoints integrationen använder."""
+import asyncio
+import hashlib
+import random
+import uuid
+from collections import Counter
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+TOKEN = "fake-access-token"
+SESSION_ID = "fake-session"
+
+
+class FakeICA:
+    """Fejkat ICA-API med räknare per endpoint, latens och felinjektion.
+
+    Endpoints heter ``user_info``, ``list_all``, ``add_row``,
+    ``delete_row`` och ``purchases``. ``fail(endpoint, *statuses)`` köar svar som skickas
+    innan den riktiga hanteraren körs; ``error_rate`` ger 503 på en
+    slumpad andel av anropen.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lists: dict[str, dict] = {}
+        self.purchases: dict[str, list] = {}
+        self.calls: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.connections: set = set()
+        self.etag_enabled = True
+        self._failures: dict[str, list] = {}
+        self._random = random.Random(seed)
+        self._version = 0
+        self.server = None
+
+        app = web.Application()
+        app.router.add_get("/api/user/information", self._user_info)
+        app.router.add_get("/api/list/all", self._list_all)
+        app.router.add_post("/api/list/{list_id}/row", self._add_row)
+        app.router.add_delete("/api/row/{row_id}", self._delete_row)
+        app.router.add_get("/api/cpa/purchases/historical/me/byyearmonth/{year_month}", self._purchases)
+        self.app = app
+
+    # --- uppsättning ----------------------------------------------------
+
+    def add_list(self, list_id: str, name: str, texts=(), striked=()):
+        rows = [
+            {"id": str(uuid.uuid4()), "text": text, "isStriked": i in striked}
+            for i, text in enumerate(texts)
+        ]
+        self.lists[list_id] = {"id": list_id, "name": name, "rows": rows}
+        self._version += 1
+        return self.lists[list_id]
+
+    def add_purchase(self, date: str, value: float, store: str, discount: float = 0):
+        transactions = self.purchases.setdefault(date[:7], [])
+        transactions.insert(0, {
+            "transactionId": str(uuid.uuid4()),
+            "transactionDate": f"{date}T12:00:00",
+            "transactionValue": value,
+            "totalDiscount": discount,
+            "storeMarketingName": store,
+        })
+
+    def rows(self, list_id: str):
+        return self.lists[list_id]["rows"]
+
+    def texts(self, list_id: str):
+        return [row["text"] for row in self.rows(list_id)]
+
+    def fail(self, endpoint: str, *statuses, retry_after=None):
+        self._failures.setdefault(endpoint, []).extend(
+            (status, retry_after) for status in statuses
+        )
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.statuses.clear()
+        self.connections.clear()
+
+    @property
+    def http_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def start(self):
+        self.server = TestServer(self.app)
+        await self.server.start_server()
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            await self.server.close()
+
+    def url(self, path: str) -> str:
+        return str(self.server.make_url(path))
+
+    # --- gemensamt för alla anrop ---------------------------------------
+
+    async def _enter(self, request, endpoint):
+        self.calls[endpoint] += 1
+        self.connections.add(request.transport)  # hålls kvar så att inget id återanvänds
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        queued = self._failures.get(endpoint)
+        if queued:
+            status, retry_after = queued.pop(0)
+            headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+            return self._respond(web.Response(status=status, headers=headers))
+        if self.error_rate and self._random.random() < self.error_rate:
+            return self._respond(web.Response(status=503, headers={"Retry-After": "0"}))
+        if endpoint != "user_info" and request.headers.get("Authorization") != f"Bearer {TOKEN}":
+            return self._respond(web.Response(status=401))
+        return None
+
+    def _respond(self, response):
+        self.statuses[response.status] += 1
+        return response
+
+    def _etag(self):
+        return '"' + hashlib.sha1(str(self._version).encode()).hexdigest()[:16] + '"'
+
+    # --- hanterare ------------------------------------------------------
+
+    async def _user_info(self, request):
+        if (early := await self._enter(request, "user_info")) is not None:
+            return early
+        if request.cookies.get("thSessionId") != SESSION_ID:
+            return self._respond(web.Response(status=401))
+        return self._respond(web.json_response({"accessToken": TOKEN}))
+
+    async def _list_all(self, request):
+        if (early := await self._enter(request, "list_all")) is not None:
+            return early
+        etag = self._etag()
+        if self.etag_enabled and request.headers.get("If-None-Match") == etag:
+            return self._respond(web.Response(status=304, headers={"ETag": etag}))
+        headers = {"ETag": etag} if self.etag_enabled else None
+        return self._respond(web.json_response(list(self.lists.values()), headers=headers))
+
+    async def _add_row(self, request):
+        if (early := await self._enter(request, "add_row")) is not None:
+            return early
+        the_list = self.lists.get(request.match_info["list_id"])
+        if the_list is None:
+            return self._respond(web.Response(status=404))
+        payload = await request.json()
+        row = {"id": str(uuid.uuid4()), "text": payload.get("text", ""), "isStriked": False}
+        the_list["rows"].append(row)
+        self._version += 1
+        return self._respond(web.json_response(row))
+
+    async def _delete_row(self, request):
+        if (early := await self._enter(request, "delete_row")) is not None:
+            return early
+        row_id = request.match_info["row_id"]
+        for the_list in self.lists.values():
+            for i, row in enumerate(the_list["rows"]):
+                if row["id"] == row_id:
+                    del the_list["rows"][i]
+                    self._version += 1
+                    return self._respond(web.Response(status=204))
+        return self._respond(web.Response(status=404))
+
+    async def _purchases(self, request):
+        if (early := await self._enter(request, "purchases")) is not None:
+            return early
+        transactions = self.purchases.get(request.match_info["year_month"], [])
+        etag = '"' + hashlib.sha1(str([t["transactionId"] for t in transactions]).encode()).hexdigest()[:16] + '"'
+        if self.etag_enabled and request.headers.get("If-None-Match") == etag:
+            return self._respond(web.Response(status=304, headers={"ETag": etag}))
+        headers = {"ETag": etag} if self.etag_enabled else None
+        return self._respond(web.json_response({"transactions": transactions}, headers=headers))
@@ -0,0 +1,72 @@
+"""En riktig todo-entity med lista i minnet, i stället för Google Keep."""
+import asyncio
+import uuid
+
+from homeassistant.components.todo import (
+    DOMAIN as TODO_DOMAIN,
+    TodoItem,
+    TodoItemStatus,
+    TodoListEntity,
+    TodoListEntityFeature,
+)
+from homeassistant.setup import async_setup_component
+
+KEEP_ENTITY = "todo.keep"
+
+
+class FakeTodoList(TodoListEntity):
+    """Todo-lista i minnet; `latency` fördröjer varje skrivning som en fjärrtjänst."""
+
+    _attr_supported_features = (
+        TodoListEntityFeature.CREATE_TODO_ITEM
+        | TodoListEntityFeature.DELETE_TODO_ITEM
+        | TodoListEntityFeature.UPDATE_TODO_ITEM
+    )
+
+    def __init__(self, name: str = "Keep", latency: float = 0.0):
+        self._attr_name = name
+        self._attr_unique_id = f"fake_todo_{name}"
+        self._attr_todo_items = []
+        self.latency = latency
+
+    def seed(self, texts, status=TodoItemStatus.NEEDS_ACTION):
+        for text in texts:
+            self._attr_todo_items.append(
+                TodoItem(summary=text, uid=str(uuid.uuid4()), status=status)
+            )
+
+    @property
+    def summaries(self):
+        return [item.summary for item in self._attr_todo_items]
+
+    def find(self, summary):
+        return next(item for item in self._attr_todo_items if item.summary == summary)
+
+    async def _write(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.async_write_ha_state()
+
+    async def async_create_todo_item(self, item: TodoItem) -> None:
+        self._attr_todo_items.append(
+            TodoItem(summary=item.summary, uid=str(uuid.uuid4()), status=item.status or TodoItemStatus.NEEDS_ACTION)
+        )
+        await self._write()
+
+    async def async_update_todo_item(self, item: TodoItem) -> None:
+        for i, existing in enumerate(self._attr_todo_items):
+            if existing.uid == item.uid:
+                self._attr_todo_items[i] = item
+        await self._write()
+
+    async def async_delete_todo_items(self, uids: list[str]) -> None:
+        uids = set(uids)
+        self._attr_todo_items = [i for i in self._attr_todo_items if i.uid not in uids]
+        await self._write()
+
+
+async def async_setup_fake_todo(hass, entity: FakeTodoList):
+    assert await async_setup_component(hass, TODO_DOMAIN, {})
+    await hass.data[TODO_DOMAIN].async_add_entities([entity])
+    await hass.async_block_till_done()
+    return entity
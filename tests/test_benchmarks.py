@@ -0,0 +1,178 @@
+"""Synkscenarier från början till slut mot fejkad ICA och fejkad Keep.
+
+Varje scenario rapporterar väggtid, HTTP-anrop mot ICA och anrop till
+todo-tjänster. Debounce-väntan hoppas över genom att flytta klockan, så
+väggtiden är integrationens arbete och inte tid den sover.
+"""
+import time
+from datetime import timedelta
+
+import aiohttp
+import pytest
+from homeassistant.components.todo import TodoItemStatus
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.ica_shopping.const import DATA_ICA, DOMAIN, ICA_CONNECTIONS_PER_HOST, MAX_ICA_ITEMS
+
+from .conftest import LIST_ID
+from .fake_ica import SESSION_ID
+from .fake_todo import KEEP_ENTITY
+
+FAKE_LATENCY = 0.002
+
+
+async def _flush(hass, seconds=15):
+    """Låt den debouncade synken köra genom att flytta klockan förbi maxväntan."""
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=seconds))
+    await hass.async_block_till_done()
+
+
+async def test_empty_to_full_list(hass, fake_ica, keep, todo_calls, config_entry, bench, setup_entry):
+    """250 varor tillagda i Keep blir 250 rader i en tom ICA-lista."""
+    fake_ica.add_list(LIST_ID, "Veckohandling")
+    fake_ica.latency = FAKE_LATENCY
+    await setup_entry(config_entry)
+    fake_ica.reset_counters()
+    todo_calls.clear()
+
+    texts = [f"vara {i}" for i in range(MAX_ICA_ITEMS)]
+    started = time.perf_counter()
+    for text in texts:
+        await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": text}, blocking=True)
+    await _flush(hass)
+    elapsed = time.perf_counter() - started
+
+    assert sorted(fake_ica.texts(LIST_ID)) == sorted(texts)
+    assert fake_ica.calls["add_row"] == MAX_ICA_ITEMS
+    bench(
+        "empty -> 250",
+        wall_s=elapsed,
+        http=fake_ica.http_calls,
+        list_all=fake_ica.calls["list_all"],
+        todo=sum(todo_calls.values()),
+    )
+
+
+async def test_steady_state_refresh(hass, fake_ica, keep, todo_calls, config_entry, bench, setup_entry):
+    """Refresh av 250 varor som redan stämmer skriver inget på någon sida."""
+    texts = [f"vara {i}" for i in range(MAX_ICA_ITEMS)]
+    fake_ica.add_list(LIST_ID, "Veckohandling", texts)
+    keep.seed(texts)
+    fake_ica.latency = FAKE_LATENCY
+    await setup_entry(config_entry)
+
+    # Första refresh bygger basen, de följande är steady state
+    await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True)
+    await hass.async_block_till_done()
+    fake_ica.reset_counters()
+    todo_calls.clear()
+
+    rounds = 5
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True)
+        await hass.async_block_till_done()
+    elapsed = time.perf_counter() - started
+
+    assert fake_ica.calls["add_row"] == fake_ica.calls["delete_row"] == 0
+    assert todo_calls["add_item"] == todo_calls["remove_item"] == 0
+    assert len(keep.summaries) == MAX_ICA_ITEMS
+    bench(
+        "steady state 250 (per refresh)",
+        wall_s=elapsed / rounds,
+        http=fake_ica.http_calls / rounds,
+        not_modified=fake_ica.statuses[304],
+        todo=sum(todo_calls.values()) / rounds,
+    )
+
+
+async def test_completion_burst(hass, fake_ica, keep, todo_calls, config_entry, bench, setup_entry):
+    """50 avbockade varor i Keep raderas ur ICA i en batch."""
+    texts = [f"vara {i}" for i in range(MAX_ICA_ITEMS)]
+    fake_ica.add_list(LIST_ID, "Veckohandling", texts)
+    keep.seed(texts)
+    fake_ica.latency = FAKE_LATENCY
+    await setup_entry(config_entry)
+    fake_ica.reset_counters()
+    todo_calls.clear()
+
+    completed = texts[:50]
+    started = time.perf_counter()
+    for text in completed:
+        item = keep.find(text)
+        await hass.services.async_call(
+            "todo", "update_item",
+            {"entity_id": KEEP_ENTITY, "item": item.uid, "rename": text, "status": TodoItemStatus.COMPLETED},
+            blocking=True,
+        )
+    await _flush(hass)
+    elapsed = time.perf_counter() - started
+
+    assert sorted(fake_ica.texts(LIST_ID)) == sorted(texts[50:])
+    assert fake_ica.calls["delete_row"] == len(completed)
+    assert fake_ica.calls["list_all"] <= 1
+    bench(
+        "completion burst 50/250",
+        wall_s=elapsed,
+        http=fake_ica.http_calls,
+        list_all=fake_ica.calls["list_all"],
+        todo=sum(todo_calls.values()),
+    )
+
+
+async def test_refresh_fills_keep(hass, fake_ica, keep, todo_calls, config_entry, bench, setup_entry):
+    """Refresh av 200 ICA-rader mot en Keep med 50 främmande varor."""
+    texts = [f"vara {i}" for i in range(200)]
+    fake_ica.add_list(LIST_ID, "Veckohandling", texts)
+    keep.seed([f"gammal {i}" for i in range(50)])
+    keep.latency = FAKE_LATENCY
+    await setup_entry(config_entry)
+    fake_ica.reset_counters()
+    todo_calls.clear()
+
+    started = time.perf_counter()
+    await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True)
+    await hass.async_block_till_done()
+    elapsed = time.perf_counter() - started
+
+    assert sorted(keep.summaries) == sorted(texts)
+    assert todo_calls["remove_item"] == 1
+    bench(
+        "refresh 200 into Keep",
+        wall_s=elapsed,
+        http=fake_ica.http_calls,
+        todo=sum(todo_calls.values()),
+    )
+
+
+@pytest.mark.parametrize("pooled", [False, True], ids=["before", "after"])
+async def test_handshakes_per_sync_cycle(hass, fake_ica, keep, config_entry, bench, pooled, setup_entry):
+    """Nya anslutningar (TCP+TLS-handskakningar) under en Keep → ICA-synk.
+
+    "before" motsvarar en ny ClientSession per anrop: varje anrop får en
+    egen anslutning. "after" är kontots långlivade session.
+    """
+    fake_ica.add_list(LIST_ID, "Veckohandling", [f"vara {i}" for i in range(20)])
+    fake_ica.latency = FAKE_LATENCY
+    keep.seed([f"vara {i}" for i in range(20)])
+    await setup_entry(config_entry)
+    api = hass.data[DOMAIN][DATA_ICA][SESSION_ID]["api"]
+    if not pooled:
+        await api.async_close()
+        api._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True))
+
+    for i in range(10):
+        await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": f"ny {i}"}, blocking=True)
+    for i in range(5):
+        await hass.services.async_call("todo", "remove_item", {"entity_id": KEEP_ENTITY, "item": f"vara {i}"}, blocking=True)
+    fake_ica.reset_counters()
+    await _flush(hass)
+
+    assert fake_ica.calls["add_row"] == 10 and fake_ica.calls["delete_row"] == 5
+    handshakes = len(fake_ica.connections)
+    if pooled:
+        assert handshakes <= ICA_CONNECTIONS_PER_HOST
+    else:
+        assert handshakes == fake_ica.http_calls
+    bench(f"handshakes per sync ({'after' if pooled else 'before'})", http=fake_ica.http_calls, handshakes=handshakes)
@@ -0,0 +1,169 @@
+"""ICAApi mot den fejkade ICA-servern: token, retry, breaker, cache och mätvärden."""
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.helpers import issue_registry as ir
+
+from custom_components.ica_shopping import ica_api
+from custom_components.ica_shopping.const import TOKEN_STORAGE_KEY
+from custom_components.ica_shopping.ica_api import ICAApi, session_hash
+from custom_components.ica_shopping.resilience import CircuitOpenError
+
+from .conftest import LIST_ID
+from .fake_ica import SESSION_ID, TOKEN
+
+
+@pytest.fixture
+async def api(hass, fake_ica):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"])
+    client = ICAApi(hass, SESSION_ID)
+    with patch.object(ica_api, "ICA_BACKOFF_BASE", 0.001):
+        yield client
+    await client.async_close()
+
+
+async def test_token_is_fetched_once(api, fake_ica):
+    assert await api.get_token() == TOKEN
+    await asyncio.gather(*(api.get_token() for _ in range(10)))
+    assert fake_ica.calls["user_info"] == 1
+
+
+async def test_tokens_are_stored_per_account(hass, hass_storage, fake_ica):
+    expires_at = time.time() + 3600
+    for session, token in (("konto-a", "token-a"), ("konto-b", "token-b")):
+        key = f"{TOKEN_STORAGE_KEY}.{session_hash(session)}"
+        hass_storage[key] = {
+            "version": 1,
+            "key": key,
+            "data": {"session": session_hash(session), "token": token, "expires_at": expires_at},
+        }
+    clients = [ICAApi(hass, session) for session in ("konto-a", "konto-b")]
+    # Varje konto får tillbaka sin egen token utan att fråga ICA
+    assert [await client.get_token() for client in clients] == ["token-a", "token-b"]
+    assert fake_ica.calls["user_info"] == 0
+    for client in clients:
+        await client.async_close()
+
+
+async def test_invalid_session_creates_issue(hass, fake_ica):
+    client = ICAApi(hass, "fel-session")
+    assert await client.get_token() is None
+    assert ir.async_get(hass).async_get_issue("ica_shopping", "invalid_session_id")
+    await client.async_close()
+
+
+async def test_401_refreshes_token_once(api, fake_ica):
+    api._token = "gammal"
+    api._token_expires_at = time.time() + 3600
+    api._token_loaded = True
+    lists = await api.fetch_lists()
+    assert lists[0]["id"] == LIST_ID
+    assert fake_ica.statuses[401] == 1
+    assert fake_ica.calls["user_info"] == 1
+
+
+async def test_get_is_retried_with_retry_after(api, fake_ica):
+    fake_ica.fail("list_all", 503, 429, retry_after=0)
+    assert await api.fetch_lists()
+    assert fake_ica.calls["list_all"] == 3
+    assert api.metrics.endpoints["GET /api/list/all"].retries == 2
+
+
+async def test_post_is_not_retried_on_500(api, fake_ica):
+    fake_ica.fail("add_row", 500)
+    assert await api.add_to_list(LIST_ID, "ost") is False
+    assert fake_ica.calls["add_row"] == 1
+    assert fake_ica.texts(LIST_ID) == ["mjölk", "ägg"]
+
+
+async def test_breaker_opens_after_repeated_failures(api, fake_ica):
+    fake_ica.fail("list_all", *[500] * 20)
+    with patch.object(ica_api, "ICA_MAX_RETRIES", 0):
+        for _ in range(ica_api.ICA_BREAKER_THRESHOLD):
+            assert await api.fetch_lists(max_age=0) == []
+        calls = fake_ica.calls["list_all"]
+        with pytest.raises(CircuitOpenError):
+            await api._request("GET", ica_api.API_LIST_ALL)
+    assert fake_ica.calls["list_all"] == calls
+    assert api.metrics.circuit_rejections == 1
+    assert "open" in api.breaker_states().values()
+
+
+async def test_half_open_trial_is_released_on_bad_response(api, fake_ica):
+    fake_ica.fail("list_all", *[500] * ica_api.ICA_BREAKER_THRESHOLD)
+    with patch.object(ica_api, "ICA_MAX_RETRIES", 0):
+        for _ in range(ica_api.ICA_BREAKER_THRESHOLD):
+            await api.fetch_lists(max_age=0)
+
+    def broken(_raw):
+        raise ValueError("trasig JSON")
+
+    later = time.monotonic() + ica_api.ICA_BREAKER_RESET_SECONDS + 1
+    with patch("custom_components.ica_shopping.resilience.time.monotonic", return_value=later):
+        with pytest.raises(ValueError):
+            await api._request("GET", ica_api.API_LIST_ALL, decoder=broken)
+        # Testanropet släpptes, så nästa anrop går igenom och stänger kretsen
+        assert await api.fetch_lists(max_age=0)
+    assert api.metrics.circuit_rejections == 0
+
+
+async def test_fetch_lists_is_single_flight_and_cached(api, fake_ica):
+    await api.get_token()
+    fake_ica.latency = 0.02
+    results = await asyncio.gather(*(api.fetch_lists() for _ in range(20)))
+    assert all(r == results[0] for r in results)
+    assert fake_ica.calls["list_all"] == 1
+
+    await api.fetch_lists()
+    assert fake_ica.calls["list_all"] == 1
+    await api.add_to_list(LIST_ID, "ost")
+    assert "ost" in [r["text"] for r in (await api.fetch_lists())[0]["rows"]]
+    assert fake_ica.calls["list_all"] == 2
+
+
+async def test_unchanged_list_gets_304(api, fake_ica):
+    first = await api.fetch_lists(max_age=0)
+    second = await api.fetch_lists(max_age=0)
+    assert first == second
+    assert fake_ica.statuses[304] == 1
+
+
+async def test_batch_writes(api, fake_ica):
+    results = await api.add_items(LIST_ID, [f"vara {i}" for i in range(12)], capacity=10)
+    assert sum(ok for _, ok in results) == 10
+    row_ids = [row["id"] for row in fake_ica.rows(LIST_ID)[:5]]
+    assert all(ok for _, ok in await api.remove_items(row_ids))
+    assert len(fake_ica.rows(LIST_ID)) == 2 + 10 - 5
+
+
+async def test_metrics(api, fake_ica):
+    await api.fetch_lists(max_age=0)
+    stats = api.metrics.as_dict()
+    endpoint = stats["endpoints"]["GET /api/list/all"]
+    assert endpoint["requests"] == 1 and endpoint["statuses"] == {"200": 1}
+    assert endpoint["bytes_received"] > 0
+    assert stats["token_refreshes"] == 1
+
+
+async def test_own_session_closes_with_hass(hass, api):
+    await api.get_token()
+    session = api.session
+    hass.bus.async_fire(EVENT_HOMEASSISTANT_CLOSE)
+    await hass.async_block_till_done()
+    assert session.closed
+
+
+async def test_connections_are_reused(api, fake_ica, bench):
+    """Handskakningen görs en gång – följande anrop återanvänder anslutningen."""
+    await api.get_token()
+    fake_ica.reset_counters()
+    rounds = 50
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await api.fetch_lists(max_age=0)
+    elapsed = time.perf_counter() - started
+    assert len(fake_ica.connections) == 1
+    bench("list/all keep-alive (per call)", wall_s=elapsed / rounds, connections=len(fake_ica.connections))
@@ -0,0 +1,286 @@
+"""Uppsättning av entries, eventfiltret, sensorer och diagnostik."""
+import asyncio
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+import voluptuous as vol
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.const import EVENT_CALL_SERVICE
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.ica_shopping.const import DATA_ICA, DOMAIN, MAX_ICA_ITEMS
+from custom_components.ica_shopping.diagnostics import async_get_config_entry_diagnostics
+from custom_components.ica_shopping.reconcile import plan_refresh
+
+from .conftest import LIST_ID
+from .fake_ica import SESSION_ID
+from .fake_todo import KEEP_ENTITY
+
+SENSOR = "sensor.ica_veckohandling_shoppinglist"
+
+
+async def test_setup_and_unload(hass, hass_storage, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"], striked={1})
+    await setup_entry(config_entry)
+    assert config_entry.state is ConfigEntryState.LOADED
+
+    # Listan sparas för nästa start
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=15))
+    await hass.async_block_till_done()
+    stored = hass_storage[f"ica_keep_synced_list.{config_entry.entry_id}"]["data"]
+    assert stored["list"]["name"] == "Veckohandling"
+
+    state = hass.states.get(SENSOR)
+    assert state.state == "2"
+    assert state.attributes["items"] == ["mjölk", "ägg"]
+    assert state.attributes["striked"] == [1]
+    assert "vara_1" not in state.attributes
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+    assert config_entry.entry_id not in hass.data[DOMAIN]
+    assert not hass.data[DOMAIN][DATA_ICA]
+
+
+async def test_legacy_attributes(hass, fake_ica, keep, make_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"])
+    await setup_entry(make_entry(legacy_attributes=True))
+    state = hass.states.get(SENSOR)
+    assert state.attributes["vara_2"] == "ägg"
+    assert "items" not in state.attributes
+
+
+async def test_entries_share_one_client(hass, fake_ica, keep, make_entry, setup_entry):
+    fake_ica.add_list("a", "Ett", ["mjölk"])
+    fake_ica.add_list("b", "Två", [])
+    for list_id in ("a", "b"):
+        await setup_entry(make_entry(list_id))
+
+    assert len(hass.data[DOMAIN][DATA_ICA]) == 1
+    # Andra entryn behöver raderna för sin lista, som första hämtningen bara gav id/namn för
+    assert fake_ica.calls["list_all"] == 2
+    assert fake_ica.calls["user_info"] == 1
+    assert hass.states.get("sensor.ica_ett_shoppinglist").state == "1"
+    assert hass.states.get("sensor.ica_tva_shoppinglist").state == "0"
+
+
+async def test_refresh_fetches_once_per_account(hass, fake_ica, keep, make_entry, setup_entry):
+    for list_id in ("a", "b", "c", "d"):
+        fake_ica.add_list(list_id, f"Lista {list_id}", [])
+        await setup_entry(make_entry(list_id))
+
+    fake_ica.reset_counters()
+    response = await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True, return_response=True)
+    assert set(response["lists"]) == {"a", "b", "c", "d"}
+    assert fake_ica.calls["list_all"] == 1
+
+
+async def test_account_options_apply_to_all_lists(hass, fake_ica, keep, make_entry, setup_entry):
+    entries = []
+    for list_id in ("a", "b"):
+        fake_ica.add_list(list_id, f"Lista {list_id}", [])
+        entry = make_entry(list_id)
+        await setup_entry(entry)
+        entries.append(entry)
+
+    hass.config_entries.async_update_entry(
+        entries[0], options={"write_concurrency": 2, "poll_fast_seconds": 45, "remove_striked": False}
+    )
+    await hass.async_block_till_done()
+
+    # Klienten delas, så kontots optioner skrivs även till den andra listan
+    assert entries[1].options == {"write_concurrency": 2, "poll_fast_seconds": 45}
+    client = hass.data[DOMAIN][DATA_ICA][SESSION_ID]
+    assert client["api"].write_concurrency == 2
+    assert client["coordinator"].fast_interval == timedelta(seconds=45)
+
+
+async def test_refresh_service_syncs_both_ways(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"], striked={1})
+    keep.seed(["bröd"])
+    await setup_entry(config_entry)
+
+    await hass.services.async_call(DOMAIN, "refresh", {"list_id": LIST_ID}, blocking=True)
+    await hass.async_block_till_done()
+
+    # Ingen bas ännu: ICA styr, och den avbockade raden rensas
+    assert fake_ica.texts(LIST_ID) == ["mjölk"]
+    assert keep.summaries == ["mjölk"]
+    assert hass.states.get(SENSOR).state == "1"
+
+
+async def test_refresh_survives_stale_keep_uid(hass, fake_ica, keep, config_entry, setup_entry):
+    """Ett uid som försvunnit ur Keep sedan get_items stoppar inte refreshen."""
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"], striked={1})
+    keep.seed(["bröd"])
+    await setup_entry(config_entry)
+
+    def with_stale_uid(*args, **kwargs):
+        plan = plan_refresh(*args, **kwargs)
+        plan.keep_remove_uids.append("borttagen-uid")
+        return plan
+
+    with patch("custom_components.ica_shopping.plan_refresh", with_stale_uid):
+        await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True)
+
+    assert keep.summaries == ["mjölk"]
+    assert fake_ica.texts(LIST_ID) == ["mjölk"]
+
+
+async def test_event_filter_ignores_unrelated_calls(hass, fake_ica, keep, config_entry, bench, setup_entry):
+    """Lyssnaren ska bara vakna för todo-anrop mot vår Keep-entity."""
+    fake_ica.add_list(LIST_ID, "Veckohandling")
+    await setup_entry(config_entry)
+
+    events = 10_000
+    with patch("custom_components.ica_shopping.sync_queue.async_call_later") as call_later:
+        started = time.perf_counter()
+        for i in range(events):
+            hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "light", "service": "turn_on", "service_data": {"entity_id": f"light.l{i}"}})
+        hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "todo", "service": "add_item", "service_data": {"entity_id": "todo.annan", "item": "ost"}})
+        await hass.async_block_till_done()
+        elapsed = time.perf_counter() - started
+        assert call_later.call_count == 0
+
+        hass.bus.async_fire(EVENT_CALL_SERVICE, {"domain": "todo", "service": "add_item", "service_data": {"entity_id": KEEP_ENTITY, "item": "ost"}})
+        await hass.async_block_till_done()
+        assert call_later.call_count == 1
+
+    bench("call_service filter", us_per_event=elapsed / events * 1e6)
+
+
+async def test_keep_add_and_remove_reach_ica(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["ost"])
+    keep.seed(["ost"])
+    await setup_entry(config_entry)
+
+    for text in ("mjölk", "ägg"):
+        await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": text}, blocking=True)
+    await hass.services.async_call("todo", "remove_item", {"entity_id": KEEP_ENTITY, "item": ["ost"]}, blocking=True)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=15))
+    await hass.async_block_till_done()
+
+    assert sorted(fake_ica.texts(LIST_ID)) == ["mjölk", "ägg"]
+    assert hass.states.get(SENSOR).state == "2"
+
+
+async def test_diagnostics_are_redacted(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    await setup_entry(config_entry)
+    diagnostics = await async_get_config_entry_diagnostics(hass, config_entry)
+    assert diagnostics["entry"]["data"]["session_id"] == "**REDACTED**"
+    assert diagnostics["list"]["rows"] == 1
+    assert diagnostics["http"]["endpoints"]["GET /api/list/all"]["requests"] == 1
+
+
+async def test_startup_shows_stored_list_before_first_fetch(hass, hass_storage, fake_ica, keep, config_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg", "ost"])
+    fake_ica.latency = 0.2
+    stored = {"id": LIST_ID, "name": "Veckohandling", "rows": [{"id": "r1", "text": "mjölk"}]}
+    hass_storage[f"ica_keep_synced_list.{config_entry.entry_id}"] = {
+        "version": 1,
+        "key": f"ica_keep_synced_list.{config_entry.entry_id}",
+        "data": {"list_id": LIST_ID, "items": None, "list": stored, "list_fingerprint": "x"},
+    }
+
+    started = time.perf_counter()
+    assert await hass.config_entries.async_setup(config_entry.entry_id)
+    assert time.perf_counter() - started < fake_ica.latency
+    assert hass.states.get(SENSOR).state == "1"
+
+    # Bakgrundshämtningen väntas inte in av async_block_till_done
+    for _ in range(50):
+        await asyncio.sleep(0.02)
+        if hass.states.get(SENSOR).state == "3":
+            break
+    assert hass.states.get(SENSOR).state == "3"
+    assert fake_ica.calls["list_all"] == 1
+
+
+async def test_dry_run_returns_plan_without_changes(hass, fake_ica, keep, config_entry, todo_calls, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"], striked={1})
+    keep.seed(["bröd"])
+    await setup_entry(config_entry)
+    fake_ica.reset_counters()
+
+    response = await hass.services.async_call(
+        DOMAIN, "refresh", {"list_id": LIST_ID, "dry_run": True}, blocking=True, return_response=True
+    )
+    result = response["lists"][LIST_ID]
+    assert result["result"] == "dry_run"
+    assert result["plan"]["keep_add"] == ["mjölk"]
+    assert result["plan"]["keep_remove"] == ["bröd"]
+    assert result["plan"]["ica_remove_striked"] == ["ägg"]
+    assert not result["plan"]["three_way"]
+
+    # Inget skrivet på någon sida
+    assert fake_ica.texts(LIST_ID) == ["mjölk", "ägg"]
+    assert keep.summaries == ["bröd"]
+    assert fake_ica.calls["add_row"] == fake_ica.calls["delete_row"] == 0
+    assert todo_calls["add_item"] == todo_calls["remove_item"] == 0
+
+
+async def test_refresh_schema_parses_dry_run(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    await setup_entry(config_entry)
+
+    # "false" från YAML/UI är falskt, inte en sann sträng
+    response = await hass.services.async_call(
+        DOMAIN, "refresh", {"dry_run": "false"}, blocking=True, return_response=True
+    )
+    assert response["lists"][LIST_ID]["result"] == "ok"
+    with pytest.raises(vol.Invalid):
+        await hass.services.async_call(DOMAIN, "sync_stats", {"okänd": 1}, blocking=True, return_response=True)
+
+
+async def test_sync_stats_keeps_recent_cycles(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    await setup_entry(config_entry)
+
+    refreshed = await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True, return_response=True)
+    assert refreshed["lists"][LIST_ID]["result"] == "ok"
+    await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": "ost"}, blocking=True)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=15))
+    await hass.async_block_till_done()
+
+    response = await hass.services.async_call(DOMAIN, "sync_stats", {}, blocking=True, return_response=True)
+    stats = response["lists"][LIST_ID]
+    refresh, sync = stats["cycles"]
+    assert (refresh["kind"], sync["kind"]) == ("refresh", "sync")
+    assert {"fetch_ica", "read_keep", "diff", "write_keep"} <= set(refresh["phases_s"])
+    assert refresh["counts"]["keep_add"] == 1
+    assert sync["counts"]["ica_add"] == 1 and sync["counts"]["http"] >= 1
+    assert stats["by_kind"]["sync"]["count"] == 1
+    assert stats["outbox_pending"] == 0
+
+
+async def test_bulk_add_and_remove_items(hass, fake_ica, keep, config_entry, todo_calls, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg", "Ägg"])
+    await setup_entry(config_entry)
+
+    response = await hass.services.async_call(
+        DOMAIN, "add_items", {"items": ["kaffe", "Mjölk", "Kaffe", "ost"]}, blocking=True, return_response=True
+    )
+    assert [i["result"] for i in response["items"]] == ["added", "exists", "duplicate", "added"]
+    assert fake_ica.texts(LIST_ID) == ["mjölk", "ägg", "Ägg", "kaffe", "ost"]
+    assert hass.states.get(SENSOR).state == "5"
+
+    response = await hass.services.async_call(
+        DOMAIN, "remove_items", {"list_id": LIST_ID, "items": "ägg"}, blocking=True, return_response=True
+    )
+    assert response["items"] == [{"item": "ägg", "result": "removed"}]
+    assert fake_ica.texts(LIST_ID) == ["mjölk", "kaffe", "ost"]
+    # Går direkt mot ICA – ingen Keep-synk per vara
+    assert sum(todo_calls.values()) == 0
+
+
+async def test_bulk_add_respects_max_items(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", [f"vara {i}" for i in range(MAX_ICA_ITEMS - 1)])
+    await setup_entry(config_entry)
+    response = await hass.services.async_call(
+        DOMAIN, "add_items", {"items": ["kaffe", "te"]}, blocking=True, return_response=True
+    )
+    assert [i["result"] for i in response["items"]] == ["added", "list_full"]
+    assert fake_ica.calls["add_row"] == 1
@@ -0,0 +1,88 @@
+"""Utplockning av synkade listor ur list/all, plus minne och CPU för 1 MB."""
+import json
+import time
+import tracemalloc
+
+import pytest
+
+from custom_components.ica_shopping.ica_api import ICAApi
+from custom_components.ica_shopping.list_parser import parse_lists
+
+from .conftest import LIST_ID
+from .fake_ica import SESSION_ID
+
+
+def _account(n_lists=40, rows=250):
+    return [
+        {
+            "id": f"lista-{n}",
+            "name": f"Lista {n}",
+            "latestChange": "2024-01-01T00:00:00Z",
+            "rows": [
+                {"id": f"{n}-{i}", "text": f"vara nummer {i} med lite längre text", "isStriked": i % 7 == 0, "articleGroupId": 12}
+                for i in range(rows)
+            ],
+        }
+        for n in range(n_lists)
+    ]
+
+
+def test_plain_array_keeps_only_wanted():
+    raw = json.dumps(_account(3, 2)).encode()
+    lists = parse_lists(raw, {"lista-1"})
+    assert [l["id"] for l in lists] == ["lista-0", "lista-1", "lista-2"]
+    assert lists[0] == {"id": "lista-0", "name": "Lista 0"}
+    assert len(lists[1]["rows"]) == 2
+
+
+def test_items_wrapper_and_whitespace():
+    raw = json.dumps({"meta": {"x": [1, {"y": "]"}]}, "items": _account(2, 1)}, indent=2)
+    lists = parse_lists(raw, {"lista-0"})
+    assert len(lists[0]["rows"]) == 1 and "rows" not in lists[1]
+    assert parse_lists(" [ ] ", {"a"}) == []
+
+
+@pytest.mark.parametrize("raw", ['"text"', '{"other": []}', "[1 2]"])
+def test_unexpected_format(raw):
+    with pytest.raises(ValueError):
+        parse_lists(raw, {"a"})
+
+
+async def test_api_decodes_only_tracked_lists(hass, fake_ica):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    fake_ica.add_list("recept", "Recept", ["mjöl", "socker"])
+    api = ICAApi(hass, SESSION_ID)
+    api.track_list(LIST_ID)
+    lists = {l["id"]: l for l in await api.fetch_lists()}
+    assert lists[LIST_ID]["rows"][0]["text"] == "mjölk"
+    assert lists["recept"] == {"id": "recept", "name": "Recept"}
+
+    # En ny lista tvingar fram en hel hämtning i stället för 304 från cachen
+    assert api.track_list("recept")
+    lists = {l["id"]: l for l in await api.fetch_lists()}
+    assert len(lists["recept"]["rows"]) == 2
+    assert fake_ica.statuses[304] == 0
+    await api.async_close()
+
+
+def _measure(func, raw):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(raw)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def test_one_megabyte_response(bench):
+    raw = json.dumps(_account()).encode()
+    assert len(raw) > 1_000_000
+
+    full, full_s, full_peak = _measure(json.loads, raw)
+    lists, stream_s, stream_peak = _measure(lambda r: parse_lists(r, {"lista-3"}), raw)
+
+    assert lists[3] == full[3]
+    assert stream_peak < full_peak
+    bench("list/all 1 MB json.loads", s=full_s, peak_kb=full_peak // 1024, bytes=len(raw))
+    bench("list/all 1 MB parse_lists", s=stream_s, peak_kb=stream_peak // 1024, bytes=len(raw))
@@ -0,0 +1,151 @@
+"""Skrivkön för ICA-ändringar: sammanslagning, bekräftelse och återhämtning."""
+import asyncio
+from datetime import timedelta
+from unittest.mock import patch
+
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.ica_shopping.const import DOMAIN, MAX_ICA_ITEMS
+from custom_components.ica_shopping.outbox import Outbox
+
+from .conftest import LIST_ID
+from .fake_todo import KEEP_ENTITY
+
+
+def _storage_key(entry_id):
+    return f"{DOMAIN}.outbox.{entry_id}"
+
+
+async def _let_sync_run(hass):
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=15))
+    await hass.async_block_till_done()
+
+
+async def test_pairs_cancel_and_ack_keeps_newer(hass, hass_storage):
+    outbox = Outbox(hass, "e1", LIST_ID)
+    await outbox.async_write({"mjölk": ("add", "Mjölk"), "ost": ("remove", "ost")})
+    assert hass_storage[_storage_key("e1")]["data"]["ops"] == [["mjölk", "add", "Mjölk"], ["ost", "remove", "ost"]]
+
+    await outbox.async_write({"mjölk": ("complete", "mjölk"), "ost": ("add", "ost"), "ägg": ("add", "ägg")})
+    await outbox.async_write({"ägg": ("add", "Ägg")})
+    assert outbox.pending() == {"ägg": ("add", "Ägg")}
+
+    # Bekräftelse för en äldre version av en operation tar inte bort den nya
+    outbox.ack({"ägg": ("add", "ägg")})
+    assert len(outbox) == 1
+    outbox.ack({"ägg": ("add", "Ägg")})
+    assert not outbox
+
+
+async def test_failed_add_waits_in_outbox(hass, hass_storage, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["ost"])
+    await setup_entry(config_entry)
+
+    fake_ica.fail("add_row", 500)
+    await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": "mjölk"}, blocking=True)
+    await _let_sync_run(hass)
+    assert fake_ica.texts(LIST_ID) == ["ost"]
+    outbox = hass.data[DOMAIN][config_entry.entry_id]["outbox"]
+    assert outbox.pending() == {"mjölk": ("add", "mjölk")}
+    assert hass_storage[_storage_key(config_entry.entry_id)]["data"]["ops"] == [["mjölk", "add", "mjölk"]]
+
+    # Nästa lyckade hämtning från ICA tömmer kön
+    await hass.data[DOMAIN][config_entry.entry_id]["coordinator"].async_refresh()
+    await _let_sync_run(hass)
+    assert fake_ica.texts(LIST_ID) == ["ost", "mjölk"]
+    assert not outbox
+
+
+async def test_rejected_ops_leave_outbox(hass, fake_ica, keep, config_entry, setup_entry):
+    """En 400 blir inte bättre av att skickas om, och en rad som redan saknas är borta."""
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["ost"])
+    keep.seed(["ost"])
+    await setup_entry(config_entry)
+
+    fake_ica.fail("add_row", 400)
+    fake_ica.fail("delete_row", 404)
+    await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": "mjölk"}, blocking=True)
+    await hass.services.async_call("todo", "remove_item", {"entity_id": KEEP_ENTITY, "item": "ost"}, blocking=True)
+    await _let_sync_run(hass)
+    assert not hass.data[DOMAIN][config_entry.entry_id]["outbox"]
+
+    fake_ica.reset_counters()
+    await hass.data[DOMAIN][config_entry.entry_id]["coordinator"].async_refresh()
+    await _let_sync_run(hass)
+    assert fake_ica.calls["add_row"] == fake_ica.calls["delete_row"] == 0
+
+
+async def test_adds_over_capacity_wait_in_outbox(hass, fake_ica, keep, config_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", [f"vara {i}" for i in range(MAX_ICA_ITEMS - 1)])
+    await setup_entry(config_entry)
+
+    for item in ("kaffe", "te"):
+        await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": item}, blocking=True)
+    await _let_sync_run(hass)
+    outbox = hass.data[DOMAIN][config_entry.entry_id]["outbox"]
+    assert fake_ica.calls["add_row"] == 1
+    assert len(outbox) == 1
+
+    # När det blir plats i ICA går det som väntade fram
+    waiting = next(iter(outbox.pending().values()))[1]
+    del fake_ica.rows(LIST_ID)[0]
+    await hass.data[DOMAIN][config_entry.entry_id]["coordinator"].async_refresh()
+    await _let_sync_run(hass)
+    assert waiting in fake_ica.texts(LIST_ID)
+    assert not outbox
+
+
+async def test_outbox_replays_after_restart(hass, hass_storage, fake_ica, keep, config_entry, todo_calls, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["ost", "bröd"])
+    hass_storage[_storage_key(config_entry.entry_id)] = {
+        "version": 1,
+        "key": _storage_key(config_entry.entry_id),
+        "data": {"list_id": LIST_ID, "ops": [["mjölk", "add", "Mjölk"], ["ost", "remove", "ost"], ["bröd", "add", "bröd"]]},
+    }
+    await setup_entry(config_entry)
+    await _let_sync_run(hass)
+
+    # En kompakt batch: bröd finns redan, ingen full läsning av Keep
+    assert fake_ica.texts(LIST_ID) == ["bröd", "Mjölk"]
+    assert fake_ica.calls["add_row"] == 1 and fake_ica.calls["delete_row"] == 1
+    assert todo_calls["get_items"] == 0
+    assert not hass.data[DOMAIN][config_entry.entry_id]["outbox"]
+
+
+async def test_event_during_batch_does_not_resend_pending(hass, fake_ica, keep, config_entry, setup_entry):
+    """En Keep-ändring under en pågående batch får inte skicka kön en gång till."""
+    fake_ica.add_list(LIST_ID, "Veckohandling")
+    await setup_entry(config_entry)
+    fake_ica.latency = 0.05
+
+    for i in range(20):
+        await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": f"vara {i}"}, blocking=True)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=15))
+    await asyncio.sleep(0.1)  # första batchen pågår
+
+    await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": "extra"}, blocking=True)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=30))
+    await hass.async_block_till_done()
+
+    texts = fake_ica.texts(LIST_ID)
+    assert len(texts) == len(set(texts)) == 21
+
+
+async def test_remove_during_inflight_add_is_sent(hass, fake_ica, keep, config_entry, setup_entry):
+    """En borttagning medan tillägget är på väg till ICA får inte ta ut det."""
+    fake_ica.add_list(LIST_ID, "Veckohandling")
+    with patch("custom_components.ica_shopping.DEBOUNCE_SECONDS", 0.05):
+        await setup_entry(config_entry)
+    fake_ica.latency = 0.3
+
+    await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": "ost"}, blocking=True)
+    await asyncio.sleep(0.15)  # synken har startat och tillägget av ost pågår
+    assert fake_ica.calls["add_row"] == 1
+    await hass.services.async_call("todo", "remove_item", {"entity_id": KEEP_ENTITY, "item": "ost"}, blocking=True)
+    await asyncio.sleep(0.1)  # nästa synk har skrivit sin borttagning och väntar på låset
+    await hass.async_block_till_done()
+
+    assert fake_ica.texts(LIST_ID) == []
+    assert keep.summaries == []
+    assert not hass.data[DOMAIN][config_entry.entry_id]["outbox"]
@@ -0,0 +1,102 @@
+"""Adaptiv pollning: tätt efter ändringar och i butiken, annars exponentiell backoff."""
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.ica_shopping.const import DOMAIN, POLL_ACTIVE_SECONDS
+from custom_components.ica_shopping.coordinator import ICAListCoordinator
+from custom_components.ica_shopping.ica_api import ICAApi
+
+from .conftest import LIST_ID
+from .fake_ica import SESSION_ID
+from .fake_todo import KEEP_ENTITY
+
+FAST = timedelta(seconds=60)
+IDLE = timedelta(minutes=8)
+
+
+def _later():
+    """Patch som flyttar klockan förbi den aktiva perioden."""
+    return patch(
+        "custom_components.ica_shopping.coordinator.time.monotonic",
+        return_value=time.monotonic() + POLL_ACTIVE_SECONDS + 1,
+    )
+
+
+async def test_change_polls_fast_then_backs_off(hass, fake_ica):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    api = ICAApi(hass, SESSION_ID, list_cache_seconds=0)
+    api.track_list(LIST_ID)
+    coordinator = ICAListCoordinator(hass, api, fast_interval=FAST, idle_interval=IDLE)
+    await coordinator.async_refresh()
+    assert coordinator.update_interval == IDLE
+
+    # Ändring i ICA-appen → tät pollning så länge perioden varar
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk", "ägg"])
+    for _ in range(2):
+        await coordinator.async_refresh()
+        assert coordinator.update_interval == FAST
+
+    intervals = []
+    with _later():
+        for _ in range(4):
+            await coordinator.async_refresh()
+            intervals.append(coordinator.update_interval.total_seconds())
+    assert intervals == [120, 240, 480, 480]
+    assert fake_ica.statuses[304] >= 5
+    await api.async_close()
+
+
+async def test_zone_keeps_polling_fast(hass, fake_ica):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    api = ICAApi(hass, SESSION_ID, list_cache_seconds=0)
+    coordinator = ICAListCoordinator(hass, api, fast_interval=FAST, idle_interval=IDLE)
+    coordinator.track_zone("zone.ica")
+    hass.states.async_set("zone.ica", "1")
+    with _later():
+        await coordinator.async_refresh()
+    assert coordinator.update_interval == FAST
+
+    # Ute ur butiken börjar backoffen från det täta intervallet
+    hass.states.async_set("zone.ica", "0")
+    with _later():
+        await coordinator.async_refresh()
+    assert coordinator.update_interval == FAST * 2
+    await api.async_close()
+
+
+async def test_options_and_keep_activity(hass, fake_ica, keep, make_entry, setup_entry):
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    entry = make_entry(poll_fast_seconds=45, poll_idle_minutes=120, presence_zone="zone.ica", list_cache_seconds=0)
+    await setup_entry(entry)
+    coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
+    assert coordinator.idle_interval == timedelta(minutes=120)
+    assert coordinator.update_interval == coordinator.idle_interval
+
+    # Keep-aktivitet utan egen hämtning (ost läggs till och tas bort igen)
+    # ger ändå nästa hämtning efter det snabba intervallet, inte efter två timmar
+    fake_ica.reset_counters()
+    await hass.services.async_call("todo", "add_item", {"entity_id": KEEP_ENTITY, "item": "ost"}, blocking=True)
+    await hass.services.async_call("todo", "remove_item", {"entity_id": KEEP_ENTITY, "item": "ost"}, blocking=True)
+    assert coordinator.update_interval == timedelta(seconds=45)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=30))
+    await hass.async_block_till_done()
+    assert fake_ica.calls["list_all"] == 0
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=46))
+    await hass.async_block_till_done()
+    assert fake_ica.calls["list_all"] == 1
+
+    # Den som kommer till butiken får en färsk lista direkt (efter debouncerns cooldown)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=60))
+    await hass.async_block_till_done()
+    fake_ica.reset_counters()
+    hass.states.async_set("zone.ica", "1")
+    await hass.async_block_till_done()
+    assert fake_ica.calls["list_all"] == 1
+
+    # Zonen följs bara medan entryn är laddad
+    assert await hass.config_entries.async_unload(entry.entry_id)
+    assert not coordinator._zones
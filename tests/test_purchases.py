@@ -0,0 +1,97 @@
+"""Köphistoriken: månadscache, inkrementell uppdatering och köpsensorerna."""
+from datetime import timedelta
+
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.ica_shopping.const import DOMAIN, PURCHASE_HISTORY_MONTHS, PURCHASE_SAVE_DELAY
+from custom_components.ica_shopping.ica_api import ICAApi
+from custom_components.ica_shopping.purchases import PurchaseHistory, months_back
+
+from .conftest import LIST_ID
+from .fake_ica import SESSION_ID
+
+
+def test_months_back_crosses_year():
+    assert months_back(2024, 2, 3) == ["2023-12", "2024-01", "2024-02"]
+
+
+async def test_past_months_are_fetched_once(hass, hass_storage, fake_ica):
+    fake_ica.add_purchase("2024-03-02", 100.5, "ICA Maxi")
+    fake_ica.add_purchase("2024-02-10", 50, "ICA Nära")
+    fake_ica.add_purchase("2024-02-20", 20, "ICA Maxi")
+    api = ICAApi(hass, SESSION_ID)
+    history = PurchaseHistory(hass, "konto")
+
+    assert await history.async_update(api, 2024, 3)
+    assert fake_ica.calls["purchases"] == PURCHASE_HISTORY_MONTHS
+
+    # Andra varvet: bara innevarande månad, och den är oförändrad (304)
+    fake_ica.reset_counters()
+    assert not await history.async_update(api, 2024, 3)
+    assert fake_ica.calls["purchases"] == 1
+    assert fake_ica.statuses[304] == 1
+
+    summary = history.summary()
+    assert summary["latest"][1:] == ["2024-03-02", 100.5, 0, "ICA Maxi"]
+    assert summary["monthly_spend"]["2024-02"] == 70
+    assert summary["store_visits"] == {"ICA Maxi": 2, "ICA Nära": 1}
+
+    # Nytt köp i innevarande månad ger ny summa utan att äldre månader hämtas
+    fake_ica.reset_counters()
+    fake_ica.add_purchase("2024-03-05", 10, "ICA Nära")
+    assert await history.async_update(api, 2024, 3)
+    assert fake_ica.calls["purchases"] == 1
+    assert history.summary()["monthly_spend"]["2024-03"] == 110.5
+    await api.async_close()
+
+
+async def test_month_change_finalizes_and_persists(hass, hass_storage, fake_ica):
+    fake_ica.add_purchase("2024-03-30", 10, "ICA Maxi")
+    api = ICAApi(hass, SESSION_ID)
+    history = PurchaseHistory(hass, "konto")
+    await history.async_update(api, 2024, 3)
+
+    # Efter månadsskiftet hämtas mars en sista gång, sedan bara april
+    fake_ica.reset_counters()
+    await history.async_update(api, 2024, 4)
+    assert fake_ica.calls["purchases"] == 2
+    fake_ica.reset_counters()
+    await history.async_update(api, 2024, 4)
+    assert fake_ica.calls["purchases"] == 1
+
+    # Cachen sparas fördröjt och överlever en omstart
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=PURCHASE_SAVE_DELAY + 5))
+    await hass.async_block_till_done()
+    assert f"{DOMAIN}.purchases.konto" in hass_storage
+    restored = PurchaseHistory(hass, "konto")
+    await restored.async_load()
+    assert restored.summary() == history.summary()
+    await api.async_close()
+
+
+async def test_forbidden_stops_backfill(hass, fake_ica):
+    fake_ica.fail("purchases", 403)
+    api = ICAApi(hass, SESSION_ID)
+    history = PurchaseHistory(hass, "konto")
+    assert not await history.async_update(api, 2024, 3)
+    assert fake_ica.calls["purchases"] == 1
+    await api.async_close()
+
+
+async def test_purchase_sensors(hass, fake_ica, keep, make_entry, setup_entry):
+    today = dt_util.now().strftime("%Y-%m-%d")
+    fake_ica.add_list(LIST_ID, "Veckohandling", ["mjölk"])
+    fake_ica.add_purchase(today, 200, "ICA Maxi")
+    fake_ica.add_purchase(today, 30, "ICA Nära")
+    entry = make_entry(purchase_sensors=True)
+    await setup_entry(entry)
+    await hass.data[DOMAIN][entry.entry_id]["purchases"].async_refresh()
+    await hass.async_block_till_done()
+
+    assert hass.states.get("sensor.ica_veckohandling_last_purchase").state == today
+    spend = hass.states.get("sensor.ica_veckohandling_monthly_spend")
+    assert float(spend.state) == 230
+    assert hass.states.get("sensor.ica_veckohandling_favorite_store").attributes["visits"] == {
+        "ICA Maxi": 1, "ICA Nära": 1,
+    }
@@ -0,0 +1,169 @@
+"""Avstämningslogiken i reconcile.py, plus hur den skalar med listans storlek."""
+import time
+
+import pytest
+
+from custom_components.ica_shopping.reconcile import (
+    keep_fingerprint,
+    list_after,
+    list_fingerprint,
+    normalize,
+    plan_bulk_add,
+    plan_bulk_remove,
+    plan_keep_to_ica,
+    plan_operations,
+    plan_refresh,
+    plan_three_way,
+    synced_snapshot,
+)
+
+
+def _rows(*texts, striked=()):
+    return [{"id": f"r{i}", "text": t, "isStriked": i in striked} for i, t in enumerate(texts)]
+
+
+def _keep(*texts, completed=()):
+    return [
+        {"uid": f"u{i}", "summary": t, "status": "completed" if i in completed else "needs_action"}
+        for i, t in enumerate(texts)
+    ]
+
+
+def _base(*texts):
+    return [{"key": normalize(t), "text": t, "row_id": None, "uid": None} for t in texts]
+
+
+def test_normalize():
+    assert normalize("  Mjölk ") == "mjölk"
+    assert normalize(None) == ""
+
+
+def test_plan_keep_to_ica_counts_duplicates_and_space():
+    assert plan_keep_to_ica(["mjölk", "Mjölk", "ägg"], _rows("mjölk"), space=10) == ["Mjölk", "ägg"]
+    assert plan_keep_to_ica(["a", "b", "c"], [], space=2) == ["a", "b"]
+    assert plan_keep_to_ica(["a"], [], space=0) == []
+
+
+def test_plan_keep_to_ica_base_keeps_ica_deletions():
+    # "ost" togs bort i ICA efter senaste synk – ska inte återuppstå
+    assert plan_keep_to_ica(["ost", "bröd"], [], space=10, base=_base("ost")) == ["bröd"]
+
+
+def test_plan_refresh_without_base():
+    plan = plan_refresh(
+        _rows("mjölk", "ägg"),
+        _keep("mjölk", "smör", "ost", completed={2}),
+        recent_removes={"ägg"},
+    )
+    assert plan.keep_add == []
+    assert plan.skipped == ["ägg"]
+    assert plan.keep_remove == ["smör"]
+    assert plan.keep_remove_completed == ["ost"]
+    assert sorted(plan.keep_remove_uids) == ["u1", "u2"]
+    assert plan.ica_remove == {"r1": ("ägg", "Keep-radering")}
+
+
+def test_plan_three_way_unchanged_is_empty():
+    texts = ("mjölk", "ägg", "ägg")
+    assert plan_three_way(_base(*texts), _rows(*texts), _keep(*texts)).is_empty
+
+
+def test_plan_three_way_changes_on_each_side():
+    plan = plan_three_way(
+        _base("mjölk", "ägg", "ost"),
+        _rows("mjölk", "ägg", "bröd"),   # ost borttagen, bröd tillagd i ICA
+        _keep("mjölk", "ost", "smör"),   # ägg borttaget, smör tillagt i Keep
+    )
+    assert plan.keep_add == ["bröd"]
+    assert plan.keep_remove == ["ost"]
+    assert plan.keep_remove_uids == ["u1"]
+    assert plan.ica_add == ["smör"]
+    assert plan.ica_remove == {"r1": ("ägg", "Keep-radering")}
+
+
+def test_plan_three_way_completed_removes_row():
+    plan = plan_three_way(_base("mjölk"), _rows("mjölk"), _keep("mjölk", completed={0}))
+    assert plan.ica_remove == {"r0": ("mjölk", "Keep: completed")}
+    assert plan.keep_remove_completed == ["mjölk"]
+    assert plan.keep_add == []
+
+
+def test_plan_three_way_respects_limits():
+    plan = plan_three_way(_base(), _rows("a", "b"), _keep("c", "d"), max_keep_add=1, ica_space=1)
+    assert len(plan.keep_add) == 1 and len(plan.ica_add) == 1
+
+
+def test_plan_operations():
+    ops = {"ägg": ("add", "Ägg"), "mjölk": ("complete", "mjölk"), "ost": ("remove", "ost"), "bröd": ("add", "bröd")}
+    to_add, to_remove, deferred = plan_operations(ops, _rows("mjölk", "bröd"), space=10)
+    assert to_add == ["Ägg"]
+    assert to_remove == {"r0": ("mjölk", "Keep: completed")}
+    assert not deferred
+
+    # Det som inte får plats skjuts upp i stället för att försvinna
+    to_add, _, deferred = plan_operations({**ops, "te": ("add", "te")}, _rows("mjölk", "bröd"), space=1)
+    assert to_add == ["Ägg"] and deferred == ["te"]
+
+
+def test_plan_bulk_add():
+    to_add, results = plan_bulk_add([" Kaffe", "mjölk", "kaffe", "", "ost", "bröd"], _rows("Mjölk"), space=2)
+    assert to_add == ["Kaffe", "ost"]
+    assert results == [None, "exists", "duplicate", "invalid", None, "list_full"]
+
+
+def test_plan_bulk_remove():
+    to_remove, results = plan_bulk_remove(["mjölk", "Mjölk", "ost"], _rows("mjölk", "ägg", "MJÖLK"))
+    assert to_remove == {"mjölk": ["r0", "r2"]}
+    assert results == [None, "duplicate", "not_found"]
+
+
+def test_snapshot_and_list_after():
+    rows = _rows("mjölk", "ägg")
+    snapshot = synced_snapshot(rows, _keep("mjölk"), removed_row_ids=["r1"], added_texts=["ost"])
+    assert [(e["key"], e["row_id"], e["uid"]) for e in snapshot] == [("mjölk", "r0", "u0"), ("ost", None, None)]
+
+    after = list_after({"id": "L", "rows": rows}, ["r1"], ["ost"])
+    assert [r["text"] for r in after["rows"]] == ["mjölk", "ost"]
+    assert len(rows) == 2  # originalet orört
+
+
+def test_snapshot_leaves_out_rows_not_mirrored():
+    """Rader som max_keep_add skar bort får inte hamna i basen och raderas sedan."""
+    rows = _rows("mjölk", "ägg", "ost")
+    plan = plan_refresh(rows, [], max_keep_add=1)
+    assert plan.keep_add == ["mjölk"]
+    base = synced_snapshot(rows, [], keep_added=plan.keep_add, keep_removed=plan.keep_remove_uids)
+    assert [e["key"] for e in base] == ["mjölk"]
+
+    follow_up = plan_three_way(base, rows, _keep("mjölk"))
+    assert not follow_up.ica_remove
+    assert sorted(follow_up.keep_add) == ["ost", "ägg"]
+
+
+def test_fingerprints():
+    the_list = {"id": "L", "name": "Min", "rows": _rows("a", "b")}
+    assert list_fingerprint(the_list) == list_fingerprint({**the_list, "rows": _rows("a", "b")})
+    assert list_fingerprint(the_list) != list_fingerprint({**the_list, "rows": _rows("a", "b", striked={1})})
+    assert keep_fingerprint(_keep("a", "b")) == keep_fingerprint(list(reversed(_keep("a", "b"))))
+    assert keep_fingerprint(_keep("a")) != keep_fingerprint(_keep("a", completed={0}))
+
+
+@pytest.mark.parametrize("size", [250, 1_000, 10_000])
+def test_plan_scaling(size, bench):
+    """Trevägsavstämningen ska vara linjär – 10k varor ska inte ta sekunder."""
+    texts = [f"vara {i % (size // 2)}" for i in range(size)]  # hälften dubbletter
+    base = _base(*texts)
+    rows = _rows(*texts[: size - 10], *[f"ny ica {i}" for i in range(10)])
+    keep = _keep(*texts[10:], *[f"ny keep {i}" for i in range(10)], completed=set(range(0, size, 50)))
+
+    started = time.perf_counter()
+    plan = plan_three_way(base, rows, keep)
+    three_way = time.perf_counter() - started
+
+    started = time.perf_counter()
+    plan_refresh(rows, keep, recent_removes={normalize(t) for t in texts[:10]})
+    two_way = time.perf_counter() - started
+
+    assert len(plan.keep_add) == 10
+    assert three_way < 2.0
+    bench(f"plan {size}", three_way_s=three_way, refresh_s=two_way)
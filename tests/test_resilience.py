@@ -0,0 +1,69 @@
+"""Circuit breaker, takt och backoff."""
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+
+from custom_components.ica_shopping.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateBudget,
+    backoff_delay,
+    parse_retry_after,
+)
+
+
+def test_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker("ica", threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    with patch("custom_components.ica_shopping.resilience.time.monotonic", return_value=time.monotonic() + 11):
+        assert breaker.state == "half_open"
+        breaker.before_request()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()  # bara ett testanrop åt gången
+        breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_retry_after_and_backoff():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("inte ett datum") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert backoff_delay(0, 0.5, 30, retry_after=100) == 30
+    assert all(0 <= backoff_delay(5, 0.5, 4) <= 4 for _ in range(50))
+
+
+async def test_rate_budget_limits_concurrency():
+    budget = RateBudget(max_concurrent=2, per_second=0)
+    running = peak = 0
+
+    async def work():
+        nonlocal running, peak
+        async with budget:
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(work() for _ in range(6)))
+    assert peak == 2
+
+
+async def test_rate_budget_paces_requests():
+    budget = RateBudget(max_concurrent=10, per_second=50)
+    started = time.monotonic()
+
+    async def work():
+        async with budget:
+            pass
+
+    await asyncio.gather(*(work() for _ in range(6)))
+    assert time.monotonic() - started >= 5 / 50 * 0.9
@@ -0,0 +1,77 @@
+"""Operationsloggen och debouncern för Keep → ICA."""
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
+
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.ica_shopping.sync_queue import (
+    OP_ADD,
+    OP_COMPLETE,
+    OP_REMOVE,
+    OperationLog,
+    SyncDebouncer,
+)
+
+
+def test_oplog_last_op_wins_and_add_remove_cancels():
+    log = OperationLog()
+    log.record(OP_ADD, " Mjölk ")
+    log.record(OP_REMOVE, "mjölk")
+    log.record(OP_REMOVE, "ost")
+    log.record(OP_COMPLETE, "Ost")
+    log.record(OP_ADD, "ägg")
+
+    ops, complete = log.drain()
+    assert ops == {"ost": (OP_COMPLETE, "Ost"), "ägg": (OP_ADD, "ägg")}
+    assert complete
+    assert len(log) == 0
+
+
+def test_oplog_remove_add_remove_keeps_remove():
+    log = OperationLog()
+    log.record(OP_REMOVE, "mjölk")
+    log.record(OP_ADD, "Mjölk")
+    log.record(OP_REMOVE, "mjölk")
+    # Ett add som ersatte en borttagning får inte ta ut nästa borttagning
+    ops, _ = log.drain()
+    assert ops == {"mjölk": (OP_REMOVE, "mjölk")}
+
+
+def test_oplog_incomplete():
+    log = OperationLog()
+    log.record(OP_ADD, "   ")
+    assert not log.complete
+    _, complete = log.drain()
+    assert not complete and log.complete
+
+
+async def test_debouncer_quiet_period_and_max_wait(hass):
+    clock = [100.0]
+    due = []
+
+    def fake_call_later(_hass, delay, _action):
+        due.append(clock[0] + delay)
+        return lambda: None
+
+    debouncer = SyncDebouncer(hass, quiet=1, max_wait=3, action=AsyncMock())
+    with patch("custom_components.ica_shopping.sync_queue.time.monotonic", lambda: clock[0]), \
+         patch("custom_components.ica_shopping.sync_queue.async_call_later", fake_call_later):
+        # Ett event per halvsekund skjuter upp körningen, men aldrig förbi max_wait
+        for _ in range(7):
+            debouncer.async_schedule()
+            clock[0] += 0.5
+    assert due[0] == 101.0
+    assert max(due) == 103.0
+    debouncer.async_cancel()
+
+
+async def test_debouncer_shorter_quiet_wins(hass):
+    action = AsyncMock()
+    debouncer = SyncDebouncer(hass, quiet=5, max_wait=10, action=action)
+    debouncer.async_schedule()
+    debouncer.async_schedule(quiet=0.5)
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=1))
+    await hass.async_block_till_done()
+    assert action.await_count == 1
+    debouncer.async_cancel()